@@ -1,48 +1,177 @@
 """
 Flight-Prof Lite: Allocation Engine (v1)
-- Reads cleaned fact tables from data_work/
-- Applies allocation weights from allocation_config.yaml
-- Writes fact_route_economics.csv to data_work/
+- Reads cleaned fact tables from the data_work/ fact store (carrier x month partitions)
+- Applies allocation weights from allocation_config.yaml, per carrier-month against that
+  carrier's own Form 41 totals
+- Cost buckets (the four Form 41 sections plus any under `buckets:`) compile to one
+  drivers x buckets weight matrix; every bucket of every row is allocated by a single
+  (rows x drivers shares) @ (drivers x buckets) product scaled by the bucket totals
+- Writes the carrier-month fact_route_economics partitions to data_work/
 """
+from dataclasses import dataclass
 from pathlib import Path
 import pandas as pd
 import numpy as np
-import yaml
+import delta
+import fact_store
+import instrument
+from utils import load_config, month_key, month_label
 
-CONFIG = Path("allocation_config.yaml")
 DATA_WORK = Path("data_work")
 
-def load_config():
-    with open(CONFIG, "r") as f:
-        return yaml.safe_load(f)
+# every allocation is one carrier's month against that carrier's own Form 41 totals
+PERIOD = ["carrier", "month"]
 
-def load_inputs():
+FARE_COLS = ["carrier", "month", "origin", "dest", "yield_est", "avg_fare", "pax"]
+
+def fare_table(cfg=None):
+    """Segment yields prorated from DB1B itineraries (prorate.py) when built, unless
+       `fares.yields: od` keeps the DB1B O&D join."""
+    yields = ((cfg or load_config()).get("fares") or {}).get("yields", "prorated")
+    if yields == "prorated" and fact_store.exists("fact_segment_fares"):
+        return "fact_segment_fares"
+    return "fact_fares"
+
+def load_inputs(months=None, carriers=None, fare_cols=FARE_COLS):
     # expected columns:
-    # seg:  month, origin, dest, fleet_type, departures, block_hours, ASMs, RPMs, pax
-    # fin:  month, fuel_expense, labor_expense, maint_expense, station_other, fuel_gallons
-    # fare: month, origin, dest, yield_est, avg_fare, pax
-    seg = pd.read_csv(DATA_WORK / "fact_segments.csv")
-    fin = pd.read_csv(DATA_WORK / "fact_financials.csv")
-    fares = pd.read_csv(DATA_WORK / "fact_fares.csv")
+    # seg:  carrier, month, origin, dest, fleet_type, departures, block_hours, ASMs, RPMs, pax
+    # fin:  carrier, month, fuel_expense, labor_expense, maint_expense, station_other, fuel_gallons
+    # fare: carrier, month, origin, dest, yield_est, avg_fare, pax (per segment or per O&D)
+    seg = fact_store.read("fact_segments", months=months, carriers=carriers)
+    fin = fact_store.read("fact_financials", months=months, carriers=carriers)
+    fares = fact_store.read(fare_table(), months=months, carriers=carriers, columns=fare_cols)
     return seg, fin, fares
 
-def allocate(month: str):
-    cfg = load_config()
-    seg, fin, fares = load_inputs()
+def periods(df):
+    """Set of (carrier, month key) pairs present in df."""
+    p = df[PERIOD].drop_duplicates()
+    return set(zip(p["carrier"].astype(str), p["month"].astype(int)))
+
+def with_financials(seg, fin):
+    """Rows of seg whose carrier-month has Form 41 totals."""
+    hit = seg[PERIOD].merge(fin[PERIOD].drop_duplicates(), on=PERIOD, how="left", indicator=True)
+    return seg[(hit["_merge"] == "both").to_numpy()]
+
+def by_period(df):
+    """{(carrier, month key): rows} for every carrier-month in df."""
+    return {(str(c), int(m)): g for (c, m), g in df.groupby(PERIOD, observed=True, sort=False)}
+
+OUT_COLS = [
+    "carrier", "month", "origin", "dest", "fleet_type", "departures", "block_hours",
+    "ASMs", "RPMs", "pax",
+    "revenue", "rasm",
+    "fuel_cost", "labor_cost", "maint_cost", "station_cost",
+    "total_cost", "casm", "margin", "margin_per_ASM"
+]
+
+# --- cost buckets ---
+# columns a bucket can be spread by; fuel_driver is the fuel section's driver (block_hours)
+# times the fleet's burn rate
+DRIVERS = ["fuel_driver", "block_hours", "departures", "pax", "ASMs", "RPMs", "revenue"]
+# the Form 41 buckets keep their own config sections: bucket -> (cost column, Form 41 column)
+CORE_BUCKETS = {
+    "fuel":          ("fuel_cost", "fuel_expense"),
+    "labor":         ("labor_cost", "labor_expense"),
+    "maintenance":   ("maint_cost", "maint_expense"),
+    "station_other": ("station_cost", "station_other"),
+}
+
+@dataclass
+class Buckets:
+    names: list       # bucket names, output order
+    costs: list       # allocated cost column per bucket (always "..._cost")
+    expense: list     # per bucket {fact_financials column: fraction of it}
+    drivers: list     # driver columns with a weight in any bucket
+    W: np.ndarray     # drivers x buckets
+
+def compile_buckets(cfg):
+    """Buckets from the config. Core sections may set `expense: {column: fraction}` to hand
+       part of their Form 41 line to an extra bucket, e.g.
+         buckets:
+           landing: {expense: {station_other: 0.3}, weights: {departures: 1.0}}"""
+    defs = {"fuel": {"weights": {"fuel_driver": 1.0}}}
+    for b in ("labor", "maintenance", "station_other"):
+        defs[b] = {"weights": cfg[b]["weights"]}
+    for b, (cost, col) in CORE_BUCKETS.items():
+        defs[b].update(cost=cost, expense=(cfg.get(b) or {}).get("expense", col))
+    for b, d in (cfg.get("buckets") or {}).items():
+        if b in defs:
+            raise ValueError(f"buckets: {b!r} is a Form 41 bucket; configure it in its own section")
+        defs[b] = {"cost": d.get("cost", f"{b}_cost"), "expense": d["expense"], "weights": d["weights"]}
+
+    for b, d in defs.items():
+        if not d["cost"].endswith("_cost") or d["cost"] == "total_cost":
+            raise ValueError(f"bucket {b!r}: cost column {d['cost']!r} must end in _cost")
+        bad = set(d["weights"]) - set(DRIVERS)
+        if bad:
+            raise ValueError(f"bucket {b!r}: unknown drivers {sorted(bad)}; have {DRIVERS}")
+        if isinstance(d["expense"], str):
+            d["expense"] = {d["expense"]: 1.0}
+    costs = [d["cost"] for d in defs.values()]
+    if len(set(costs)) < len(costs):
+        raise ValueError(f"bucket cost columns are not unique: {costs}")
+
+    drivers = [k for k in DRIVERS if any(k in d["weights"] for d in defs.values())]
+    W = np.array([[float(d["weights"].get(k, 0.0)) for d in defs.values()] for k in drivers],
+                 dtype=float).reshape(len(drivers), len(defs))
+    return Buckets(list(defs), costs, [{c: float(f) for c, f in d["expense"].items()} for d in defs.values()],
+                   drivers, W)
+
+def bucket_costs(df):
+    """The allocated bucket cost columns of an allocation frame, in column order."""
+    return [c for c in df.columns if c.endswith("_cost") and c != "total_cost"]
+
+def burn_rates(fleet_type, cfg):
+    """Per-row burn rate for a fleet_type Series; unknown fleets get the lowest configured rate."""
+    burn = cfg["fuel"]["burn_rate_hr"]  # e.g., {"B737-700": 850, ...}
+    default_burn = min(burn.values()) if len(burn) else 1.0
+    if isinstance(fleet_type.dtype, pd.CategoricalDtype):
+        # look up once per dictionary entry, then gather by code
+        rates = np.append(fleet_type.cat.categories.map(lambda f: burn.get(f, default_burn)).to_numpy(float),
+                          default_burn)
+        return pd.Series(rates[fleet_type.cat.codes.to_numpy()], index=fleet_type.index)
+    return fleet_type.map(burn).fillna(default_burn)
+
+def driver_shares(df, x):
+    """Row shares of the driver columns x (rows x drivers) within each carrier-month
+       (0 where the total is 0)."""
+    tot = (pd.DataFrame(x, index=df.index).groupby([df[c] for c in PERIOD], observed=True)
+             .transform("sum").to_numpy())
+    return np.divide(x, tot, out=np.zeros_like(x), where=tot > 0)
 
-    # --- filter this month ---
-    segm = seg[seg["month"] == month].copy()
-    finm = fin[fin["month"] == month].iloc[0]
-    faresm = fares[fares["month"] == month].copy()
+def mix(shares, W):
+    """shares @ W, each bucket summed over its nonzero weights in driver order, so it rounds
+       like a plain weighted sum of shares (BLAS may fuse the multiply-adds and move the
+       last bit). -> rows x buckets"""
+    S = np.ascontiguousarray(shares.T)
+    out = np.zeros((W.shape[1], len(shares)))
+    for j in range(W.shape[1]):
+        for k in np.flatnonzero(W[:, j]):
+            out[j] += W[k, j] * S[k]
+    return out.T
 
-    # --- merge fares by month+OD (IMPORTANT) ---
+@instrument.traced("allocation.compute")
+def allocate_frame(seg, fin, fares, cfg):
+    """Allocate every carrier-month present in seg against its own financials.
+       All driver sums are per carrier-month grouped sums, so one call covers any number
+       of carriers and months."""
+    segm = seg.copy()
+
+    # --- merge fares by carrier+month+segment (prorated) or +OD (IMPORTANT) ---
     segm = segm.merge(
-        faresm[["month", "origin", "dest", "yield_est", "avg_fare", "pax"]],
-        on=["month", "origin", "dest"],
+        fares[["carrier", "month", "origin", "dest", "yield_est", "avg_fare", "pax"]],
+        on=["carrier", "month", "origin", "dest"],
         how="left",
         suffixes=("", "_fare"),
     )
 
+    # bucket totals aligned row-for-row with segm
+    fin = segm[PERIOD].merge(fin.drop_duplicates(PERIOD), on=PERIOD, how="left", indicator=True)
+    missing = fin.loc[fin["_merge"] == "left_only", PERIOD].drop_duplicates()
+    if len(missing):
+        raise KeyError(f"No fact_financials for carrier-months "
+                       f"{sorted(zip(missing['carrier'].astype(str), missing['month'].map(month_label)))}")
+
     # --- revenue & RASM ---
     # fallback yield of 12.5¢/RPM if missing
     segm["yield_est"] = segm["yield_est"].fillna(0.125)
@@ -52,72 +181,130 @@ def allocate(month: str):
     segm["revenue"] = segm["RPMs"] * segm["yield_est"]
     segm["rasm"] = np.where(segm["ASMs"] > 0, segm["revenue"] / segm["ASMs"], np.nan)
 
-    # --- fuel allocation: block_hours * burn_rate per fleet ---
-    burn = cfg["fuel"]["burn_rate_hr"]  # e.g., {"B737-700": 850, ...}
-    default_burn = min(burn.values()) if len(burn) else 1.0
-    segm["burn_rate_hr"] = segm["fleet_type"].map(burn).fillna(default_burn)
-    segm["block_hours"] = segm["block_hours"].fillna(0.0)
-
-    segm["fuel_driver"] = segm["block_hours"] * segm["burn_rate_hr"]
-    fuel_driver_sum = segm["fuel_driver"].sum()
-    segm["fuel_share"] = np.where(fuel_driver_sum > 0, segm["fuel_driver"] / fuel_driver_sum, 0.0)
-    segm["fuel_cost"] = segm["fuel_share"] * float(finm["fuel_expense"])
-
-    # --- labor allocation: 0.7 block_hours + 0.3 departures ---
-    lw = cfg["labor"]["weights"]  # {"block_hours": 0.7, "departures": 0.3}
-    segm["departures"] = segm["departures"].fillna(0.0)
-    bh_sum = segm["block_hours"].sum()
-    dp_sum = segm["departures"].sum()
-    bh_share = np.where(bh_sum > 0, segm["block_hours"] / bh_sum, 0.0)
-    dep_share = np.where(dp_sum > 0, segm["departures"] / dp_sum, 0.0)
-
-    segm["labor_share"] = lw.get("block_hours", 0.0) * bh_share + lw.get("departures", 0.0) * dep_share
-    segm["labor_cost"] = segm["labor_share"] * float(finm["labor_expense"])
-
-    # --- maintenance allocation: (default) block_hours (optionally + departures) ---
-    mw = cfg["maintenance"]["weights"]  # e.g., {"block_hours": 1.0}
-    segm["maint_share"] = mw.get("block_hours", 0.0) * bh_share + mw.get("departures", 0.0) * dep_share
-    segm["maint_cost"] = segm["maint_share"] * float(finm["maint_expense"])
-
-    # --- station/other: 0.5 departures + 0.5 pax ---
-    sw = cfg["station_other"]["weights"]  # {"departures": 0.5, "pax": 0.5}
-    segm["pax"] = segm["pax"].fillna(0.0)
-    pax_sum = segm["pax"].sum()
-    pax_share = np.where(pax_sum > 0, segm["pax"] / pax_sum, 0.0)
-
-    segm["station_share"] = sw.get("departures", 0.0) * dep_share + sw.get("pax", 0.0) * pax_share
-    segm["station_cost"] = segm["station_share"] * float(finm["station_other"])
-
-    # --- totals & KPIs ---
-    segm["total_cost"] = segm[["fuel_cost", "labor_cost", "maint_cost", "station_cost"]].sum(axis=1)
+    # --- costs: every bucket in one (rows x drivers) @ (drivers x buckets) product ---
+    b = compile_buckets(cfg)
+    for c in ["block_hours", "departures", "pax"]:
+        segm[c] = segm[c].fillna(0.0)
+    x = {c: segm[c].to_numpy(float) for c in DRIVERS if c != "fuel_driver"}
+    x["fuel_driver"] = (segm[cfg["fuel"].get("driver", "block_hours")].to_numpy(float)
+                        * burn_rates(segm["fleet_type"], cfg).to_numpy(float))
+    shares = driver_shares(segm, np.column_stack([x[k] for k in b.drivers]))
+    totals = np.column_stack([sum(f * fin[c].to_numpy(float) for c, f in e.items()) for e in b.expense])
+    cost = mix(shares, b.W) * totals
+
+    segm = segm.assign(**dict(zip(b.costs, cost.T)))
+    return add_totals(segm)[OUT_COLS[:12] + b.costs + OUT_COLS[16:]]
+
+def add_totals(segm):
+    """total_cost, CASM, margin and margin/ASM from the bucket costs (in place)."""
+    segm["total_cost"] = segm[bucket_costs(segm)].sum(axis=1)
     segm["casm"] = np.where(segm["ASMs"] > 0, segm["total_cost"] / segm["ASMs"], np.nan)
     segm["margin"] = segm["revenue"] - segm["total_cost"]
     segm["margin_per_ASM"] = np.where(segm["ASMs"] > 0, segm["margin"] / segm["ASMs"], np.nan)
+    return segm
 
-    out_cols = [
-        "month", "origin", "dest", "fleet_type", "departures", "block_hours",
-        "ASMs", "RPMs", "pax",
-        "revenue", "rasm",
-        "fuel_cost", "labor_cost", "maint_cost", "station_cost",
-        "total_cost", "casm", "margin", "margin_per_ASM"
-    ]
-    DATA_WORK.mkdir(exist_ok=True)
-    segm[out_cols].to_csv(DATA_WORK / "fact_route_economics.csv", index=False)
-    print(f"Wrote {DATA_WORK/'fact_route_economics.csv'} with {len(segm)} rows for {month}")
+def _reconcile(out, fin, cfg, carriers=None, months=None):
+    """Tie the fresh allocation out to Form 41 in memory, then write it and the report as
+       the whole of carriers x months (None: all): carrier-months in that scope that no
+       longer allocate (segments or financials gone upstream) are dropped."""
+    import reconcile
+    if len(out):
+        out, report = reconcile.reconcile_frame(out, fin, cfg)
+        reconcile.summarize(report, cfg)
+    else:
+        report = out[PERIOD]
+    fact_store.write(out, "fact_route_economics", overwrite=True, carriers=carriers, months=months)
+    fact_store.write(report, "fact_reconciliation", overwrite=True, carriers=carriers, months=months)
+    reconcile.record(periods(out))
+    return out
+
+def _allocate_job(seg, fin, fares, cfg):
+    """Pool entry point: one carrier-month's allocation plus this worker's profiling spans."""
+    return allocate_frame(seg, fin, fares, cfg), instrument.drain()
+
+@instrument.traced("allocation")
+def allocate(month: str, carriers=None):
+    cfg = load_config()
+    seg, fin, fares = load_inputs([month], carriers)
+    if month_key(month) not in set(fin["month"]):
+        raise KeyError(f"No fact_financials for {month}")
+    skipped = sorted(periods(seg) - periods(fin))
+    if skipped:
+        print(f"Skipping carriers without financials for {month}: {[c for c, _ in skipped]}")
+
+    out = allocate_frame(with_financials(seg, fin), fin, fares, cfg)
+    out = _reconcile(out, fin, cfg, carriers, [month])
+    print(f"Wrote {DATA_WORK/'fact_route_economics'} with {len(out)} rows for {month} "
+          f"(carriers: {sorted(c for c, _ in periods(out))})")
+    return out
+
+@instrument.traced("allocation")
+def allocate_months(months=None, workers=1, carriers=None, append=False):
+    """Batch mode: load config + inputs once, allocate every requested carrier-month
+       (default: all with both segments and financials) into one table.
+       append: only months whose segments, financials or fares partitions changed since the
+       last batch (delta.py); any config change re-allocates everything."""
+    cfg = load_config()
+    tables = ("fact_segments", "fact_financials", fare_table(cfg))
+    version = {"carriers": carriers, "config": cfg}
+    entry = delta.load("allocation", version) if append else None
+    if entry is not None:
+        stale = {m for t in tables for _, m in delta.stale_inputs(entry, t, carriers)}
+        months = sorted(stale & {month_label(m) for m in months} if months else stale)
+        if not months:
+            print(f"{DATA_WORK/'fact_route_economics'} up to date")
+            return None
+    seg, fin, fares = load_inputs(months, carriers)
+    todo = sorted(periods(seg) & periods(fin))
+    skipped = [f"{c}:{month_label(m)}" for c, m in sorted((periods(seg) | periods(fin)) - set(todo))]
+    skipped += [month_label(m) for m in
+                sorted(({month_key(m) for m in months} if months else set()) - {m for _, m in todo})]
+    if skipped:
+        print(f"Skipping carrier-months without segments/financials: {skipped}")
+    seg = with_financials(seg, fin)
+
+    if not todo:
+        out = seg.iloc[0:0]
+    elif workers and workers > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        s, f, fa = by_period(seg), by_period(fin), by_period(fares)
+        parts = [(s[k], f[k], fa.get(k, fares.iloc[0:0]), cfg) for k in todo]
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as ex:
+            outs = []
+            for part, events in ex.map(_allocate_job, *zip(*parts)):
+                outs.append(part); instrument.absorb(events)
+        out = pd.concat(outs, ignore_index=True)
+    else:
+        out = allocate_frame(seg, fin, fares, cfg)
+
+    out = _reconcile(out, fin, cfg, carriers, months)
+    delta.save("allocation", version, inputs=delta.recorded_inputs(entry, tables, carriers, months))
+    ms = sorted({m for _, m in todo})
+    print(f"Wrote {DATA_WORK/'fact_route_economics'} with {len(out)} rows for "
+          f"{len(todo)} carrier-months (carriers: {sorted({c for c, _ in todo})}, "
+          f"{month_label(ms[0]) if ms else '-'}..{month_label(ms[-1]) if ms else '-'})")
+    return out
 
 if __name__ == "__main__":
     import argparse
-    import shutil
+    from utils import parse_carriers, parse_months
 
     p = argparse.ArgumentParser()
-    p.add_argument("--month", required=True, help="YYYY-MM")
-    p.add_argument("--use-shocked", action="store_true",
-                   help="Use data_work/fact_financials_shocked.csv if present")
+    g = p.add_mutually_exclusive_group(required=True)
+    g.add_argument("--month", help="YYYY-MM")
+    g.add_argument("--months", help="YYYY-MM..YYYY-MM range or comma list")
+    g.add_argument("--all-months", action="store_true",
+                   help="Allocate every month with segments and financials")
+    p.add_argument("--workers", type=int, default=1,
+                   help="Process pool size for batch mode (default: 1, in-process)")
+    p.add_argument("--carriers", help="comma list of carriers (default: all in the fact tables)")
+    p.add_argument("--append", action="store_true",
+                   help="batch mode: only months whose inputs changed since the last batch")
     args = p.parse_args()
+    months = [args.month] if args.month else (parse_months(args.months) if args.months else None)
+    carriers = parse_carriers(args.carriers)
 
-    # Optionally swap in shocked financials for this run (non-destructive: copy-over)
-    if args.use_shocked and (DATA_WORK / "fact_financials_shocked.csv").exists():
-        shutil.copyfile(DATA_WORK / "fact_financials_shocked.csv", DATA_WORK / "fact_financials.csv")
-        print("Using shocked financials for allocation…")
-
-    allocate(args.month)
+    if args.month:
+        allocate(args.month, carriers)
+    else:
+        allocate_months(months, workers=args.workers, carriers=carriers, append=args.append)
@@ -0,0 +1,142 @@
+"""
+Scaling benchmark for the whole pipeline
+- generates synthetic raw data per scale (synth_data.py) under a scratch root
+- runs every stage of pipeline.build_dag (all carriers, synthetic flights, a sqlite
+  warehouse) plus the QA rules, each in a fresh child process in DAG order, and records
+  wall time, CPU time, output rows and two peaks: the stage process's own RSS and the
+  largest of its pool workers' (separate maxima; their sum would not be a peak)
+- saves results as JSON; --baseline compares against a stored run and exits 1 when
+  a stage regresses past --threshold (relative) and --min-seconds (absolute)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+
+import pipeline
+import synth_data
+from utils import CONFIG
+
+WAREHOUSE = "sqlite:///data_work/warehouse.db"
+EXTRA = ["qa"]        # after the pipeline stages; not part of the DAG
+
+def _dag(files):
+    """The pipeline's stage table over a generated data_raw/ (already in DAG order)."""
+    return pipeline.build_dag(files["t100"], files["p12a"], files["p52"], [files["db1b"]],
+                              carriers="all", flights=[], warehouse=WAREHOUSE)
+
+def stages(files):
+    return [s.name for s in _dag(files)] + EXTRA
+
+def _stage(name, files):
+    """Run one stage; -> the fact table it writes first (None: files only)."""
+    if name == "qa":
+        from qa_tests import run_basic_checks
+        run_basic_checks()
+        return None
+    s = {s.name: s for s in _dag(files)}[name]
+    getattr(pipeline, s.run)(s.params)
+    tables = [Path(p).name for p in s.outputs if Path(p).parent == pipeline.WORK]
+    return tables[0] if tables else None
+
+def _measure(root, name, files):
+    """Runs in a fresh child: chdir to the scratch root, run one stage, report metrics."""
+    os.chdir(root)
+    sys.stdout = open(os.devnull, "w")
+    t0, c0 = time.perf_counter(), time.process_time()
+    table = _stage(name, files)
+    wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+    rows = None
+    if table:
+        import fact_store
+        rows = len(fact_store.read(table, columns=["month"]))
+    # ru_maxrss is in KiB on Linux; RUSAGE_CHILDREN is the largest single reaped worker
+    return {"wall_s": wall, "cpu_s": cpu,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0,
+            "rows_out": rows}
+
+def run_scale(scale, root, seed=0, only=None):
+    root = Path(root) / scale
+    root.mkdir(parents=True, exist_ok=True)
+    params = synth_data.SCALES[scale]
+    t0 = time.perf_counter()
+    files = synth_data.generate(root, seed=seed, **params)
+    gen_s = time.perf_counter() - t0
+    raw_mb = sum(p.stat().st_size for p in (root / "data_raw").glob("*.csv")) / 2**20
+    (root / "docs").mkdir(exist_ok=True)
+    shutil.copyfile(CONFIG, root / CONFIG.name)
+
+    done = {}
+    for name in stages(files):
+        if only and name not in only:
+            continue
+        with ProcessPoolExecutor(max_workers=1) as ex:
+            done[name] = ex.submit(_measure, str(root.resolve()), name, files).result()
+        s = done[name]
+        print(f"  {scale:<7} {name:<11} {s['wall_s']:8.2f}s wall {s['cpu_s']:8.2f}s cpu "
+              f"{s['peak_rss_mb']:8.0f} MB (workers {s['worker_peak_rss_mb']:.0f} MB)  rows={s['rows_out']}")
+    return {"params": params, "raw_mb": raw_mb, "generate_s": gen_s, "stages": done}
+
+def compare(results, baseline, threshold=0.25, min_seconds=0.5, mem_threshold=0.5):
+    """List of regressions (scale, stage, metric, base, now) past the thresholds."""
+    bad = []
+    for scale, r in results["scales"].items():
+        b = baseline.get("scales", {}).get(scale)
+        if not b:
+            continue
+        for stage, s in r["stages"].items():
+            bs = b["stages"].get(stage)
+            if not bs:
+                continue
+            if s["wall_s"] > bs["wall_s"] * (1 + threshold) and s["wall_s"] - bs["wall_s"] > min_seconds:
+                bad.append((scale, stage, "wall_s", bs["wall_s"], s["wall_s"]))
+            for m in ("peak_rss_mb", "worker_peak_rss_mb"):
+                # a worker peak of 0 is a stage without a pool
+                if m in bs and bs[m] and s[m] > bs[m] * (1 + mem_threshold):
+                    bad.append((scale, stage, m, bs[m], s[m]))
+    return bad
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--scales", nargs="+", default=["tiny", "small"], choices=synth_data.SCALES)
+    p.add_argument("--root", default="data_work/bench", help="scratch dir for generated data")
+    p.add_argument("--out", default="data_work/bench/results.json")
+    p.add_argument("--baseline", help="JSON from an earlier run to check for regressions")
+    p.add_argument("--save-baseline", help="also write this run to the given baseline path")
+    p.add_argument("--threshold", type=float, default=0.25, help="allowed relative wall-time slowdown")
+    p.add_argument("--min-seconds", type=float, default=0.5, help="ignore slowdowns smaller than this")
+    p.add_argument("--mem-threshold", type=float, default=0.5, help="allowed relative peak-RSS growth")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--stages", nargs="+", help="only these stages (default: every pipeline stage, then qa); "
+                                                "their upstream stages must be included or already built")
+    args = p.parse_args()
+
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "host": {"python": platform.python_version(), "machine": platform.machine(),
+                        "cpus": os.cpu_count()},
+               "scales": {}}
+    for scale in args.scales:
+        results["scales"][scale] = run_scale(scale, args.root, seed=args.seed, only=args.stages)
+
+    for path in [args.out, args.save_baseline]:
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_text(json.dumps(results, indent=2))
+            print(f"Wrote {path}")
+
+    if args.baseline:
+        bad = compare(results, json.loads(Path(args.baseline).read_text()),
+                      args.threshold, args.min_seconds, args.mem_threshold)
+        for scale, stage, metric, was, now in bad:
+            print(f"REGRESSION {scale}/{stage} {metric}: {was:.2f} -> {now:.2f}")
+        if bad:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
@@ -1,54 +1,89 @@
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import distances
+import fact_store
+import instrument
+import schema
+from allocation import PERIOD
+from utils import month_key, month_label
 
 DATA = Path("data_work")
 DOCS = Path("docs"); DOCS.mkdir(exist_ok=True)
 
-def main(month="2023-07"):
-    econ = pd.read_csv(DATA/"fact_route_economics.csv")
-    m = econ[econ["month"]==month].copy()
+# Broad 250-mile-ish bins on stage length to keep sample sizes healthy
+BINS = [-1, 250, 500, 750, 1000, 1500, 2000, 3000, 5000]
+LABELS = ["<250","250-500","500-750","750-1000","1000-1500","1500-2000","2000-3000","3000-5000"]
 
-    # Top/bottom routes by margin
-    m.sort_values("margin", ascending=False).head(20).to_csv(DOCS/"top20_routes.csv", index=False)
-    m.sort_values("margin", ascending=True).head(20).to_csv(DOCS/"bottom20_routes.csv", index=False)
+def stage_bins(econ):
+    """Great-circle OD miles (distances.py), binned. Where an airport has no coordinates (or
+       there is no coordinates file) the distance proxy carried from the segment stage is used:
+       avg pax-miles per passenger (Σ RPMs / Σ pax per carrier+month+OD across fleets)."""
+    g = econ.groupby(PERIOD + ["origin","dest"], observed=True)
+    rpm, pax = g["RPMs"].transform("sum"), g["pax"].transform("sum")
+    miles = rpm.where(pax > 0) / pax.where(pax > 0)
+    gc = distances.great_circle(econ["origin"], econ["dest"])
+    return pd.cut(miles.where(np.isnan(gc), gc), bins=BINS, labels=LABELS)
 
-    # Build an average distance proxy from T-100: avg pax-miles per passenger (RPMs/pax)
-    seg = pd.read_csv(DATA/"fact_segments.csv", dtype={"origin":str,"dest":str})
-    seg_mkt = (seg[seg["month"]==month]
-               .groupby(["month","origin","dest"], as_index=False)
-               .agg(RPMs=("RPMs","sum"), pax=("pax","sum"), ASMs=("ASMs","sum")))
+def bin_cube(econ):
+    """carrier x month x stage_bin: ASM-weighted RASM/CASM as ratios of grouped sums.
+       Every bin is listed for each carrier-month, empty ones with 0 routes."""
+    w = econ["ASMs"].where(econ["ASMs"] > 0, 0.0)
+    e = pd.DataFrame({
+        "carrier": econ["carrier"], "month": econ["month"], "stage_bin": stage_bins(econ), "ASMs": w,
+        "revenue": econ["revenue"].where(w > 0, 0.0), "total_cost": econ["total_cost"].where(w > 0, 0.0),
+    })
+    g = (e.groupby(PERIOD + ["stage_bin"], observed=True)
+          .agg(ASMs=("ASMs","sum"), revenue=("revenue","sum"), total_cost=("total_cost","sum"),
+               routes=("ASMs","size")))
+    full = pd.MultiIndex.from_tuples(
+        [(c, m, b) for c, m in e[PERIOD].drop_duplicates().sort_values(PERIOD).itertuples(index=False)
+         for b in LABELS], names=PERIOD + ["stage_bin"])
+    g = g.reindex(full, fill_value=0).reset_index()
+    g["stage_bin"] = pd.Categorical(g["stage_bin"], categories=LABELS, ordered=True)
+    g["asm_m"] = g["ASMs"] / 1e6
+    g["rasm"] = g["revenue"].where(g["ASMs"] > 0) / g["ASMs"].where(g["ASMs"] > 0)
+    g["casm"] = g["total_cost"].where(g["ASMs"] > 0) / g["ASMs"].where(g["ASMs"] > 0)
+    return g[PERIOD + ["stage_bin","asm_m","rasm","casm","routes"]]
 
-    seg_mkt["avg_pax_miles"] = np.where(seg_mkt["pax"]>0, seg_mkt["RPMs"]/seg_mkt["pax"], np.nan)
+def top_bottom(econ, n=20):
+    """Per carrier-month top/bottom n routes by margin."""
+    g = econ.groupby(PERIOD, observed=True)["margin"]
+    top = econ.loc[g.nlargest(n).index.get_level_values(-1)]
+    bottom = econ.loc[g.nsmallest(n).index.get_level_values(-1)]
+    return top.reset_index(drop=True), bottom.reset_index(drop=True)
 
-    # Join the proxy to economics and create bins (250-mile buckets)
-    mm = m.merge(seg_mkt[["origin","dest","avg_pax_miles","ASMs"]],
-                 on=["origin","dest"], how="left")
+@instrument.traced("memo")
+def main(month=None, months=None, n=20, carriers=None):
+    econ = fact_store.read("fact_route_economics", months=months, carriers=carriers)
+    month = month_key(month) if month else (econ["month"].max() if len(econ) else None)
 
-    # Bin by avg_pax_miles; use broad bins to keep sample sizes healthy
-    bins = [-1, 250, 500, 750, 1000, 1500, 2000, 3000, 5000]
-    labels = ["<250","250-500","500-750","750-1000","1000-1500","1500-2000","2000-3000","3000-5000"]
-    mm["stage_bin"] = pd.cut(mm["avg_pax_miles"], bins=bins, labels=labels)
+    with instrument.span("memo.topn", rows_in=len(econ)):
+        top, bottom = top_bottom(econ, n)
+    with instrument.span("memo.cube", rows_in=len(econ)):
+        cube = bin_cube(econ)
 
-    # ASM-weighted CASM/RASM by bin
-    def wavg(s, w):
-        s = s.astype(float); w = w.fillna(0.0).astype(float)
-        mask = (w>0) & np.isfinite(s)
-        return (s[mask]*w[mask]).sum()/w[mask].sum() if mask.any() else np.nan
+    # all months (docs keep YYYY-MM labels)
+    schema.labels(top).to_csv(DOCS/f"top{n}_routes_by_month.csv", index=False)
+    schema.labels(bottom).to_csv(DOCS/f"bottom{n}_routes_by_month.csv", index=False)
+    schema.labels(cube).to_csv(DOCS/"asm_bins_by_month.csv", index=False)
 
-
-    agg = (mm.groupby("stage_bin", observed=False)
-            .apply(lambda x: pd.Series({
-                "asm_m": x["ASMs"].sum()/1e6 if "ASMs" in x else np.nan,
-                "rasm":  wavg(x["rasm"], x.get("ASMs", pd.Series(index=x.index, data=np.nan))),
-                "casm":  wavg(x["casm"], x.get("ASMs", pd.Series(index=x.index, data=np.nan))),
-                "routes": len(x)
-            }), include_groups=False)  
-            .reset_index())
-
-
-    agg.to_csv(DOCS/"asm_bins_rasm_casm.csv", index=False)
-    print("Wrote: docs/top20_routes.csv, docs/bottom20_routes.csv, docs/asm_bins_rasm_casm.csv")
+    # memo month
+    schema.labels(top[top["month"]==month]).to_csv(DOCS/f"top{n}_routes.csv", index=False)
+    schema.labels(bottom[bottom["month"]==month]).to_csv(DOCS/f"bottom{n}_routes.csv", index=False)
+    cube[cube["month"]==month].drop(columns="month").to_csv(DOCS/"asm_bins_rasm_casm.csv", index=False)
+    print(f"Wrote: docs/top{n}_routes.csv, docs/bottom{n}_routes.csv, docs/asm_bins_rasm_casm.csv "
+          f"({month_label(month) if month else '-'}) "
+          f"+ *_by_month.csv for {econ['month'].nunique()} months x {econ['carrier'].nunique()} carriers")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    from utils import parse_carriers, parse_months
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--month", help="YYYY-MM for the memo tables (default: latest)")
+    p.add_argument("--months", help="YYYY-MM..YYYY-MM or comma list for the cubes (default: all)")
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--carriers", help="comma list of carriers (default: all)")
+    args = p.parse_args()
+    main(args.month, parse_months(args.months) if args.months else None, args.top, parse_carriers(args.carriers))
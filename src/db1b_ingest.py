@@ -2,6 +2,11 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import re
+import delta
+import fact_store
+import instrument
+import schema
+from utils import parse_carriers
 
 RAW  = Path("data_raw")
 WORK = Path("data_work"); WORK.mkdir(exist_ok=True)
@@ -15,117 +20,211 @@ def _first(df, candidates):
         if c in df.columns: return c
     raise KeyError(f"Missing any of {candidates}. Have: {list(df.columns)[:25]}")
 
-def _q_to_months(q):
-    return {1:[1,2,3], 2:[4,5,6], 3:[7,8,9], 4:[10,11,12]}[int(q)]
+CHUNK_ROWS = 1_000_000
+KEYS = ["carrier","year","qtr","origin","dest"]
+MKT  = ["carrier","month","origin","dest"]
 
-def build_fact_fares(db1b_csv="DB1B_MARKET_2023.csv", carrier="WN"):
-    # Load DB1B + normalize
-    df = pd.read_csv(RAW/db1b_csv, low_memory=False)
-    df = _norm(df)
+def _read_header(path):
+    """Normalized header of a raw CSV -> {normalized name: raw name}."""
+    raw_cols = pd.read_csv(path, nrows=0).columns
+    return dict(zip(_norm(pd.DataFrame(columns=raw_cols)).columns, raw_cols))
 
-    year     = _first(df, ["YEAR"])
-    quarter  = _first(df, ["QUARTER"])
-    carrierc = _first(df, ["REPORTING_CARRIER","RPCARRIER","CARRIER","UNIQUECARRIER","AIRLINE_ID"])
-    origin   = _first(df, ["ORIGIN"])
-    dest     = _first(df, ["DEST"])
+def _market_quarters(path, carriers, chunksize=CHUNK_ROWS):
+    """Stream DB1B MARKET in chunks -> quarterly pax/rev per (carrier, year, qtr, origin, dest)
+       for every requested carrier (None: all) in one pass."""
+    hdr = _read_header(path)
+    cols = pd.DataFrame(columns=list(hdr))
 
-    # prefer total market fare (quarterly), else avg fare * pax
-    fare_total_col = next((c for c in ["MARKET_FARE","MKTFARE"] if c in df.columns), None)
-    pax_col        = _first(df, ["PASSENGERS","PAX"])
-    avg_fare_col   = next((c for c in ["AVERAGE_FARE","AVG_FARE","FARE"] if c in df.columns), None)
-
-    # filter for Southwest
-    df[carrierc] = df[carrierc].astype(str).str.strip().str.upper()
-    df = df[df[carrierc] == carrier].copy()
-
-    # numeric clean
-    for c in [pax_col, fare_total_col, avg_fare_col]:
-        if c and c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
-
-    # build monthly pax shares from T-100 (by quarter, OD, month)
-    seg = pd.read_csv(WORK/"fact_segments.csv", dtype={"origin":str,"dest":str})
-    seg["year"]  = pd.to_datetime(seg["month"]).dt.year
-    seg["mnum"]  = pd.to_datetime(seg["month"]).dt.month
-    seg["qtr"]   = ((seg["mnum"] - 1) // 3 + 1).astype(int)
+    year     = _first(cols, ["YEAR"])
+    quarter  = _first(cols, ["QUARTER"])
+    carrierc = _first(cols, ["REPORTING_CARRIER","RPCARRIER","CARRIER","UNIQUECARRIER","AIRLINE_ID"])
+    origin   = _first(cols, ["ORIGIN"])
+    dest     = _first(cols, ["DEST"])
 
-    # monthly pax per OD
-    odm = (seg.groupby(["year","qtr","origin","dest","mnum"], as_index=False)
-              .agg(pax_m=("pax","sum")))
-
-    # quarter totals per OD
-    odq = (odm.groupby(["year","qtr","origin","dest"], as_index=False)
-              .agg(pax_q_total=("pax_m","sum")))
-
-    # join & compute share; guard zero-quarters
-    w = odm.merge(odq, on=["year","qtr","origin","dest"], how="left")
-    w["share"] = np.where(w["pax_q_total"] > 0, w["pax_m"] / w["pax_q_total"], np.nan)
-
-    # dict for fast lookup: (year, qtr, mnum, origin, dest) -> share
-    share_map = {(int(r.year), int(r.qtr), int(r.mnum), str(r.origin)[:3], str(r.dest)[:3]): float(r.share)
-                 for r in w.itertuples(index=False)}
-
-    # expand DB1B quarter to months using T-100 shares (fallback 1/3)
-    rows = []
-    for _, r in df.iterrows():
-        y     = int(r[year])
-        q     = int(r[quarter])
-        o     = str(r[origin])[:3]
-        d     = str(r[dest])[:3]
-        pax_q = float(r[pax_col])
-        rev_q = float(r[fare_total_col]) if fare_total_col else float(r.get(avg_fare_col, 0.0)) * pax_q
-
-        months = _q_to_months(q)
-        fallback_share = 1.0/3.0
-        for m in months:
-            sh = share_map.get((y, q, m, o, d), np.nan)
-            if not np.isfinite(sh):
-                sh = fallback_share
-            rows.append({
-                "month":  f"{y:04d}-{m:02d}",
-                "origin": o,
-                "dest":   d,
-                "pax":    pax_q * sh,   # monthly pax via T-100 share
-                "rev":    rev_q * sh,   # monthly revenue via T-100 share
+    # prefer total market fare (quarterly), else avg fare * pax
+    fare_total_col = next((c for c in ["MARKET_FARE","MKTFARE"] if c in hdr), None)
+    pax_col        = _first(cols, ["PASSENGERS","PAX"])
+    avg_fare_col   = next((c for c in ["AVERAGE_FARE","AVG_FARE","FARE"] if c in hdr), None)
+
+    use = [c for c in dict.fromkeys([year, quarter, carrierc, origin, dest,
+                                     pax_col, fare_total_col, avg_fare_col]) if c]
+    rename = {hdr[c]: c for c in use}
+
+    acc = None
+    with instrument.span("fares.read_chunks", bytes_read=instrument.file_bytes(path)) as sp:
+        for df in pd.read_csv(path, usecols=list(rename), dtype=str, chunksize=chunksize):
+            sp.add(rows_in=len(df))
+            df = df.rename(columns=rename)
+
+            # filter for carriers before any other work
+            cr = df[carrierc].str.strip().str.upper()
+            if carriers is not None:
+                df, cr = df[cr.isin(carriers)], cr[cr.isin(carriers)]
+            if df.empty:
+                continue
+
+            pax = pd.to_numeric(df[pax_col], errors="coerce").fillna(0.0)
+            if fare_total_col:
+                rev = pd.to_numeric(df[fare_total_col], errors="coerce").fillna(0.0)
+            elif avg_fare_col:
+                rev = pd.to_numeric(df[avg_fare_col], errors="coerce").fillna(0.0) * pax
+            else:
+                rev = pax * 0.0
+
+            part = pd.DataFrame({
+                "carrier": cr,
+                "year":   pd.to_numeric(df[year]).astype(int),
+                "qtr":    pd.to_numeric(df[quarter]).astype(int),
+                "origin": df[origin].astype(str).str[:3],
+                "dest":   df[dest].astype(str).str[:3],
+                "pax_q":  pax,
+                "rev_q":  rev,
             })
-
-    fares_m = pd.DataFrame(rows)
-
-    # aggregate to unique month+OD (DB1B has many samples per market)
-    fares_m = (fares_m.groupby(["month","origin","dest"], as_index=False)
-                        .agg(pax=("pax","sum"), rev=("rev","sum")))
-
-    # join T-100 RPMs; compute yield & avg fare
-    seg_mkt = (seg.groupby(["month","origin","dest"], as_index=False)
-                 .agg(RPMs=("RPMs","sum")))
-
-    fares_m = fares_m.merge(seg_mkt, on=["month","origin","dest"], how="left")
-
-    # yield_est = revenue / RPMs (fallback to 12.5¢ if RPMs missing/zero)
-    fares_m["yield_est"] = np.where(fares_m["RPMs"] > 0, fares_m["rev"] / fares_m["RPMs"], 0.125)
-
-    # avg_fare = revenue / pax
-    fares_m["avg_fare"] = np.where(fares_m["pax"] > 0, fares_m["rev"] / fares_m["pax"], np.nan)
-
-    # coverage/confidence
-    seg_coverage = (seg.groupby(["month","origin","dest"], as_index=False)
-                    .agg(pax_t100=("pax","sum")))
-    fares_m = fares_m.merge(seg_coverage, on=["month","origin","dest"], how="left")
-
-    # missing/zero T-100 pax treated as 0 (aka low coverage)
-    pax_t100 = fares_m["pax_t100"].fillna(0.0)
-    fares_m["coverage"] = np.where(pax_t100 > 0, fares_m["pax"]/pax_t100, 0.0)
-
-    fares_m["confidence"] = pd.cut(
-        fares_m["coverage"].clip(0, 1.01),
-        bins=[-0.01, 0.25, 0.6, 1.01],
-        labels=["low", "medium", "high"]
-    )
-
-
-    out = fares_m[["month","origin","dest","yield_est","avg_fare","pax","coverage","confidence"]]
-    out.to_csv(WORK/"fact_fares.csv", index=False)
-    print(f"Wrote {WORK/'fact_fares.csv'} with {len(out)} rows (unique month+OD).")
+            part = part.groupby(KEYS, as_index=False).sum()
+
+            # fold into the running total so memory tracks #markets, not #rows
+            acc = part if acc is None else (pd.concat([acc, part], ignore_index=True)
+                                              .groupby(KEYS, as_index=False).sum())
+        sp.add(rows_out=0 if acc is None else len(acc))
+
+    return _no_markets() if acc is None else acc
+
+def _no_markets():
+    return pd.DataFrame({"carrier": pd.Series(dtype=str), "year": pd.Series(dtype=int), "qtr": pd.Series(dtype=int),
+                         "origin": pd.Series(dtype=str), "dest": pd.Series(dtype=str),
+                         "pax_q": pd.Series(dtype=float), "rev_q": pd.Series(dtype=float)})
+
+def _typed(mq):
+    """DB1B airports/carriers join the shared dictionaries first, so segment reads and the
+       market frame carry the same categorical dtypes and merge on codes."""
+    airport = schema.dtype("airport", np.concatenate([mq["origin"].unique(), mq["dest"].unique()]))
+    mq["origin"], mq["dest"] = mq["origin"].astype(airport), mq["dest"].astype(airport)
+    mq["carrier"] = mq["carrier"].astype(schema.dtype("carrier", mq["carrier"].unique()))
+    return mq
+
+def read_segments(carriers, months=None):
+    """T-100 segments with year/quarter keys, for quarter -> month shares and KPIs."""
+    seg = fact_store.read("fact_segments", columns=["carrier","month","origin","dest","RPMs","pax"],
+                          carriers=carriers, months=months)
+    seg["year"]  = seg["month"] // 100
+    seg["mnum"]  = seg["month"] % 100
+    seg["qtr"]   = ((seg["mnum"] - 1) // 3 + 1).astype(int)
+    return seg
+
+def _quarters(acc):
+    """YYYYQn label per quarterly aggregate row (the append-mode partitions)."""
+    return (acc["year"].astype(str) + "Q" + acc["qtr"].astype(str)).to_numpy()
+
+def quarterly(name, db1b_files, carriers, read, version, append=False):
+    """Quarterly DB1B aggregates behind one consumer (fact_fares, fact_segment_fares).
+       -> (per-file frames, months to rebuild or None for all, state to save after the write).
+       In append mode the quarters are those whose DB1B rows changed plus those whose T-100
+       pax shares moved (a fact_segments month was re-ingested); only those are read back."""
+    paths = [RAW/f for f in ([db1b_files] if isinstance(db1b_files, str) else db1b_files)]
+    entry = delta.load(name, version) if append else None
+    also = {delta.quarter(m) for _, m in delta.stale_inputs(entry, "fact_segments", carriers)} if entry else ()
+    frames, quarters, files = delta.gather(entry, paths, lambda ps: [read(p) for p in ps], _quarters, also)
+    months = None if quarters is None else sorted(m for q in quarters for m in delta.quarter_months(q))
+    state = {"files": files, "inputs": {"fact_segments": delta.inputs("fact_segments", carriers)}}
+    return frames, months, state
+
+@instrument.traced("fares")
+def build_fact_fares(db1b_csv="DB1B_MARKET_2023.csv", carriers=("WN",), chunksize=CHUNK_ROWS, append=False):
+    # Stream DB1B -> quarterly market totals for every requested carrier in one pass
+    # db1b_csv: one file or a list (e.g. one per quarter); append: see quarterly()
+    carriers = parse_carriers(carriers)
+    version = {"carriers": carriers}
+    parts, months, state = quarterly("fares", db1b_csv, carriers,
+                                     lambda p: _market_quarters(p, carriers, chunksize=chunksize),
+                                     version, append)
+    if months is not None and not months:
+        delta.save("fares", version, **state)
+        print(f"{WORK/'fact_fares'} up to date")
+        return
+    mq = (pd.concat(parts, ignore_index=True).groupby(KEYS, as_index=False).sum() if len(parts) > 1
+          else parts[0] if parts else _no_markets())
+    mq = _typed(mq)
+    seg = read_segments(carriers, months)
+    out = monthly_fares(mq, seg)
+    fact_store.write(out, "fact_fares", overwrite=True, carriers=carriers, months=months)
+    delta.save("fares", version, **state)
+    print(f"Wrote {WORK/'fact_fares'} with {len(out)} rows (unique carrier+month+OD"
+          + (f"; quarters {sorted({delta.quarter(m) for m in months})})." if months is not None else ")."))
+
+def monthly_fares(mq, seg):
+    """Quarterly (carrier, year, qtr, origin, dest) pax_q/rev_q -> monthly yield, avg fare,
+       pax, coverage and confidence per carrier+month+origin+dest (T-100 monthly pax shares)."""
+    with instrument.span("fares.shares") as sp:
+        # build monthly pax shares from T-100 (by quarter, OD, month)
+
+        # monthly pax per OD
+        odm = (seg.groupby(KEYS + ["mnum"], as_index=False, observed=True)
+                  .agg(pax_m=("pax","sum")))
+
+        # quarter totals per OD
+        odq = (odm.groupby(KEYS, as_index=False, observed=True)
+                  .agg(pax_q_total=("pax_m","sum")))
+
+        # join & compute share; guard zero-quarters (odm is unique per KEYS + mnum by construction)
+        w = odm.merge(odq, on=KEYS, how="left", validate="many_to_one")
+        w["share"] = np.where(w["pax_q_total"] > 0, w["pax_m"] / w["pax_q_total"], np.nan)
+        sp.add(rows_in=len(seg), rows_out=len(w))
+
+    with instrument.span("fares.expand", rows_in=len(mq)) as sp:
+        # expand each market quarter to its three months, then one join against the share table
+        fares_m = mq.loc[mq.index.repeat(3)].reset_index(drop=True)
+        fares_m["mnum"] = (fares_m["qtr"] - 1) * 3 + np.tile([1, 2, 3], len(mq))
+        fares_m = fares_m.merge(w[KEYS + ["mnum","share"]], on=KEYS + ["mnum"], how="left")
+
+        # fallback 1/3 where T-100 has no (or a zero) share for that month
+        sh = fares_m["share"].fillna(1.0/3.0)
+        fares_m["month"] = (fares_m["year"] * 100 + fares_m["mnum"]).astype(schema.MONTH)
+        fares_m["pax"] = fares_m["pax_q"] * sh   # monthly pax via T-100 share
+        fares_m["rev"] = fares_m["rev_q"] * sh   # monthly revenue via T-100 share
+
+        # aggregate to unique month+OD (DB1B has many samples per market)
+        fares_m = (fares_m.groupby(MKT, as_index=False, observed=True)
+                            .agg(pax=("pax","sum"), rev=("rev","sum")))
+        sp.add(rows_out=len(fares_m))
+
+    with instrument.span("fares.kpis", rows_in=len(fares_m)):
+        # join T-100 RPMs; compute yield & avg fare
+        seg_mkt = (seg.groupby(MKT, as_index=False, observed=True)
+                     .agg(RPMs=("RPMs","sum")))
+
+        fares_m = fares_m.merge(seg_mkt, on=MKT, how="left")
+
+        # yield_est = revenue / RPMs (fallback to 12.5¢ if RPMs missing/zero)
+        fares_m["yield_est"] = np.where(fares_m["RPMs"] > 0, fares_m["rev"] / fares_m["RPMs"], 0.125)
+
+        # avg_fare = revenue / pax
+        fares_m["avg_fare"] = np.where(fares_m["pax"] > 0, fares_m["rev"] / fares_m["pax"], np.nan)
+
+        # coverage/confidence
+        seg_coverage = (seg.groupby(MKT, as_index=False, observed=True)
+                        .agg(pax_t100=("pax","sum")))
+        fares_m = fares_m.merge(seg_coverage, on=MKT, how="left")
+
+        # missing/zero T-100 pax treated as 0 (aka low coverage)
+        pax_t100 = fares_m["pax_t100"].fillna(0.0)
+        fares_m["coverage"] = np.where(pax_t100 > 0, fares_m["pax"]/pax_t100, 0.0)
+
+        fares_m["confidence"] = pd.cut(
+            fares_m["coverage"].clip(0, 1.01),
+            bins=[-0.01, 0.25, 0.6, 1.01],
+            labels=["low", "medium", "high"]
+        )
+
+
+    return fares_m[MKT + ["yield_est","avg_fare","pax","coverage","confidence"]]
 
 if __name__ == "__main__":
-    build_fact_fares()
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument("--carriers", default="WN", help="comma list of carriers, or 'all' (one pass either way)")
+    p.add_argument("--files", nargs="+", default=["DB1B_MARKET_2023.csv"],
+                   help="DB1B MARKET files in data_raw/ (e.g. one per quarter)")
+    p.add_argument("--append", action="store_true",
+                   help="only rebuild quarters whose DB1B rows or T-100 pax shares changed since the last run")
+    args = p.parse_args()
+    build_fact_fares(args.files, carriers=args.carriers, append=args.append)
@@ -0,0 +1,132 @@
+"""
+Append-mode bookkeeping for the ingest stages (newly published BTS months)
+- every raw file is recorded with its signature (size:mtime) and a digest per partition it
+  holds: year/month for T-100, year/quarter for DB1B. The digests are taken from the
+  file's own aggregate, so a re-published file counts as changed only in partitions whose
+  aggregates really moved
+- gather() re-reads only new or changed files. A file that did not change is read again
+  only when it holds part of an affected partition, e.g. a second T-100 file for the same
+  month
+- downstream builders record the fact-table partition signatures they were built from, so
+  a re-ingested month marks just its own quarter (fares) or carrier-month (allocation) stale
+- state is one file per consumer (data_work/.ingest_<consumer>.json; stages that run
+  concurrently never share one). A change to the consumer's version (carriers, coordinates,
+  config) drops that state and the next run rebuilds in full
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import fact_store
+from utils import month_label
+
+DATA_WORK = Path("data_work")
+
+def _key(version):
+    return hashlib.sha256(json.dumps(version, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def _state(name):
+    return DATA_WORK / f".ingest_{name}.json"
+
+def load(name, version):
+    """Recorded state of a consumer ({"files", "inputs", "parts"}), or None when there is none
+       for this version (the caller then builds in full)."""
+    path = _state(name)
+    entry = json.loads(path.read_text()) if path.exists() else None
+    if not entry or entry.get("version") != _key(version):
+        return None
+    return {k: entry.get(k, {}) for k in ("files", "inputs", "parts")}
+
+def save(name, version, files=None, inputs=None, parts=None):
+    state = {"version": _key(version), "files": files or {}, "inputs": inputs or {}, "parts": parts or {}}
+    DATA_WORK.mkdir(exist_ok=True)
+    path = _state(name)
+    tmp = path.with_suffix(f".json.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+def signature(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def digests(df, labels):
+    """{partition label: digest} of a frame, from order-independent sums of row hashes."""
+    labels = np.asarray(labels)
+    if not len(df):
+        return {}
+    h = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    codes, uniq = pd.factorize(labels)
+    acc = np.zeros(len(uniq), dtype=np.uint64)
+    np.add.at(acc, codes, h)                 # wraps mod 2**64
+    n = np.bincount(codes, minlength=len(uniq))
+    return {str(u): f"{k}:{s:016x}" for u, k, s in zip(uniq, n, acc)}
+
+def changed_parts(old, new):
+    """Labels whose digest differs, including ones present on one side only."""
+    return {k for k in set(old) | set(new) if old.get(k) != new.get(k)}
+
+def gather(entry, paths, read, labels, also=()):
+    """Per-file aggregates for a build. read([path, ...]) -> [frame, ...] (one aggregate per
+       file); labels(frame) -> partition label per row.
+       -> (frames, affected partitions or None for everything, files state to save).
+       Without an entry every file is read whole; with one, only new/changed files are, and
+       the frames are cut down to the partitions they changed plus `also`."""
+    stale = list(paths) if entry is None else [
+        p for p in paths if (entry["files"].get(str(p)) or {}).get("sig") != signature(p)]
+    frames = dict(zip(stale, read(stale))) if stale else {}
+    fresh = {str(p): {"sig": signature(p), "parts": digests(f, labels(f))} for p, f in frames.items()}
+    files = {str(p): fresh.get(str(p)) or entry["files"][str(p)] for p in paths}
+    if entry is None:
+        return list(frames.values()), None, files
+
+    old = entry["files"]
+    parts = set(also)
+    for k in set(old) | set(fresh):
+        if k in fresh or k not in files:      # re-read, or no longer among the inputs
+            parts |= changed_parts((old.get(k) or {}).get("parts", {}), (files.get(k) or {}).get("parts", {}))
+    if not parts:
+        return [], set(), files
+
+    holders = [p for p in paths if str(p) not in fresh and parts & set(files[str(p)]["parts"])]
+    if holders:
+        frames.update(zip(holders, read(holders)))
+    keep = list(parts)
+    return [f[np.isin(np.asarray(labels(f)), keep)] for f in frames.values()], parts, files
+
+def inputs(table, carriers=None):
+    """{"carrier/month": signature} of a fact table's partitions (carriers=None: all)."""
+    return {f"{c}/{m}": sig for (c, m), sig in fact_store.partition_signatures(table).items()
+            if carriers is None or c in set(carriers)}
+
+def stale_inputs(entry, table, carriers=None):
+    """(carrier, month label) partitions of table written, rewritten or removed since the
+       consumer recorded them."""
+    old = {} if entry is None else entry["inputs"].get(table, {})
+    return sorted(tuple(k.split("/", 1)) for k in changed_parts(old, inputs(table, carriers)))
+
+def recorded_inputs(entry, tables, carriers=None, months=None):
+    """Input signatures to save once `months` (None: all) were rebuilt from tables; the other
+       months keep what the consumer recorded before."""
+    done = None if months is None else {month_label(m) for m in months}
+    out = {}
+    for t in tables:
+        now = inputs(t, carriers)
+        if done is None:
+            out[t] = now
+            continue
+        old = {} if entry is None else entry["inputs"].get(t, {})
+        out[t] = {**{k: s for k, s in old.items() if k.split("/", 1)[1] not in done},
+                  **{k: s for k, s in now.items() if k.split("/", 1)[1] in done}}
+    return out
+
+def quarter(month):
+    """'2023-07' -> '2023Q3'."""
+    y, m = map(int, month.split("-")[:2])
+    return f"{y}Q{(m - 1) // 3 + 1}"
+
+def quarter_months(q):
+    """'2023Q3' -> ['2023-07', '2023-08', '2023-09']."""
+    y, n = q.split("Q")
+    return [f"{int(y):04d}-{(int(n) - 1) * 3 + i:02d}" for i in (1, 2, 3)]
@@ -0,0 +1,166 @@
+"""
+Great-circle distances between airports
+- coordinates come from the BTS Master Coordinate table (data_raw/T_MASTER_CORD.csv:
+  AIRPORT, LATITUDE, LONGITUDE; only AIRPORT_IS_LATEST rows when that column is present)
+- great_circle() works on unique OD pairs only: one vectorized haversine over the pairs not
+  yet known, memoized in data_work/od_distances.parquet. The cache belongs to one version of
+  the coordinates file and is dropped when it changes
+- validate() checks the T-100 DISTANCE of every carrier-month-OD-fleet against the great
+  circle during ingest: missing/zero distances are filled, deviations past
+  `distances: tolerance_pct/tolerance_mi` are flagged (replaced with replace_deviations) and
+  listed in data_work/distance_flags.csv
+- without the coordinates file distances stay as reported (missing ones are still listed)
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from utils import CONFIG, load_config, month_str
+
+RAW = Path("data_raw")
+DATA_WORK = Path("data_work")
+COORDS = "T_MASTER_CORD.csv"
+CACHE = DATA_WORK / "od_distances.parquet"
+STATE = DATA_WORK / ".od_distances.json"
+FLAGS = DATA_WORK / "distance_flags.csv"
+EARTH_RADIUS_MI = 3958.7613          # mean Earth radius, statute miles
+
+DEFAULTS = {
+    "tolerance_pct": 2.0,            # flag when off by more than this share of the great circle
+    "tolerance_mi": 10.0,            # ... and by more than this many miles
+    "replace_deviations": False,     # True: use the great circle for flagged rows too
+}
+
+def settings(cfg):
+    return {**DEFAULTS, **(cfg.get("distances") or {})}
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle miles between arrays of points given in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MI * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+# --- coordinates ---
+_coords = {"version": None, "table": None}
+
+def version():
+    """Content hash of the coordinates file, or None without one."""
+    path = RAW / COORDS
+    if not path.exists():
+        return None
+    st = path.stat()
+    if _coords.get("stat") != (st.st_size, st.st_mtime_ns):
+        _coords.update(stat=(st.st_size, st.st_mtime_ns),
+                       version=hashlib.sha256(path.read_bytes()).hexdigest()[:16], table=None)
+    return _coords["version"]
+
+def coordinates():
+    """airport -> (lat, lon) frame, or None without a coordinates file."""
+    if version() is None:
+        return None
+    if _coords["table"] is None:
+        want = {"AIRPORT", "LATITUDE", "LONGITUDE", "AIRPORT_IS_LATEST"}
+        df = pd.read_csv(RAW / COORDS, usecols=lambda c: c in want)
+        if "AIRPORT_IS_LATEST" in df:
+            df = df[df["AIRPORT_IS_LATEST"] == 1]
+        df = df.dropna(subset=["LATITUDE", "LONGITUDE"]).drop_duplicates("AIRPORT", keep="last")
+        _coords["table"] = (df.set_index("AIRPORT")[["LATITUDE", "LONGITUDE"]]
+                              .rename(columns={"LATITUDE": "lat", "LONGITUDE": "lon"}))
+    return _coords["table"]
+
+# --- pair cache ---
+_pairs = {"version": None, "miles": None}
+
+def _load_pairs(v):
+    if _pairs["version"] != v:
+        fresh = CACHE.exists() and STATE.exists() and json.loads(STATE.read_text()).get("coords") == v
+        miles = pd.read_parquet(CACHE).set_index(["origin", "dest"])["miles"] if fresh else None
+        _pairs.update(version=v, miles=miles)
+    return _pairs["miles"]
+
+def _save_pairs(v, miles):
+    DATA_WORK.mkdir(exist_ok=True)
+    tmp = CACHE.with_suffix(f".{os.getpid()}.tmp")
+    miles.rename("miles").reset_index().to_parquet(tmp, index=False)
+    os.replace(tmp, CACHE)
+    tmp = STATE.with_suffix(f".json.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({"coords": v, "pairs": len(miles)}))
+    os.replace(tmp, STATE)
+    _pairs.update(version=v, miles=miles)
+
+def great_circle(origin, dest):
+    """Great-circle miles per origin/dest element (NaN where an airport has no coordinates,
+       or for everything without a coordinates file)."""
+    v = version()
+    if v is None:
+        return np.full(len(origin), np.nan)
+    # integer pair codes: factorizing two string columns beats hashing a MultiIndex of tuples
+    oc, ou = pd.factorize(pd.Series(origin).astype(str), use_na_sentinel=False)
+    dc, du = pd.factorize(pd.Series(dest).astype(str), use_na_sentinel=False)
+    codes, pairs = pd.factorize(oc.astype(np.int64) * len(du) + dc)
+    uniq = pd.MultiIndex.from_arrays([np.asarray(ou)[pairs // len(du)], np.asarray(du)[pairs % len(du)]],
+                                     names=["origin", "dest"])
+    known = _load_pairs(v)
+    new = uniq if known is None else uniq[~uniq.isin(known.index)]
+    if len(new):
+        xy = coordinates()
+        o = xy.reindex(new.get_level_values("origin"))
+        d = xy.reindex(new.get_level_values("dest"))
+        add = pd.Series(haversine_miles(o["lat"], o["lon"], d["lat"], d["lon"]), index=new)
+        known = add if known is None else pd.concat([known, add])
+        _save_pairs(v, known)
+    return known.reindex(uniq).to_numpy(float)[codes]
+
+def validate(df, cfg=None, months=None):
+    """Checked DISTANCE for a T-100 frame (CARRIER, YEAR, MONTH, ORIGIN, DEST, AIRCRAFT_TYPE,
+       DISTANCE); writes the rows that were filled, flagged or left without a distance to FLAGS.
+       months: df only re-checks these months; FLAGS keeps its rows for the others."""
+    s = settings(cfg if cfg is not None else (load_config() if CONFIG.exists() else {}))
+    reported = df["DISTANCE"].to_numpy(float)
+    gc = great_circle(df["ORIGIN"], df["DEST"])
+    have_gc = ~np.isnan(gc)
+    missing = ~(reported > 0)
+    off = np.abs(reported - gc)
+    deviates = ~missing & have_gc & (off > s["tolerance_pct"] / 100.0 * gc) & (off > s["tolerance_mi"])
+
+    action = np.full(len(df), "", dtype=object)
+    action[missing & have_gc] = "filled"
+    action[missing & ~have_gc] = "no_distance"      # no ASMs: dropped by ingest
+    action[deviates] = "replaced" if s["replace_deviations"] else "flagged"
+    use_gc = (missing & have_gc) | (deviates & bool(s["replace_deviations"]))
+    out = np.where(use_gc, np.round(gc), np.where(missing, np.nan, reported))
+
+    hit = action != ""
+    rows = df[hit]
+    flags = pd.DataFrame({
+        "carrier": rows["CARRIER"].to_numpy(),
+        "month": [month_str(int(y), int(m)) for y, m in zip(rows["YEAR"], rows["MONTH"])],
+        "origin": rows["ORIGIN"].to_numpy(), "dest": rows["DEST"].to_numpy(),
+        "fleet_type": rows["AIRCRAFT_TYPE"].to_numpy(),
+        "reported": reported[hit], "great_circle": gc[hit].round(1),
+        "deviation_pct": np.where(have_gc & ~missing, 100.0 * (reported - gc) / gc, np.nan)[hit].round(2),
+        "action": action[hit],
+    })
+    if months is not None and FLAGS.exists():
+        kept = pd.read_csv(FLAGS, dtype={"month": str, "fleet_type": str})
+        flags = pd.concat([kept[~kept["month"].isin(set(months))], flags], ignore_index=True)
+    DATA_WORK.mkdir(exist_ok=True)
+    flags.to_csv(FLAGS, index=False)
+    n = pd.Series(action[hit]).value_counts()
+    note = "" if version() is not None else f" (no {RAW / COORDS}: distances used as reported)"
+    print(f"[distances] {len(df)} rows: {n.get('filled', 0)} filled, {n.get('flagged', 0)} flagged, "
+          f"{n.get('replaced', 0)} replaced, {n.get('no_distance', 0)} without a distance{note}"
+          + (f" -> {FLAGS}" if hit.any() else ""))
+    return pd.Series(out, index=df.index, name="DISTANCE")
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("pairs", nargs="+", help="ORIGIN-DEST, e.g. DAL-HOU")
+    args = p.parse_args()
+    o, d = zip(*(x.upper().split("-") for x in args.pairs))
+    for a, b, m in zip(o, d, great_circle(list(o), list(d))):
+        print(f"{a}-{b}: " + (f"{m:,.0f} mi" if m == m else f"no coordinates (see {RAW / COORDS})"))
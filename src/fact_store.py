@@ -0,0 +1,220 @@
+"""
+Flight-Prof Lite: Fact Store
+- Carrier x month partitioned Parquet for the data_work fact tables:
+    data_work/<table>/carrier=XX/month=YYYY-MM/part.parquet
+  (month-only partitions written before the carrier level are still read)
+- Reads push column projection and carrier/month filters down to the partition files
+- Writes replace one carrier-month partition at a time (temp file + atomic rename)
+- Frames are cast to the compact schema (schema.py) on write and conformed on read, so
+  every stage sees categorical airports/fleets and integer YYYYMM months
+- CSV export stays available for docs/ and ad-hoc pandas
+"""
+from pathlib import Path
+import os
+import shutil
+import pandas as pd
+import instrument
+import schema
+from utils import month_key, month_label, parse_carriers
+
+WORK = Path("data_work")
+TABLES = ("fact_segments", "fact_financials", "fact_fares", "fact_segment_fares", "fact_route_economics",
+          "fact_reconciliation", "fact_rollup", "fact_scenarios", "fact_margin_bands", "fact_marginal",
+          "fact_flight_economics")
+PART = "part.parquet"
+
+def _table_dir(table, root=None):
+    return Path(root or WORK) / table
+
+def _legacy_csv(table, root=None):
+    return Path(root or WORK) / f"{table}.csv"
+
+def exists(table, root=None):
+    return _table_dir(table, root).is_dir() or _legacy_csv(table, root).exists()
+
+def _partitions(table, root=None):
+    """[(carrier, month label, path)] from partition names only (no data bytes).
+       Month-only partitions from before the carrier level read as DEFAULT_CARRIER."""
+    d = _table_dir(table, root)
+    out = [(p.parent.parent.name.split("=", 1)[1], p.parent.name.split("=", 1)[1], p)
+           for p in d.glob(f"carrier=*/month=*/{PART}")]
+    out += [(None, p.parent.name.split("=", 1)[1], p) for p in d.glob(f"month=*/{PART}")]
+    return sorted(out, key=lambda t: (t[1], t[0] or schema.DEFAULT_CARRIER))
+
+def list_partitions(table, root=None):
+    """Sorted (carrier, month) pairs present in a table."""
+    d = _table_dir(table, root)
+    if d.is_dir():
+        return sorted({(c or schema.DEFAULT_CARRIER, m) for c, m, _ in _partitions(table, root)})
+    if _legacy_csv(table, root).exists():
+        df = read(table, columns=["carrier", "month"]).drop_duplicates()
+        return sorted(zip(df["carrier"].astype(str), df["month"].map(month_label)))
+    return []
+
+def partition_signatures(table, root=None):
+    """{(carrier, month): "size:mtime_ns"} per partition file, for change detection."""
+    out = {}
+    for c, m, p in _partitions(table, root):
+        st = p.stat()
+        out[(c or schema.DEFAULT_CARRIER, m)] = f"{st.st_size}:{st.st_mtime_ns}"
+    return out
+
+def list_carriers(table, root=None):
+    return sorted({c for c, _ in list_partitions(table, root)})
+
+def list_months(table, root=None, carriers=None):
+    """Months present in a table, read from partition names only (no data bytes)."""
+    d = _table_dir(table, root)
+    if d.is_dir():
+        return sorted({m for c, m in list_partitions(table, root) if carriers is None or c in set(carriers)})
+    csv = _legacy_csv(table, root)
+    if csv.exists():
+        return sorted(pd.read_csv(csv, usecols=["month"], dtype=str)["month"].dropna().unique())
+    return []
+
+def _read_part(path, cols, carrier, table):
+    if carrier is not None or (cols is not None and "carrier" not in cols):
+        return schema.conform(pd.read_parquet(path, columns=cols), table)
+    # month-only partition: the carrier lives in neither the path nor the file
+    df = pd.read_parquet(path, columns=None if cols is None else [c for c in cols if c != "carrier"])
+    df.insert(0, "carrier", schema.DEFAULT_CARRIER)
+    return schema.conform(schema.cast(df, table), table)[cols if cols is not None else df.columns]
+
+def read(table, months=None, columns=None, root=None, carriers=None):
+    """Read a fact table, touching only the requested carrier/month partitions and columns.
+       Falls back to a flat data_work/<table>.csv if the table was never partitioned."""
+    cols = None if columns is None else list(dict.fromkeys(columns))
+    d = _table_dir(table, root)
+
+    if not d.is_dir():
+        csv = _legacy_csv(table, root)
+        if not csv.exists():
+            raise FileNotFoundError(f"No fact table {table!r} under {Path(root or WORK)}")
+        head = pd.read_csv(csv, nrows=0).columns
+        usecols = None if cols is None else [c for c in dict.fromkeys(cols + ["month"]) if c in head]
+        df = schema.cast(pd.read_csv(csv, usecols=usecols, dtype={"month": str}), table)
+        if months is not None:
+            df = df[df["month"].isin({month_key(m) for m in months})]
+        if carriers is not None and "carrier" in df.columns:
+            df = df[df["carrier"].isin(set(carriers))]
+        return df[cols].reset_index(drop=True) if cols is not None else df.reset_index(drop=True)
+
+    have = _partitions(table, root)
+    want_m = None if months is None else {month_label(m) for m in months}
+    want_c = None if carriers is None else set(carriers)
+    parts = [(c, p) for c, m, p in have
+             if (want_m is None or m in want_m) and (want_c is None or (c or schema.DEFAULT_CARRIER) in want_c)]
+    if not parts:
+        if not have:
+            raise FileNotFoundError(f"Fact table {table!r} has no partitions under {d}")
+        # empty frame with the table's schema
+        return _read_part(have[0][2], cols, have[0][0], table).iloc[0:0]
+    with instrument.span("store.read", table=table) as sp:
+        # conform each partition before concat so categoricals stay categorical
+        df = pd.concat([_read_part(p, cols, c, table) for c, p in parts], ignore_index=True)
+        sp.add(rows_out=len(df), bytes_read=sum(instrument.file_bytes(p) for _, p in parts))
+    return df
+
+def columns(table, root=None):
+    """Column names of a table, from one partition's Parquet footer (or the CSV header)."""
+    have = _partitions(table, root)
+    if have:
+        import pyarrow.parquet as pq
+        names = pq.read_schema(have[0][2]).names
+        return names if "carrier" in names else ["carrier"] + names
+    csv = _legacy_csv(table, root)
+    if csv.exists():
+        return list(pd.read_csv(csv, nrows=0).columns)
+    raise FileNotFoundError(f"No fact table {table!r} under {Path(root or WORK)}")
+
+def chunks(table, columns=None, root=None):
+    """Stream a table one carrier-month partition at a time (a flat legacy CSV is one chunk),
+       so a scan over multi-year data holds a single partition in memory."""
+    if not _table_dir(table, root).is_dir():
+        yield read(table, columns=columns, root=root)
+        return
+    cols = None if columns is None else list(dict.fromkeys(columns))
+    for c, _, p in _partitions(table, root):
+        yield _read_part(p, cols, c, table)
+
+def _replace(part, pdir):
+    pdir.mkdir(parents=True, exist_ok=True)
+    tmp = pdir / f".{PART}.{os.getpid()}.tmp"
+    part.reset_index(drop=True).to_parquet(tmp, index=False)
+    os.replace(tmp, pdir / PART)
+
+def write(df, table, root=None, overwrite=False, carriers=None, months=None):
+    """Upsert one Parquet partition per carrier x month in df (month only for tables
+       without a carrier). Each partition is written to a temp file and renamed into place,
+       so readers never see a half-written month.
+       overwrite=True also drops partitions not present in df; with carriers, only those
+       carriers' partitions are candidates (a WN rebuild leaves AA alone), and with months
+       only those months' (an appended month leaves the rest of the history alone)."""
+    d = _table_dir(table, root)
+    d.mkdir(parents=True, exist_ok=True)
+
+    df = schema.cast(df, table)
+    keys = ["carrier", "month"] if "carrier" in df.columns else ["month"]
+    written = set()
+    with instrument.span("store.write", table=table, rows_in=len(df)):
+        for key, part in df.groupby(keys, sort=True, observed=True):
+            key = key if isinstance(key, tuple) else (key,)
+            m = month_label(key[-1])
+            if len(key) == 2:
+                c = str(key[0])
+                _replace(part, d / f"carrier={c}" / f"month={m}")
+                # a carrier partition supersedes the old month-only one for the default carrier
+                if c == schema.DEFAULT_CARRIER and (d / f"month={m}").is_dir():
+                    shutil.rmtree(d / f"month={m}")
+                written.add(f"carrier={c}/month={m}")
+            else:
+                _replace(part, d / f"month={m}")
+                written.add(f"month={m}")
+
+    if overwrite:
+        for c, m, p in _partitions(table, root):
+            if carriers is not None and (c or schema.DEFAULT_CARRIER) not in set(carriers):
+                continue
+            if months is not None and m not in {month_label(x) for x in months}:
+                continue
+            if str(p.parent.relative_to(d)) not in written:
+                shutil.rmtree(p.parent)
+        for p in d.glob("carrier=*"):
+            if p.is_dir() and not any(p.iterdir()):
+                p.rmdir()
+    return sorted(written)
+
+def drop(table, keys, root=None):
+    """Delete the (carrier, month label) partitions in keys (e.g. a carrier-month whose
+       source partition is gone); -> the keys that existed."""
+    d = _table_dir(table, root)
+    gone = []
+    for c, m, p in _partitions(table, root):
+        if (c or schema.DEFAULT_CARRIER, m) in set(keys):
+            shutil.rmtree(p.parent)
+            gone.append((c or schema.DEFAULT_CARRIER, m))
+    for p in d.glob("carrier=*"):
+        if p.is_dir() and not any(p.iterdir()):
+            p.rmdir()
+    return sorted(gone)
+
+def export_csv(table, out=None, months=None, columns=None, root=None, carriers=None):
+    """Flat CSV of a fact table (defaults to data_work/<table>.csv)."""
+    out = Path(out) if out else _legacy_csv(table, root)
+    df = schema.labels(read(table, months=months, columns=columns, root=root, carriers=carriers))
+    out.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(out, index=False)
+    print(f"Wrote {out} with {len(df)} rows")
+    return out
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("table", choices=TABLES)
+    p.add_argument("--out", help="CSV path (default data_work/<table>.csv)")
+    p.add_argument("--month", action="append", help="YYYY-MM (repeatable; default all)")
+    p.add_argument("--carrier", action="append", help="carrier code (repeatable; default all)")
+    args = p.parse_args()
+    export_csv(args.table, out=args.out, months=args.month,
+               carriers=parse_carriers(args.carrier) if args.carrier else None)
@@ -0,0 +1,402 @@
+"""
+Flight-level economics: fact_route_economics split down to individual departures
+- flights come from per-departure files in data_raw/ (a schedule, or BTS On-Time Reporting
+  downloads: the column names of either are recognised; cancelled flights are dropped) or,
+  with --synthetic, from a stand-in that deals each segment row's T-100 departures over the
+  days of its month at drawn departure times, with peak-hour loads and block times
+- every flight is matched to its fact_route_economics row (carrier, month, OD, fleet);
+  flights without usable equipment (On-Time data has none) are dealt over the OD's fleets in
+  proportion to their T-100 departures, in departure-time order
+- a segment row's measures and bucket costs are split over its flights by within-row shares
+  (grouped sums): departures one each, block hours by block minutes, ASMs by seats, pax,
+  RPMs and revenue by passengers; equal shares where the flights do not carry a field.
+  Each bucket is split by the mix of drivers that produced it (weights x the row's month
+  shares), so a flight gets what allocating the month's totals straight to flights would
+  give it, and the flights of a row sum back to the row, reconciliation spread included
+- a segment row no flight matched stays as one unscheduled row (no day/time/flight number),
+  so fact_flight_economics rolls up to fact_route_economics in full
+- input files are parsed once, in chunks: each chunk's rows are spilled to per-month Parquet
+  pieces under data_work/flights_input/ (removed after the build), so memory is bounded by
+  a chunk and no file is read more than once however many months it spans
+- one job per month: a worker reads only its month's pieces, holds a single month of
+  flights and writes its own partitions; --workers runs months in parallel. Carrier-months
+  that left fact_route_economics lose their flight partitions
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import calendar
+import shutil
+import zlib
+import numpy as np
+import pandas as pd
+import fact_store
+import instrument
+from allocation import DRIVERS, OUT_COLS, add_totals, bucket_costs, burn_rates, compile_buckets, \
+    driver_shares, load_config
+from utils import month_key, month_label
+
+RAW = Path("data_raw")
+DATA_WORK = Path("data_work")
+SPILL = DATA_WORK / "flights_input"
+TABLE = "fact_flight_economics"
+CHUNK_ROWS = 1_000_000
+
+KEYS = ["carrier", "month", "origin", "dest", "fleet_type"]
+FLIGHT = ["day", "dep_time", "flight_no"]
+# flight column -> accepted input names (schedule first, then BTS On-Time Reporting)
+ALIASES = {
+    "carrier":    ["carrier", "OP_UNIQUE_CARRIER", "OP_CARRIER", "Reporting_Airline", "IATA_CODE_Reporting_Airline"],
+    "date":       ["flight_date", "FL_DATE", "FlightDate"],
+    "flight_no":  ["flight_no", "OP_CARRIER_FL_NUM", "Flight_Number_Reporting_Airline"],
+    "origin":     ["origin", "ORIGIN", "Origin"],
+    "dest":       ["dest", "DEST", "Dest"],
+    "dep_time":   ["dep_time", "CRS_DEP_TIME", "CRSDepTime"],
+    "block_min":  ["block_min", "ACTUAL_ELAPSED_TIME", "ActualElapsedTime", "CRS_ELAPSED_TIME", "CRSElapsedTime"],
+    "fleet_type": ["fleet_type", "AIRCRAFT_TYPE", "equipment"],
+    "seats":      ["seats", "SEATS"],
+    "pax":        ["pax", "PASSENGERS"],
+    "cancelled":  ["cancelled", "CANCELLED", "Cancelled"],
+}
+REQUIRED = ["carrier", "date", "origin", "dest", "dep_time"]
+# flight field each allocation driver splits a segment row by
+FIELD = {"block_hours": "block_hours", "departures": "departures", "pax": "pax", "ASMs": "seats",
+         "RPMs": "pax", "revenue": "pax"}
+# measures of the segment row and the flight field they split by
+MEASURES = {"departures": "departures", "block_hours": "block_hours", "ASMs": "seats",
+            "RPMs": "pax", "pax": "pax", "revenue": "pax"}
+
+# --- flight input ---
+def _columns(path):
+    """{flight column: input column} for one file."""
+    have = list(pd.read_csv(path, nrows=0).columns)
+    cols = {k: next((c for c in names if c in have), None) for k, names in ALIASES.items()}
+    missing = [k for k in REQUIRED if cols[k] is None]
+    if missing:
+        raise KeyError(f"{path}: no flight column for {missing} (accepted: {[ALIASES[k] for k in missing]})")
+    return {k: c for k, c in cols.items() if c}
+
+def _dates(s):
+    """Dates parsed once per distinct value (a month of flights has ~31)."""
+    codes, uniq = pd.factorize(s)
+    return pd.DatetimeIndex(pd.to_datetime(pd.Index(uniq).astype(str), format="mixed"))[codes]
+
+def _chunks(paths, carriers=None):
+    """Flights of the input files, every month, one chunk of at most CHUNK_ROWS rows at a
+       time (cancelled flights and other carriers dropped)."""
+    for path in paths:
+        cols = _columns(path)
+        with instrument.span("flights.read_file", file=str(path), bytes_read=instrument.file_bytes(path)) as sp:
+            for df in pd.read_csv(path, usecols=list(cols.values()), chunksize=CHUNK_ROWS,
+                                  dtype={cols[k]: str for k in ("carrier", "origin", "dest", "fleet_type", "date")
+                                         if k in cols}):
+                sp.add(rows_in=len(df))
+                df = df.rename(columns={v: k for k, v in cols.items()})
+                keep = np.ones(len(df), dtype=bool)
+                if "cancelled" in df:
+                    keep &= ~(pd.to_numeric(df["cancelled"], errors="coerce").fillna(0) > 0).to_numpy()
+                if carriers is not None:
+                    keep &= df["carrier"].str.strip().isin(carriers).to_numpy()
+                if not keep.any():
+                    continue
+                df = df[keep]
+                d = _dates(df["date"])
+                sp.add(rows_out=len(df))
+                yield pd.DataFrame({
+                    "carrier": df["carrier"].str.strip().to_numpy(),
+                    "month": np.asarray(d.year * 100 + d.month, dtype=np.int64),
+                    "day": d.day.to_numpy(),
+                    "dep_time": pd.to_numeric(df["dep_time"].astype(str).str.replace(":", ""),
+                                              errors="coerce").to_numpy(float),
+                    "flight_no": pd.to_numeric(df["flight_no"], errors="coerce").to_numpy(float)
+                                 if "flight_no" in df else np.nan,
+                    "origin": df["origin"].str.strip().to_numpy(), "dest": df["dest"].str.strip().to_numpy(),
+                    "fleet_type": df["fleet_type"].str.strip().to_numpy() if "fleet_type" in df else None,
+                    "block_hours": pd.to_numeric(df["block_min"], errors="coerce").to_numpy(float) / 60.0
+                                   if "block_min" in df else np.nan,
+                    "seats": pd.to_numeric(df["seats"], errors="coerce").to_numpy(float) if "seats" in df else np.nan,
+                    "pax": pd.to_numeric(df["pax"], errors="coerce").to_numpy(float) if "pax" in df else np.nan,
+                })
+
+def _flights(parts):
+    if not parts:
+        return pd.DataFrame(columns=["carrier", "month", *FLIGHT, "origin", "dest", "fleet_type",
+                                     "block_hours", "seats", "pax"])
+    return pd.concat(parts, ignore_index=True)
+
+def read_flights(paths, month, carriers=None):
+    """One month of flights straight from the input files (a full pass over them)."""
+    return _flights([df[df["month"] == month] for df in _chunks(paths, carriers) if (df["month"] == month).any()])
+
+def spill(paths, carriers=None, out=SPILL):
+    """Partition the input files by month in one chunked pass: each chunk's rows go to
+       out/month=YYYY-MM/part-NNNNN.parquet. -> month keys covered"""
+    if out.exists():
+        shutil.rmtree(out)
+    months = set()
+    with instrument.span("flights.spill") as sp:
+        for i, df in enumerate(_chunks(paths, carriers)):
+            for m, part in df.groupby("month", sort=True):
+                d = out / f"month={month_label(int(m))}"
+                d.mkdir(parents=True, exist_ok=True)
+                part.to_parquet(d / f"part-{i:05d}.parquet", index=False)
+                months.add(int(m))
+            sp.add(rows_out=len(df))
+    return months
+
+def read_spilled(month, out=SPILL):
+    """One month of flights from its spilled pieces."""
+    pieces = sorted((out / f"month={month_label(month)}").glob("part-*.parquet"))
+    return _flights([pd.read_parquet(p) for p in pieces])
+
+# peak-hour passenger factor and congestion for the synthetic stand-in, by departure hour
+_LOAD = np.interp(np.arange(24), [0, 6, 8, 11, 14, 17, 19, 22, 23], [0.8, 0.95, 1.15, 0.9, 0.9, 1.15, 1.05, 0.85, 0.8])
+_CONGESTION = np.interp(np.arange(24), [0, 7, 9, 12, 16, 19, 23], [1.0, 1.04, 1.06, 1.02, 1.07, 1.05, 1.0])
+
+def synthetic(econ, seed=0):
+    """Stand-in schedule for one carrier-month of fact_route_economics rows: each row's
+       departures become daily frequencies (same time and flight number every day) dealt
+       over the month. Flights carry their row index as `seg`."""
+    m = int(econ["month"].iloc[0])
+    ndays = calendar.monthrange(m // 100, m % 100)[1]
+    rng = np.random.default_rng([seed, m, zlib.crc32(str(econ["carrier"].iloc[0]).encode())])
+    dep = econ["departures"].to_numpy(int).clip(min=0)
+    seg = np.repeat(np.arange(len(econ)), dep)
+    i = np.arange(len(seg)) - np.repeat(np.cumsum(dep) - dep, dep)
+    freq = -(-dep // ndays)                                            # daily frequencies per row
+    slot = np.repeat(np.cumsum(freq) - freq, dep) + i // ndays
+    # departure times: banked waves between 06:00 and 21:55, 5-minute grid
+    minute = np.clip(rng.normal(rng.choice([8, 12, 17, 20], freq.sum(), p=[0.35, 0.2, 0.3, 0.15]) * 60, 75),
+                     360, 1315).astype(int) // 5 * 5
+    hour = (minute // 60)[slot]
+    fl = pd.DataFrame({
+        "seg": seg, "day": (i % ndays + 1).astype("int8"),
+        "dep_time": ((minute // 60) * 100 + minute % 60)[slot],
+        "flight_no": (np.arange(freq.sum()) % 9000 + 1)[slot],
+        "block_hours": _CONGESTION[hour] * rng.lognormal(0.0, 0.04, len(seg)),
+        "seats": np.nan,
+        "pax": _LOAD[hour] * rng.lognormal(0.0, 0.12, len(seg)),
+    })
+    return fl
+
+# --- matching ---
+def _codes(values, categories):
+    """Positions of values in categories (-1 where missing), looked up once per distinct value."""
+    codes, uniq = pd.factorize(pd.Series(values).astype(str), use_na_sentinel=False)
+    return pd.Index(categories.astype(str)).get_indexer(uniq)[codes]
+
+def match(fl, econ):
+    """Row of econ each flight belongs to (-1: no segment row for its carrier-OD)."""
+    cats = {c: econ[c].cat.categories for c in ["carrier", "origin", "dest", "fleet_type"]}
+    n_ap, n_fl = len(cats["origin"]) + 1, len(cats["fleet_type"]) + 1
+    f_od = ((_codes(fl["carrier"], cats["carrier"]) + 1) * n_ap
+            + _codes(fl["origin"], cats["origin"]) + 1) * n_ap + _codes(fl["dest"], cats["dest"]) + 1
+    e_od = ((econ["carrier"].cat.codes.to_numpy(np.int64) + 1) * n_ap
+            + econ["origin"].cat.codes.to_numpy() + 1) * n_ap + econ["dest"].cat.codes.to_numpy() + 1
+    seg = np.full(len(fl), -1)
+    if fl["fleet_type"].notna().any():
+        f_key = f_od * n_fl + _codes(fl["fleet_type"], cats["fleet_type"]) + 1
+        seg = pd.Index(e_od * n_fl + econ["fleet_type"].cat.codes.to_numpy() + 1).get_indexer(f_key)
+
+    # the rest: dealt over the OD's fleets by T-100 departure share, in departure order
+    todo = np.flatnonzero(seg < 0)
+    if len(todo):
+        order = np.argsort(e_od, kind="stable")
+        ods, start = np.unique(e_od[order], return_index=True)
+        gid = ods.searchsorted(f_od[todo])
+        ok = (gid < len(ods)) & (ods[np.minimum(gid, len(ods) - 1)] == f_od[todo])
+        todo, gid = todo[ok], gid[ok]
+        # rank of each flight within its OD by day and time
+        srt = np.lexsort((fl["dep_time"].to_numpy()[todo], fl["day"].to_numpy()[todo], gid))
+        todo, gid = todo[srt], gid[srt]
+        n = np.bincount(gid, minlength=len(ods))
+        first = np.cumsum(n) - n
+        u = gid + (np.arange(len(todo)) - first[gid] + 0.5) / n[gid]
+        # cumulative departure shares of the OD's fleets, offset by the OD's index: flight
+        # position u falls into the first fleet whose bound reaches it
+        cnt = np.diff(np.append(start, len(order)))
+        g = np.repeat(np.arange(len(ods)), cnt)
+        d = econ["departures"].to_numpy(float)[order]
+        tot = np.bincount(g, weights=d, minlength=len(ods))[g]
+        w = np.where(tot > 0, d / np.where(tot > 0, tot, 1.0), 1.0 / cnt[g])
+        cw = np.cumsum(w)
+        cum = cw - np.repeat(np.append(0.0, cw[start[1:] - 1]), cnt)
+        cum[start + cnt - 1] = 1.0
+        seg[todo] = order[np.minimum((g + cum).searchsorted(u, side="left"), len(order) - 1)]
+    return seg
+
+# --- split ---
+def _shares(v, seg, n):
+    """Within-row shares of flight field v; missing values take the row's mean, rows
+       without any value (or summing to 0) split equally."""
+    per = np.bincount(seg, minlength=n)
+    known = ~np.isnan(v)
+    if not known.any():
+        return 1.0 / per[seg]
+    if not known.all():
+        cnt = np.bincount(seg, weights=known, minlength=n)
+        mean = np.bincount(seg, weights=np.where(known, v, 0.0), minlength=n) / np.where(cnt > 0, cnt, 1)
+        v = np.where(known, v, mean[seg])
+    tot = np.bincount(seg, weights=v, minlength=n)
+    return np.where(tot[seg] > 0, v / np.where(tot > 0, tot, 1.0)[seg], 1.0 / per[seg])
+
+def driver_mix(econ, cfg):
+    """{flight field: rows x buckets} share of each row's bucket cost that its drivers
+       behind that field produced: weight x the row's share of the month's driver total,
+       normalized per bucket."""
+    b = compile_buckets(cfg)
+    fuel = cfg["fuel"].get("driver", "block_hours")
+    x = {k: econ[k].to_numpy(float) for k in DRIVERS if k != "fuel_driver"}
+    x["fuel_driver"] = econ[fuel].to_numpy(float) * burn_rates(econ["fleet_type"], cfg).to_numpy(float)
+    S = driver_shares(econ, np.column_stack([x[k] for k in b.drivers]))     # rows x drivers
+    mix = {}
+    for j in range(len(b.names)):
+        P = S * b.W[:, j]
+        tot = P.sum(axis=1, keepdims=True)
+        P = np.where(tot > 0, P / np.where(tot > 0, tot, 1.0), b.W[:, j] / b.W[:, j].sum())
+        for i, k in enumerate(b.drivers):
+            f = FIELD[fuel] if k == "fuel_driver" else FIELD[k]
+            mix.setdefault(f, np.zeros((len(econ), len(b.names))))[:, j] += P[:, i]
+    return mix
+
+def split(econ, fl, cfg):
+    """Flight economics for one month's econ rows and their matched flights (fl["seg"])."""
+    econ = econ.reset_index(drop=True)
+    fl = fl[fl["seg"] >= 0]
+    R, seg = len(econ), fl["seg"].to_numpy()
+    fields = {"departures": np.ones(len(fl)), "block_hours": fl["block_hours"].to_numpy(float),
+              "seats": fl["seats"].to_numpy(float), "pax": fl["pax"].to_numpy(float)}
+    # passengers unknown: seats carry the share, then equal
+    fields["pax"] = np.where(np.isnan(fields["pax"]), fields["seats"], fields["pax"])
+    s = {f: _shares(v, seg, R) for f, v in fields.items()}
+
+    out = {k: pd.Categorical.from_codes(econ[k].cat.codes.to_numpy()[seg], dtype=econ[k].dtype)
+           for k in KEYS if k != "month"}
+    out["month"] = econ["month"].to_numpy()[seg]
+    out.update({"day": fl["day"].to_numpy(), "dep_time": fl["dep_time"].to_numpy(),
+                "flight_no": fl["flight_no"].to_numpy()})
+    for c, f in MEASURES.items():
+        out[c] = econ[c].to_numpy(float)[seg] * s[f]
+    costs = bucket_costs(econ)
+    frac = sum(mix[seg] * s[f][:, None] for f, mix in driver_mix(econ, cfg).items())
+    C = econ[costs].to_numpy(float)[seg] * frac
+    out.update(zip(costs, C.T))
+    flights = pd.DataFrame(out)
+
+    # rows no flight matched stay whole, unscheduled
+    rest = econ[np.bincount(seg, minlength=R) == 0]
+    rest = rest[KEYS + list(MEASURES) + costs].assign(day=np.nan, dep_time=np.nan, flight_no=np.nan)
+    df = pd.concat([flights, rest], ignore_index=True) if len(rest) else flights
+    df = df.astype({"day": "Int8", "dep_time": "Int16", "flight_no": "Int32"})
+    df["rasm"] = np.where(df["ASMs"] > 0, df["revenue"] / df["ASMs"].where(df["ASMs"] > 0), np.nan)
+    df = add_totals(df)
+    return df[KEYS[:2] + FLIGHT + KEYS[2:] + OUT_COLS[5:12] + costs + OUT_COLS[16:]]
+
+def rollup_error(flights, econ):
+    """Largest relative gap between a segment row and the sum of its flights, over the
+       additive columns."""
+    cols = list(MEASURES) + bucket_costs(econ) + ["total_cost"]
+    got = flights.groupby(KEYS, observed=True)[cols].sum()
+    want = econ.set_index(KEYS)[cols].reindex(got.index)
+    scale = want.abs().clip(lower=1.0)
+    return float(((got - want).abs() / scale).to_numpy().max()) if len(got) else 0.0
+
+# --- jobs ---
+def _month_job(month, spilled, carriers, seed, cfg):
+    """One month: read its econ rows and flights (spilled: from the month's spilled pieces,
+       else synthetic), then split and write one carrier at a time, so at most one
+       carrier-month of flight economics is in memory. -> (stats, profiling spans)"""
+    econ = fact_store.read("fact_route_economics", months=[month], carriers=carriers).reset_index(drop=True)
+    stats = {"month": month_label(month), "segments": len(econ), "flights": 0, "unmatched": 0,
+             "unscheduled": 0, "rows": 0, "error": 0.0}
+    fl = None
+    if spilled and len(econ):
+        with instrument.span("flights.match", month=month_label(month)) as sp:
+            fl = read_spilled(month)
+            fl["seg"] = match(fl, econ)
+            sp.add(rows_in=len(fl))
+        stats["unmatched"] = int((fl["seg"] < 0).sum())
+        fl = fl[fl["seg"] >= 0]
+        owner = econ["carrier"].cat.codes.to_numpy()[fl["seg"].to_numpy()]
+    for code, rows in econ.groupby(econ["carrier"].cat.codes, sort=True).indices.items():
+        part = econ.iloc[rows].reset_index(drop=True)
+        if fl is None:
+            sub = synthetic(part, seed)
+        else:
+            local = np.full(len(econ), -1)
+            local[rows] = np.arange(len(rows))
+            sub = fl[owner == code]
+            sub = sub.assign(seg=local[sub["seg"].to_numpy()])
+        with instrument.span("flights.split", month=month_label(month), rows_in=len(sub)) as sp:
+            out = split(part, sub, cfg)
+            sp.add(rows_out=len(out))
+        stats["flights"] += len(sub)
+        stats["unscheduled"] += int(out["day"].isna().sum())
+        stats["rows"] += len(out)
+        stats["error"] = max(stats["error"], rollup_error(out, part))
+        fact_store.write(out, TABLE)
+        del out
+    return stats, instrument.drain()
+
+@instrument.traced("flights")
+def build(months=None, paths=None, workers=1, carriers=None, seed=0):
+    """fact_flight_economics for every allocated month (and with input files, only the
+       months they cover); paths=None uses the synthetic stand-in."""
+    cfg = load_config()
+    have = fact_store.list_months("fact_route_economics", carriers=carriers)
+    todo = sorted(month_key(m) for m in have) if months is None else sorted(month_key(m) for m in months)
+    # flights of carrier-months no longer allocated
+    want_m = None if months is None else {month_label(m) for m in months}
+    econ = set(fact_store.list_partitions("fact_route_economics"))
+    gone = [(c, m) for c, m in fact_store.list_partitions(TABLE)
+            if (c, m) not in econ and (want_m is None or m in want_m) and (carriers is None or c in set(carriers))]
+    if gone:
+        fact_store.drop(TABLE, gone)
+        print(f"[flights] removed {[f'{c}:{m}' for c, m in gone]} (no longer in fact_route_economics)")
+    if paths:
+        paths = [Path(p) if Path(p).exists() else RAW / p for p in paths]
+        cover = spill(paths, carriers)
+        missing = [month_label(m) for m in todo if m not in cover]
+        if missing:
+            print(f"[flights] no flights in the input for {missing}; skipped")
+        todo = [m for m in todo if m in cover]
+
+    args = [(m, bool(paths), carriers, seed, cfg) for m in todo]
+    stats = []
+    try:
+        if workers and workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as ex:
+                for st, events in ex.map(_month_job, *zip(*args)):
+                    stats.append(st); instrument.absorb(events)
+        else:
+            for a in args:
+                st, events = _month_job(*a)
+                stats.append(st); instrument.absorb(events)
+    finally:
+        if paths:
+            shutil.rmtree(SPILL, ignore_errors=True)
+
+    for st in stats:
+        if st["segments"]:
+            print(f"[flights] {st['month']}: {st['flights']:,} flights over {st['segments']:,} segment rows "
+                  f"({st['unscheduled']:,} unscheduled, {st['unmatched']:,} flights unmatched), "
+                  f"max roll-up error {st['error']:.1e}")
+    print(f"Wrote {DATA_WORK / TABLE} with {sum(st.get('rows', 0) for st in stats):,} rows for "
+          f"{len(stats)} months ({'synthetic flights' if not paths else f'{len(paths)} flight files'})")
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    from utils import parse_carriers, parse_months
+
+    p = argparse.ArgumentParser()
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--files", nargs="+", help="per-departure CSVs (data_raw/ names or paths): a schedule "
+                                                "or BTS On-Time Reporting downloads")
+    src.add_argument("--synthetic", action="store_true", help="stand-in flights from T-100 departures")
+    p.add_argument("--months", help="YYYY-MM, YYYY-MM..YYYY-MM or comma list (default: all allocated)")
+    p.add_argument("--carriers", help="comma list of carriers (default: all)")
+    p.add_argument("--workers", type=int, default=1, help="months in parallel")
+    p.add_argument("--seed", type=int, default=0, help="synthetic stand-in seed")
+    args = p.parse_args()
+    build(parse_months(args.months) if args.months else None, args.files, args.workers,
+          parse_carriers(args.carriers), args.seed)
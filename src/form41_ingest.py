@@ -1,9 +1,20 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import numpy as np
 import pandas as pd
 import re
+import delta
+import fact_store
+import instrument
+import schema
+from utils import month_key, month_label, parse_carriers
 
 RAW  = Path("data_raw")
 WORK = Path("data_work"); WORK.mkdir(exist_ok=True)
+CHUNK_ROWS = 1_000_000
 
 def _norm(df):
     df.columns = [re.sub(r"[^A-Z0-9]+", "_", c.upper()).strip("_") for c in df.columns]
@@ -15,141 +26,193 @@ def _first(df, candidates):
             return c
     raise KeyError(f"Missing any of {candidates}. Have: {list(df.columns)[:30]}")
 
-def build_p12a(p12a_csv: str):
-    """Fuel dollars + gallons per month for WN from P-12(a)."""
-    df = pd.read_csv(RAW / p12a_csv, low_memory=False)
-    df = _norm(df)
-
-    carrier = _first(df, ["CARRIER", "UNIQUECARRIER", "AIRLINEID"])
-    year    = _first(df, ["YEAR"])
-    month   = _first(df, ["MONTH"])
-
-    gallon_candidates = [
-        "STDOMGALLONS", "SDOMGALLONS",
-        "SDOMT_GALLONS",
-        "TDOMTGALLONS",
-        "TSGALLONS",
-        "TOTALGALLONS",
-    ]
-    cost_candidates = [
-        "STDOMCOST", "SDOMCOST",
-        "SDOMT_COST",
-        "TDOMTCOST",
-        "TSCOST",
-        "TOTALCOST",
-    ]
-
-    gallons = next((c for c in gallon_candidates if c in df.columns), None)
-    cost    = next((c for c in cost_candidates    if c in df.columns), None)
+GALLON_CANDIDATES = ["STDOMGALLONS", "SDOMGALLONS", "SDOMT_GALLONS", "TDOMTGALLONS", "TSGALLONS", "TOTALGALLONS"]
+COST_CANDIDATES   = ["STDOMCOST", "SDOMCOST", "SDOMT_COST", "TDOMTCOST", "TSCOST", "TOTALCOST"]
+CARRIER_CANDIDATES = ["CARRIER", "UNIQUE_CARRIER", "UNIQUECARRIER", "AIRLINE_ID", "AIRLINEID"]
+
+# Heuristics for P-5.2 buckets
+LABOR_PATTERNS   = [r"PILOT", r"OTH(ER)?_?FLT", r"FLIGHT_PERSONNEL", r"BENEFIT", r"PERSONNEL",
+                    r"WAGE", r"PAYROLL", r"SALAR"]
+MAINT_PATTERNS   = [r"MAINT", r"REPAIR", r"OVERHAUL", r"AIRWORTH", r"MATERIALS"]
+STATION_PATTERNS = [r"TOTAIROPEXPENSES", r"STATION", r"GROUND", r"HANDLING", r"TRAFFIC"]
+# Prefer explicit fields if present (underscore variants from your file)
+FAVORITES = {
+    "labor":   ["PILOT_FLY_OPS","OTH_FLT_FLY_OPS","BENEFITS_FLY_OPS","PILOTFLYOPS","OTHFLTFLYOPS","BENEFITSFLYOPS"],
+    "maint":   ["TOT_DIR_MAINT","TOTDIRMAINT"],
+    "station": ["TOT_AIR_OP_EXPENSES","TOTAIROPEXPENSES"],
+}
+PATTERNS = {"labor": LABOR_PATTERNS, "maint": MAINT_PATTERNS, "station": STATION_PATTERNS}
+
+RESOLVED = WORK / ".form41_columns.json"
+_resolved = {}
+_lock = threading.Lock()   # P-12(a) and P-5.2 resolve from two threads
+
+def _signature(path):
+    st = os.stat(path)
+    return f"{Path(path).resolve()}:{st.st_size}:{st.st_mtime_ns}"
+
+def _header(path):
+    """Normalized header only -> {normalized name: raw name}."""
+    raw_cols = pd.read_csv(path, nrows=0).columns
+    return dict(zip(_norm(pd.DataFrame(columns=raw_cols)).columns, raw_cols))
+
+def _resolve(path, kind, resolver):
+    """Column resolution for one raw file, cached per file signature (path, size, mtime)
+       in memory and in data_work/.form41_columns.json."""
+    global _resolved
+    key = f"{kind}|{_signature(path)}"
+    with _lock:
+        if not _resolved and RESOLVED.exists():
+            _resolved = json.loads(RESOLVED.read_text())
+        if key not in _resolved:
+            hdr = _header(path)
+            _resolved[key] = {"columns": resolver(pd.DataFrame(columns=list(hdr))), "raw": hdr}
+            tmp = RESOLVED.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(_resolved, indent=1))
+            os.replace(tmp, RESOLVED)
+        return _resolved[key]["columns"], _resolved[key]["raw"]
+
+def _read(path, use, hdr, carrier_col, carriers):
+    """Read only the resolved columns, filtering the carriers (None: all) per chunk."""
+    rename = {hdr[c]: c for c in use}
+    parts = []
+    for df in pd.read_csv(path, usecols=list(rename), dtype={hdr[carrier_col]: str},
+                          chunksize=CHUNK_ROWS):
+        df = df.rename(columns=rename)
+        df[carrier_col] = df[carrier_col].str.strip().str.upper()
+        if carriers is not None:
+            df = df[df[carrier_col].isin(carriers)]
+        parts.append(df)
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=use)
+
+def _resolve_p12a(cols):
+    gallons = next((c for c in GALLON_CANDIDATES if c in cols.columns), None)
+    cost    = next((c for c in COST_CANDIDATES    if c in cols.columns), None)
     if gallons is None or cost is None:
-        raise KeyError(f"P-12(a) columns not found. Tried gallons={gallon_candidates}, cost={cost_candidates}")
-
-    df[carrier] = df[carrier].astype(str).str.strip().str.upper()
-    df = df[df[carrier] == "WN"].copy()
-
-    g = (df.groupby([year, month], as_index=False)
-           .agg({gallons: "sum", cost: "sum"}))
-
-    g["month"] = pd.to_datetime(
-        g[year].astype(int).astype(str) + "-" + g[month].astype(int).astype(str) + "-01"
-    ).dt.strftime("%Y-%m")
-
-    out = g.rename(columns={gallons: "fuel_gallons", cost: "fuel_expense"})
-    return out[["month", "fuel_expense", "fuel_gallons"]]
+        raise KeyError(f"P-12(a) columns not found. Tried gallons={GALLON_CANDIDATES}, cost={COST_CANDIDATES}")
+    return {"carrier": _first(cols, CARRIER_CANDIDATES), "year": _first(cols, ["YEAR"]),
+            "month": _first(cols, ["MONTH"]), "gallons": gallons, "cost": cost}
+
+@instrument.traced("financials.p12a")
+def build_p12a(p12a_csv: str, carriers=("WN",)):
+    """Fuel dollars + gallons per carrier-month from P-12(a)."""
+    path = RAW / p12a_csv
+    c, hdr = _resolve(path, "p12a", _resolve_p12a)
+    with instrument.span("financials.p12a.read", bytes_read=instrument.file_bytes(path)) as sp:
+        df = _read(path, list(c.values()), hdr, c["carrier"], carriers)
+        sp.add(rows_out=len(df))
+
+    df[[c["gallons"], c["cost"]]] = df[[c["gallons"], c["cost"]]].apply(pd.to_numeric, errors="coerce")
+    g = (df.groupby([c["carrier"], c["year"], c["month"]], as_index=False)
+           .agg({c["gallons"]: "sum", c["cost"]: "sum"}))
+    g["month"] = (g[c["year"]].astype(int) * 100 + g[c["month"]].astype(int)).astype(schema.MONTH)
+
+    out = g.rename(columns={c["carrier"]: "carrier", c["gallons"]: "fuel_gallons", c["cost"]: "fuel_expense"})
+    return out[["carrier", "month", "fuel_expense", "fuel_gallons"]]
 
 def _match_any(name: str, patterns):
     return any(re.search(p, name) for p in patterns)
 
-def build_p52(p52_csv: str):
-    """Labor/Maint/Station per quarter for WN from P-5.2, then expand to months.
-       Auto-detects reasonable columns if the exact ones aren’t present."""
-    df = pd.read_csv(RAW / p52_csv, low_memory=False)
-    df = _norm(df)
-
-    carrier = _first(df, ["CARRIER", "UNIQUECARRIER", "AIRLINEID"])
-    year    = _first(df, ["YEAR"])
-    quarter = _first(df, ["QUARTER"])
-
-    # Heuristics for buckets
-    labor_patterns   = [r"PILOT", r"OTH(ER)?_?FLT", r"FLIGHT_PERSONNEL", r"BENEFIT", r"PERSONNEL",
-                        r"WAGE", r"PAYROLL", r"SALAR"]
-    maint_patterns   = [r"MAINT", r"REPAIR", r"OVERHAUL", r"AIRWORTH", r"MATERIALS"]
-    station_patterns = [r"TOTAIROPEXPENSES", r"STATION", r"GROUND", r"HANDLING", r"TRAFFIC"]
-
-    cols = df.columns.tolist()
-
-    # Explicit favorites if present
-    # Prefer explicit fields if present (underscore variants from your file)
-    favorites_labor   = [c for c in ["PILOT_FLY_OPS","OTH_FLT_FLY_OPS","BENEFITS_FLY_OPS",
-                                    "PILOTFLYOPS","OTHFLTFLYOPS","BENEFITSFLYOPS"] if c in cols]
-    favorites_maint   = [c for c in ["TOT_DIR_MAINT","TOTDIRMAINT"] if c in cols]
-    favorites_station = [c for c in ["TOT_AIR_OP_EXPENSES","TOTAIROPEXPENSES"] if c in cols]
-
-    # Regex discovery
-    if not favorites_labor:
-        favorites_labor = [c for c in cols if _match_any(c, labor_patterns)]
-    if not favorites_maint:
-        favorites_maint = [c for c in cols if _match_any(c, maint_patterns)]
-    if not favorites_station:
-        favorites_station = [c for c in cols if _match_any(c, station_patterns)]
-
+def _resolve_p52(cols):
+    """Auto-detects reasonable bucket columns if the exact ones aren’t present."""
+    names = cols.columns.tolist()
+    buckets = {}
+    for b in ("labor", "maint", "station"):
+        buckets[b] = ([c for c in FAVORITES[b] if c in names]
+                      or [c for c in names if _match_any(c, PATTERNS[b])])
     # Require at least one column per bucket
-    if not favorites_labor:
+    if not buckets["labor"]:
         raise KeyError("Could not find any labor-like columns in P-5.2. Check your field selections.")
-    if not favorites_maint:
+    if not buckets["maint"]:
         raise KeyError("Could not find any maintenance-like columns in P-5.2. Check your field selections.")
-    if not favorites_station:
+    if not buckets["station"]:
         raise KeyError("Could not find any station/ops-like columns in P-5.2. Check your field selections.")
+    return {"carrier": _first(cols, CARRIER_CANDIDATES), "year": _first(cols, ["YEAR"]),
+            "quarter": _first(cols, ["QUARTER"]), **buckets}
+
+@instrument.traced("financials.p52")
+def build_p52(p52_csv: str, carriers=("WN",)):
+    """Labor/Maint/Station per carrier-quarter from P-5.2, then expand to months."""
+    path = RAW / p52_csv
+    c, hdr = _resolve(path, "p52", _resolve_p52)
+    numeric = list(dict.fromkeys(c["labor"] + c["maint"] + c["station"]))
+    with instrument.span("financials.p52.read", bytes_read=instrument.file_bytes(path)) as sp:
+        df = _read(path, list(dict.fromkeys([c["carrier"], c["year"], c["quarter"]] + numeric)),
+                   hdr, c["carrier"], carriers)
+        sp.add(rows_out=len(df))
 
-    numeric = list(set(favorites_labor + favorites_maint + favorites_station))
-    # Detect "(000)" dollars: if max values look small, multiply by 1000.
     df[numeric] = df[numeric].apply(pd.to_numeric, errors="coerce").fillna(0.0)
-    scale = 1000.0 if df[numeric].max().max() < 1e9 else 1.0
-    df[numeric] = df[numeric] * scale
-
-    df[carrier] = df[carrier].astype(str).str.strip().str.upper()
-    df = df[df[carrier] == "WN"].copy()
+    # Detect "(000)" dollars per carrier from its own values: if max looks small, multiply by 1000.
+    peak = df.groupby(c["carrier"])[numeric].transform("max").max(axis=1)
+    df[numeric] = df[numeric].mul(np.where(peak < 1e9, 1000.0, 1.0), axis=0)
 
-    agg = {c: "sum" for c in numeric}
-    q = df.groupby([year, quarter], as_index=False).agg(agg)
+    q = df.groupby([c["carrier"], c["year"], c["quarter"]], as_index=False).agg({k: "sum" for k in numeric})
 
     # For transparency, print which columns got used
     print("[P-5.2] Using columns:",
-          "\n  labor   =", favorites_labor,
-          "\n  maint   =", favorites_maint,
-          "\n  station =", favorites_station)
-
-    # Quarterly → monthly thirds
-    rows = []
-    for _, r in q.iterrows():
-        y = int(r[year]); qtr = int(r[quarter])
-        months = {1:[1,2,3], 2:[4,5,6], 3:[7,8,9], 4:[10,11,12]}[qtr]
-        labor_sum   = float(sum(r[c] for c in favorites_labor))
-        maint_sum   = float(sum(r[c] for c in favorites_maint))
-        station_sum = float(sum(r[c] for c in favorites_station))
-        for m in months:
-            rows.append({
-                "month": f"{y}-{m:02d}",
-                "labor_expense":   labor_sum   / 3.0,
-                "maint_expense":   maint_sum   / 3.0,
-                "station_other":   station_sum / 3.0,
-            })
-    out = pd.DataFrame(rows)
-    return out[["month","labor_expense","maint_expense","station_other"]]
-
-def build_fact_financials(p12a_csv: str, p52_csv: str):
-    fuel  = build_p12a(p12a_csv)
-    ops   = build_p52(p52_csv)
-
-    seg = pd.read_csv(WORK / "fact_segments.csv")
-    months = seg["month"].unique()
-
-    fin = pd.merge(ops, fuel, on="month", how="outer").fillna(0.0)
-    fin = fin[fin["month"].isin(months)].copy()
-
-    fin = fin[["month","fuel_expense","labor_expense","maint_expense","station_other","fuel_gallons"]]
-    fin.to_csv(WORK / "fact_financials.csv", index=False)
-    print(f"Wrote {WORK/'fact_financials.csv'} with {len(fin)} months.")
+          "\n  labor   =", c["labor"],
+          "\n  maint   =", c["maint"],
+          "\n  station =", c["station"])
+
+    with instrument.span("financials.p52.expand", rows_in=len(q)) as sp:
+        # Quarterly → monthly thirds: repeat each quarter row 3x and offset the month
+        m = q.loc[q.index.repeat(3)].reset_index(drop=True)
+        mnum = (m[c["quarter"]].astype(int).to_numpy() - 1) * 3 + np.tile([1, 2, 3], len(q))
+        out = pd.DataFrame({
+            "carrier":       m[c["carrier"]].to_numpy(),
+            "month":         (m[c["year"]].astype(int).to_numpy() * 100 + mnum).astype(schema.MONTH),
+            "labor_expense": m[c["labor"]].sum(axis=1).to_numpy() / 3.0,
+            "maint_expense": m[c["maint"]].sum(axis=1).to_numpy() / 3.0,
+            "station_other": m[c["station"]].sum(axis=1).to_numpy() / 3.0,
+        })
+        sp.add(rows_out=len(out))
+    return out[["carrier","month","labor_expense","maint_expense","station_other"]]
+
+def _periods(fin):
+    """carrier/YYYY-MM label per row (the append-mode partitions)."""
+    return (fin["carrier"].astype(str) + "/" + fin["month"].map(month_label)).to_numpy()
+
+@instrument.traced("financials")
+def build_fact_financials(p12a_csv: str, p52_csv: str, carriers=("WN",), append=False):
+    # P-12(a) and P-5.2 are independent reads; overlap them
+    # append: both files are a few rows per carrier-month and are still read whole (the P-5.2
+    # "(000)" check looks at a carrier's whole history), but only carrier-months whose
+    # totals changed or that fact_segments gained or lost are written
+    carriers = parse_carriers(carriers)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fuel_f = ex.submit(build_p12a, p12a_csv, carriers)
+        ops_f  = ex.submit(build_p52, p52_csv, carriers)
+        fuel, ops = fuel_f.result(), ops_f.result()
+
+    # keep the carrier-months the segment table has (partition names only)
+    have = pd.DataFrame(fact_store.list_partitions("fact_segments"), columns=["carrier", "month"])
+    have["month"] = have["month"].map(month_key).astype(schema.MONTH)
+
+    fin = pd.merge(ops, fuel, on=["carrier","month"], how="outer").fillna(0.0)
+    fin = fin.merge(have, on=["carrier","month"], how="inner")
+
+    fin = fin[["carrier","month","fuel_expense","labor_expense","maint_expense","station_other","fuel_gallons"]]
+    version = {"carriers": carriers}
+    entry = delta.load("financials", version) if append else None
+    parts = delta.digests(fin, _periods(fin))
+    months = None
+    if entry is not None:
+        months = sorted({k.split("/", 1)[1] for k in delta.changed_parts(entry["parts"], parts)})
+        if not months:
+            print(f"{WORK/'fact_financials'} up to date")
+            return
+        fin = fin[fin["month"].isin({month_key(m) for m in months})]
+    fact_store.write(fin, "fact_financials", overwrite=True, carriers=carriers, months=months)
+    delta.save("financials", version, parts=parts)
+    print(f"Wrote {WORK/'fact_financials'} with {len(fin)} carrier-months"
+          + (f" ({', '.join(months)})." if months is not None else "."))
 
 if __name__ == "__main__":
-    build_fact_financials("FORM41_P12A_2023.csv", "FORM41_P52_2023.csv")
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument("--carriers", default="WN", help="comma list of carriers, or 'all' (one pass either way)")
+    p.add_argument("--append", action="store_true",
+                   help="only write carrier-months that are new or changed since the last run")
+    args = p.parse_args()
+    build_fact_financials("FORM41_P12A_2023.csv", "FORM41_P52_2023.csv", carriers=args.carriers,
+                          append=args.append)
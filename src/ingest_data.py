@@ -1,50 +1,145 @@
 # src/ingest_data.py
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os
 import pandas as pd
+import delta
+import distances
+import fact_store
+import instrument
+import schema
+from utils import CONFIG, load_config, month_label, parse_carriers
 
 RAW = Path("data_raw")
 WORK = Path("data_work"); WORK.mkdir(exist_ok=True)
 
-def _load_one(path):
-    df = pd.read_csv(path, low_memory=False)
-    df.columns = [c.upper().strip() for c in df.columns]
-    need = ["YEAR","MONTH","CARRIER","ORIGIN","DEST","AIRCRAFT_TYPE",
-            "DEPARTURES_PERFORMED","RAMP_TO_RAMP","SEATS","PASSENGERS","DISTANCE"]
-    df = df[need].copy()
-    return df
+CHUNK_ROWS = 1_000_000
+KEYS = ["YEAR","MONTH","CARRIER","ORIGIN","DEST","AIRCRAFT_TYPE"]
+SUMS = ["DEPARTURES_PERFORMED","RAMP_TO_RAMP","SEATS","PASSENGERS"]
+NEED = KEYS + SUMS + ["DISTANCE"]
+DTYPES = {"YEAR":"float64","MONTH":"float64","CARRIER":str,"ORIGIN":str,"DEST":str,
+          "AIRCRAFT_TYPE":str,"DEPARTURES_PERFORMED":"float64","RAMP_TO_RAMP":"float64",
+          "SEATS":"float64","PASSENGERS":"float64","DISTANCE":"float64"}
 
-def build_fact_segments(raw_files, out_csv="fact_segments.csv", carrier="WN"):
-    # raw_files: list[str] or single str
+def _partial_one(path, carriers=("WN",), chunksize=CHUNK_ROWS):
+    """Partial carrier–month–OD–aircraft aggregate of one T-100 file (carriers=None: all).
+       DISTANCE is carried as sum + count so partials can be merged into a mean."""
+    raw_cols = pd.read_csv(path, nrows=0).columns
+    hdr = {c.upper().strip(): c for c in raw_cols}
+    missing = [c for c in NEED if c not in hdr]
+    if missing:
+        raise KeyError(f"{path}: missing T-100 columns {missing}")
+
+    parts = []
+    with instrument.span("segments.read_file", file=str(path), bytes_read=instrument.file_bytes(path)) as sp:
+        for df in pd.read_csv(path, usecols=[hdr[c] for c in NEED],
+                              dtype={hdr[c]: DTYPES[c] for c in NEED}, chunksize=chunksize):
+            sp.add(rows_in=len(df))
+            df.columns = [c.upper().strip() for c in df.columns]
+
+            # normalize and filter before aggregating
+            df["CARRIER"] = df["CARRIER"].astype(str).str.strip().str.upper()
+            if carriers is not None:
+                df = df[df["CARRIER"].isin(carriers)]
+            if df.empty:
+                continue
+
+            # a zero distance is a missing one; left in, it would drag the key's mean down
+            df["DISTANCE"] = df["DISTANCE"].where(df["DISTANCE"] > 0)
+            df["DIST_N"] = df["DISTANCE"].notna().astype("int64")
+            parts.append(df.groupby(KEYS, as_index=False)
+                           .agg({**{c: "sum" for c in SUMS}, "DISTANCE": "sum", "DIST_N": "sum"}))
+
+        out = _merge_partials(parts) if parts else pd.DataFrame(columns=KEYS + SUMS + ["DISTANCE","DIST_N"])
+        sp.add(rows_out=len(out))
+    return out
+
+def _partial_job(path, carriers, chunksize):
+    """Pool entry point: partial aggregate plus this worker's profiling spans."""
+    return _partial_one(path, carriers, chunksize), instrument.drain()
+
+def _merge_partials(parts):
+    df = pd.concat(parts, ignore_index=True)
+    return (df.groupby(KEYS, as_index=False)
+              .agg({**{c: "sum" for c in SUMS}, "DISTANCE": "sum", "DIST_N": "sum"}))
+
+def _read_partials(paths, carriers, workers, chunksize):
+    """One partial aggregate per file; files are read in parallel."""
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = []
+            for part, events in ex.map(_partial_job, paths, [carriers]*len(paths), [chunksize]*len(paths)):
+                parts.append(part); instrument.absorb(events)
+        return parts
+    return [_partial_one(p, carriers, chunksize) for p in paths]
+
+def _months(part):
+    """YYYY-MM label per partial row (the append-mode partitions)."""
+    key = (part["YEAR"] * 100 + part["MONTH"]).astype("int64")
+    return key.map({k: month_label(k) for k in key.unique()}).to_numpy()
+
+@instrument.traced("segments")
+def build_fact_segments(raw_files, table="fact_segments", carriers=("WN",),
+                        workers=None, chunksize=CHUNK_ROWS, append=False):
+    # raw_files: list[str] or single str; carriers: codes, "all" or None
+    # every requested carrier comes out of the same single pass over each file
+    # append: only months that are new or changed in the raw files are re-ingested (delta.py)
     if isinstance(raw_files, str): raw_files = [raw_files]
-    df = pd.concat([_load_one(RAW/f) for f in raw_files], ignore_index=True)
+    carriers = parse_carriers(carriers)
+    paths = [RAW/f for f in raw_files]
 
-    # normalize and filter
-    df["CARRIER"] = df["CARRIER"].astype(str).str.strip().str.upper()
-    df = df[df["CARRIER"] == carrier]
+    cfg = load_config() if CONFIG.exists() else {}
+    version = {"table": table, "carriers": carriers, "coords": distances.version(),
+               "distances": distances.settings(cfg)}
+    entry = delta.load("segments", version) if append else None
+    parts, months, files = delta.gather(entry, paths,
+                                        lambda ps: _read_partials(ps, carriers, workers, chunksize), _months)
+    if months is not None and not months:
+        delta.save("segments", version, files=files)
+        print(f"{WORK/table} up to date: no new or changed months in {len(paths)} T-100 files")
+        return
+    parts = parts or [pd.DataFrame(columns=KEYS + SUMS + ["DISTANCE","DIST_N"])]
 
     # aggregate to month–OD–aircraft
-    gcols = ["YEAR","MONTH","CARRIER","ORIGIN","DEST","AIRCRAFT_TYPE"]
-    df = (df.groupby(gcols, as_index=False)
-            .agg({"DEPARTURES_PERFORMED":"sum","RAMP_TO_RAMP":"sum",
-                  "SEATS":"sum","PASSENGERS":"sum","DISTANCE":"mean"}))
-
-    # compute target fields
-    df["month"]       = pd.to_datetime(df["YEAR"].astype(int).astype(str)+"-"+df["MONTH"].astype(int).astype(str)+"-01").dt.strftime("%Y-%m")
-    df["departures"]  = df["DEPARTURES_PERFORMED"].fillna(0).astype(int)
-    df["block_hours"] = (df["RAMP_TO_RAMP"].fillna(0) / 60.0)
-    df["ASMs"]        = (df["SEATS"].fillna(0) * df["DISTANCE"].fillna(0)).astype(float)
-    df["RPMs"]        = (df["PASSENGERS"].fillna(0) * df["DISTANCE"].fillna(0)).astype(float)
-    df["pax"]         = df["PASSENGERS"].fillna(0).astype(int)
-    df["fleet_type"]  = df["AIRCRAFT_TYPE"].astype(str)
-
-    out = df[["month","ORIGIN","DEST","fleet_type","departures","block_hours","ASMs","RPMs","pax"]] \
-            .rename(columns={"ORIGIN":"origin","DEST":"dest"})
-    out = out[(out["ASMs"]>0) & out["month"].notna()]
-    out.to_csv(WORK/out_csv, index=False)
-    print(f"Wrote {WORK/out_csv} with {len(out)} rows "
-          f"(years: {sorted(pd.to_datetime(out['month']).dt.year.unique())})")
+    with instrument.span("segments.merge", rows_in=sum(len(p) for p in parts)) as sp:
+        df = _merge_partials(parts)
+        sp.add(rows_out=len(df))
+    df["DISTANCE"] = df["DISTANCE"].where(df["DIST_N"] > 0) / df["DIST_N"].where(df["DIST_N"] > 0)
+    # check against the great circle; fills missing distances instead of losing their ASMs
+    with instrument.span("segments.distance", rows_in=len(df)):
+        df["DISTANCE"] = distances.validate(df, cfg, months=months)
+
+    with instrument.span("segments.derive", rows_in=len(df)) as sp:
+        # compute target fields
+        df["month"]       = (df["YEAR"] * 100 + df["MONTH"]).astype("int32")   # YYYYMM key
+        df["departures"]  = df["DEPARTURES_PERFORMED"].fillna(0).astype(int)
+        df["block_hours"] = (df["RAMP_TO_RAMP"].fillna(0) / 60.0)
+        df["ASMs"]        = (df["SEATS"].fillna(0) * df["DISTANCE"].fillna(0)).astype(float)
+        df["RPMs"]        = (df["PASSENGERS"].fillna(0) * df["DISTANCE"].fillna(0)).astype(float)
+        df["pax"]         = df["PASSENGERS"].fillna(0).astype(int)
+        df["fleet_type"]  = df["AIRCRAFT_TYPE"].astype(str)
+
+        out = df[["CARRIER","month","ORIGIN","DEST","fleet_type","departures","block_hours","ASMs","RPMs","pax"]] \
+                .rename(columns={"CARRIER":"carrier","ORIGIN":"origin","DEST":"dest"})
+        out = out[(out["ASMs"]>0) & out["month"].notna()]
+        # cast once: categorical airports/fleets, int32 counts (schema.py)
+        out = schema.cast(out, "fact_segments")
+        sp.add(rows_out=len(out))
+    fact_store.write(out, table, overwrite=True, carriers=carriers, months=months)
+    delta.save("segments", version, files=files)
+    print(f"Wrote {WORK/table} with {len(out)} rows "
+          f"(carriers: {sorted(out['carrier'].unique().astype(str).tolist())}, "
+          + (f"years: {sorted((out['month'] // 100).unique().tolist())})" if months is None
+             else f"months: {sorted(months)})"))
 
 if __name__ == "__main__":
-    # 2023 data
-    build_fact_segments(raw_files=["2023_T_T100D_SEGMENT_ALL_CARRIER.csv"])
-  
\ No newline at end of file
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument("--carriers", default="WN", help="comma list of carriers, or 'all' (one pass either way)")
+    p.add_argument("--files", nargs="+", default=["2023_T_T100D_SEGMENT_ALL_CARRIER.csv"],
+                   help="T-100 segment files in data_raw/ (default: 2023 data)")
+    p.add_argument("--append", action="store_true",
+                   help="only re-ingest months that are new or changed since the last run")
+    args = p.parse_args()
+    build_fact_segments(raw_files=args.files, carriers=args.carriers, append=args.append)
@@ -0,0 +1,158 @@
+"""
+Per-stage profiling spans
+- off by default; FP_PROFILE=1 (or instrument.enable(), e.g. pipeline.py --profile)
+  switches it on. When off, span() returns a shared no-op, so the cost is one flag check
+- a span records wall time, CPU time, rows in/out, bytes read and memory: how far it
+  raised the process's peak RSS (rss_growth_mb) and that peak at its end
+  (process_peak_rss_mb, a lifetime maximum: every span after the largest repeats it)
+- at exit: Chrome trace JSON (chrome://tracing / Perfetto) under data_work/profile/
+  plus a summary table on stdout
+- process-pool workers hand their spans back with drain(); the parent absorb()s them
+"""
+from functools import wraps
+from pathlib import Path
+import atexit
+import json
+import os
+import resource
+import threading
+import time
+
+ENV = "FP_PROFILE"
+ENV_OUT = "FP_PROFILE_OUT"
+OUT_DIR = Path("data_work") / "profile"
+
+_enabled = os.environ.get(ENV, "").lower() not in ("", "0", "false", "no")
+_events = []
+_lock = threading.Lock()
+_registered = False
+
+class _NullSpan:
+    def add(self, **kw):
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullSpan()
+
+def _peak_rss_mb():
+    """Process peak RSS so far (ru_maxrss is KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class Span:
+    __slots__ = ("name", "rows_in", "rows_out", "bytes_read", "meta", "_t0", "_c0", "_rss0")
+
+    def __init__(self, name, rows_in=0, rows_out=0, bytes_read=0, **meta):
+        self.name, self.meta = name, meta
+        self.rows_in, self.rows_out, self.bytes_read = rows_in, rows_out, bytes_read
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0, **meta):
+        self.rows_in += rows_in; self.rows_out += rows_out; self.bytes_read += bytes_read
+        self.meta.update(meta)
+
+    def __enter__(self):
+        self._t0, self._c0 = time.perf_counter_ns(), time.thread_time_ns()
+        self._rss0 = _peak_rss_mb()
+        return self
+
+    def __exit__(self, *exc):
+        t1, c1 = time.perf_counter_ns(), time.thread_time_ns()
+        rss = _peak_rss_mb()
+        ev = {
+            "name": self.name, "cat": self.name.split(".")[0], "ph": "X",
+            "ts": self._t0 / 1e3, "dur": (t1 - self._t0) / 1e3,
+            "pid": os.getpid(), "tid": threading.get_ident() % 2**31,
+            "args": {"cpu_ms": (c1 - self._c0) / 1e6,
+                     "rss_growth_mb": rss - self._rss0, "process_peak_rss_mb": rss,
+                     "rows_in": self.rows_in, "rows_out": self.rows_out,
+                     "bytes_read": self.bytes_read, **self.meta},
+        }
+        with _lock:
+            _events.append(ev)
+        return False
+
+def enabled():
+    return _enabled
+
+def span(name, **kw):
+    return Span(name, **kw) if _enabled else _NULL
+
+def traced(name):
+    """Decorator: wrap a whole function in a span (no-op when profiling is off)."""
+    def deco(fn):
+        @wraps(fn)
+        def inner(*a, **kw):
+            if not _enabled:
+                return fn(*a, **kw)
+            with Span(name):
+                return fn(*a, **kw)
+        return inner
+    return deco
+
+def file_bytes(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def drain():
+    """Take this process's own events (for returning them from a pool worker;
+       events inherited from a forked parent are left behind)."""
+    pid = os.getpid()
+    with _lock:
+        out = [e for e in _events if e["pid"] == pid]
+        _events[:] = [e for e in _events if e["pid"] != pid]
+    return out
+
+def absorb(events):
+    with _lock:
+        _events.extend(events or [])
+
+def summary(events=None):
+    rows = {}
+    for e in (_events if events is None else events):
+        r = rows.setdefault(e["name"], {"calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "rows_in": 0,
+                                         "rows_out": 0, "mb_read": 0.0, "rss_growth_mb": 0.0,
+                                         "process_peak_rss_mb": 0.0})
+        a = e["args"]
+        r["calls"] += 1; r["wall_ms"] += e["dur"] / 1e3; r["cpu_ms"] += a["cpu_ms"]
+        r["rows_in"] += a["rows_in"]; r["rows_out"] += a["rows_out"]
+        r["mb_read"] += a["bytes_read"] / 2**20
+        r["rss_growth_mb"] = max(r["rss_growth_mb"], a["rss_growth_mb"])
+        r["process_peak_rss_mb"] = max(r["process_peak_rss_mb"], a["process_peak_rss_mb"])
+    # +RSS: most a single call raised the process peak; peak: the process peak so far
+    head = (f"{'span':<32}{'calls':>6}{'wall ms':>11}{'cpu ms':>11}{'rows in':>12}{'rows out':>12}{'MB read':>9}"
+            f"{'+RSS MB':>9}{'peak MB':>9}")
+    lines = [head, "-" * len(head)]
+    for name, r in sorted(rows.items(), key=lambda kv: -kv[1]["wall_ms"]):
+        lines.append(f"{name:<32}{r['calls']:>6}{r['wall_ms']:>11.1f}{r['cpu_ms']:>11.1f}"
+                     f"{r['rows_in']:>12,}{r['rows_out']:>12,}{r['mb_read']:>9.1f}"
+                     f"{r['rss_growth_mb']:>9.0f}{r['process_peak_rss_mb']:>9.0f}")
+    return "\n".join(lines)
+
+def write_trace(path=None):
+    path = Path(path or os.environ.get(ENV_OUT) or OUT_DIR / f"trace-{os.getpid()}.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _lock:
+        path.write_text(json.dumps({"traceEvents": _events, "displayTimeUnit": "ms"}))
+    return path
+
+def _at_exit():
+    if _enabled and _events:
+        path = write_trace()
+        print(f"\n[profile] wrote {path}\n{summary()}")
+
+def enable(out=None):
+    """Turn profiling on for this process and any child processes it starts."""
+    global _enabled, _registered
+    _enabled = True
+    os.environ[ENV] = "1"
+    if out:
+        os.environ[ENV_OUT] = str(out)
+    if not _registered:
+        atexit.register(_at_exit); _registered = True
+
+if _enabled:
+    enable()
@@ -0,0 +1,132 @@
+"""
+Leave-one-route-out marginal economics (closed form)
+- every bucket is a weighted sum of linear driver shares (allocation.compile_buckets:
+  fuel_driver, block_hours, departures, pax, ...), so dropping routes only rescales the
+  driver totals:
+    share'_j = Σ_k w_bk * x_jk / (X_k - X_dropped,k)
+- each bucket splits into an avoidable part (`avoidable` in allocation_config.yaml),
+  which leaves with the dropped flying, and a fixed part re-spread over the rest
+- leave_one_out(): every route's avoidable cost, fixed cost absorbed and the driver
+  uplift it would push onto the rest of the network, in O(routes)
+- drop_routes(): the re-spread for a batch dropped together (e.g. Hawaii inter-island)
+"""
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import fact_store
+import schema
+from allocation import (PERIOD, load_config, load_inputs, allocate_frame, burn_rates, compile_buckets,
+                        with_financials)
+
+DATA_WORK = Path("data_work")
+
+KEYS = ["carrier", "month", "origin", "dest", "fleet_type"]
+
+def weight_matrix(cfg):
+    """buckets x drivers weights, the same matrix allocation.allocate_frame spreads with."""
+    b = compile_buckets(cfg)
+    return pd.DataFrame(b.W.T, index=b.names, columns=b.drivers)
+
+def cost_columns(cfg):
+    return compile_buckets(cfg).costs
+
+def avoidable_fractions(cfg):
+    av = cfg.get("avoidable") or {}
+    return pd.Series({b: float(av.get(b, 0.0)) for b in compile_buckets(cfg).names})
+
+def network(months=None, carriers=None):
+    """Baseline allocation plus the driver columns the closed forms need."""
+    cfg = load_config()
+    seg, fin, fares = load_inputs(months, carriers)
+    seg = with_financials(seg, fin)
+    econ = allocate_frame(seg, fin, fares, cfg).reset_index(drop=True)
+    econ["fuel_driver"] = (econ[cfg["fuel"].get("driver", "block_hours")]
+                           * burn_rates(econ["fleet_type"], cfg).to_numpy())
+    return econ, cfg
+
+def _driver_shares(econ, drivers, drop=None):
+    """x_rk / X_k per carrier-month, with the dropped rows' drivers removed from X."""
+    x = econ[drivers].astype(float)
+    keep = x if drop is None else x.where(~drop, 0.0)
+    X = keep.groupby([econ[c] for c in PERIOD], observed=True).transform("sum")
+    return pd.DataFrame(np.divide(x.to_numpy(), X.to_numpy(), out=np.zeros(x.shape),
+                                  where=X.to_numpy() > 0), columns=drivers, index=econ.index)
+
+def leave_one_out(econ, cfg):
+    W, a = weight_matrix(cfg), avoidable_fractions(cfg)
+    cost = econ[cost_columns(cfg)].to_numpy(float)               # R x buckets
+    avoid = cost @ a.to_numpy()
+    fixed = cost @ (1.0 - a.to_numpy())
+
+    out = econ[KEYS + ["ASMs", "revenue", "total_cost", "margin"]].copy()
+    out["avoidable_cost"] = avoid
+    out["fixed_absorbed"] = fixed
+    # dropping r: revenue and avoidable cost leave, fixed cost lands on everyone else
+    out["network_margin_delta"] = avoid - econ["revenue"].to_numpy(float)
+    asm_m = econ.groupby(PERIOD, observed=True)["ASMs"].transform("sum")
+    rest_asm = (asm_m - econ["ASMs"]).to_numpy(float)
+    out["rest_casm_delta"] = np.divide(fixed, rest_asm, out=np.full(len(out), np.nan), where=rest_asm > 0)
+
+    # every other route's share of driver k scales by 1 + uplift_k
+    xs = _driver_shares(econ, list(W.columns)).to_numpy()
+    with np.errstate(divide="ignore"):
+        uplift = np.where(xs < 1.0, xs / (1.0 - xs), np.inf)
+    for i, k in enumerate(W.columns):
+        if W[k].any():
+            out[f"uplift_{k}"] = uplift[:, i]
+    return out
+
+def drop_routes(econ, cfg, drop):
+    """Remaining routes' costs after dropping the rows in boolean mask `drop` together."""
+    W, a = weight_matrix(cfg), avoidable_fractions(cfg)
+    drop = pd.Series(np.asarray(drop, bool), index=econ.index)
+    cost = econ[cost_columns(cfg)].to_numpy(float)
+
+    # carrier-month bucket totals -> fixed pool; variable cost stays with its own route
+    tot = (pd.DataFrame(cost, columns=list(W.index), index=econ.index)
+             .groupby([econ[c] for c in PERIOD], observed=True).transform("sum").to_numpy())
+    fixed_pool = tot * (1.0 - a.to_numpy())
+    share_new = _driver_shares(econ, list(W.columns), drop).to_numpy() @ W.to_numpy().T   # R x buckets
+    new_cost = cost * a.to_numpy() + fixed_pool * share_new
+
+    rest = econ.loc[~drop, KEYS + ["ASMs", "revenue", "total_cost", "margin"]].copy()
+    rest["total_cost_new"] = new_cost[~drop.to_numpy()].sum(axis=1)
+    rest["cost_delta"] = rest["total_cost_new"] - rest["total_cost"]
+    rest["margin_new"] = rest["revenue"] - rest["total_cost_new"]
+    return rest
+
+def _route_mask(econ, routes=(), within=()):
+    od = econ["origin"].astype(str) + "-" + econ["dest"].astype(str)
+    mask = od.isin(set(routes))
+    if within:
+        s = set(within)
+        mask |= econ["origin"].isin(s) & econ["dest"].isin(s)
+    return mask.to_numpy()
+
+if __name__ == "__main__":
+    import argparse
+    from utils import parse_carriers, parse_months
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--month", required=True, help="YYYY-MM, YYYY-MM..YYYY-MM or comma list")
+    p.add_argument("--carriers", help="comma list of carriers (default: all)")
+    p.add_argument("--drop", nargs="*", default=[], help="routes to drop together, e.g. HNL-OGG OGG-HNL")
+    p.add_argument("--within", nargs="*", default=[],
+                   help="drop every route with both ends in this airport set (e.g. HNL OGG KOA LIH ITO)")
+    args = p.parse_args()
+
+    econ, cfg = network(parse_months(args.month), parse_carriers(args.carriers))
+    loo = leave_one_out(econ, cfg)
+    fact_store.write(loo, "fact_marginal")
+    print(f"Wrote {DATA_WORK/'fact_marginal'} with {len(loo)} rows")
+
+    if args.drop or args.within:
+        mask = _route_mask(econ, args.drop, args.within)
+        rest = drop_routes(econ, cfg, mask)
+        schema.labels(rest).to_csv(DATA_WORK / "marginal_drop_batch.csv", index=False)
+        gone = econ[mask]
+        av = float((gone[cost_columns(cfg)].to_numpy(float) @ avoidable_fractions(cfg).to_numpy()).sum())
+        print(f"Wrote {DATA_WORK/'marginal_drop_batch.csv'} with {len(rest)} remaining rows")
+        print(f"Dropped {int(mask.sum())} rows: revenue {gone['revenue'].sum():,.0f}  "
+              f"avoidable cost {av:,.0f}  fixed re-spread {rest['cost_delta'].sum():,.0f}  "
+              f"network margin Δ {av - gone['revenue'].sum():,.0f}")
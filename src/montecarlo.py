@@ -0,0 +1,167 @@
+"""
+Monte Carlo margin bands (P10/P50/P90 per route)
+- samples the placeholder allocation weights, per-fleet burn rates (around the fuel driver
+  the allocation uses: fuel.driver x burn_rate_hr) and DB1B yield
+  (sigma by fare confidence) from the `uncertainty` section of allocation_config.yaml
+- weights are drawn on the configured bucket matrix (allocation.compile_buckets): a range
+  `<bucket>_<driver>: [lo, hi]` draws that driver's fraction of the bucket's weight and the
+  bucket's other drivers share the rest pro rata; every bucket, core or `buckets:`, is then
+  spread as in the allocation, driver shares @ W
+- every draw is evaluated at once as (draws x routes) arrays; routes are processed in
+  blocks so memory stays bounded by max_cells, not draws * routes
+- Form 41 bucket totals are held fixed: only how they are shared out varies
+- writes fact_margin_bands (one row per carrier x month x route x fleet)
+"""
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import fact_store
+from allocation import (CORE_BUCKETS, DRIVERS, FARE_COLS, PERIOD, load_config, load_inputs, allocate_frame,
+                        burn_rates, by_period, compile_buckets, driver_shares, with_financials)
+
+DATA_WORK = Path("data_work")
+
+KEYS = ["carrier", "month", "origin", "dest", "fleet_type"]
+DEFAULTS = {
+    "labor_block_hours": [0.6, 0.8],
+    "maintenance_block_hours": [0.85, 1.0],
+    "station_departures": [0.4, 0.6],
+    "burn_rate_cv": 0.05,
+    "yield_sigma": {"high": 0.05, "medium": 0.12, "low": 0.25, "missing": 0.35},
+}
+# short bucket names accepted in `<bucket>_<driver>` range keys
+ALIASES = {"station": "station_other"}
+
+def _listed(cfg, bucket):
+    """Drivers a bucket's config names (weight 0 included): where drawn weight can go."""
+    if bucket == "fuel":
+        return ["fuel_driver"]
+    return list((cfg[bucket] if bucket in CORE_BUCKETS else cfg["buckets"][bucket])["weights"])
+
+def weight_ranges(b, cfg, unc):
+    """[(bucket index, driver index, (lo, hi), split)] for the `uncertainty` ranges that apply
+       to the configured buckets. split spreads the rest of the bucket's weight over its other
+       drivers, pro rata to their configured weights (equally where those are all 0). Ranges
+       naming a driver the bucket does not list, or its only one, are ignored."""
+    prefixes = {**{n: n for n in b.names}, **{a: n for a, n in ALIASES.items() if n in b.names}}
+    out = []
+    for key, r in unc.items():
+        for prefix, bucket in prefixes.items():
+            driver = key[len(prefix) + 1:] if key.startswith(prefix + "_") else None
+            listed = _listed(cfg, bucket) if driver else []
+            if driver not in listed or len(listed) < 2:
+                continue
+            j, k = b.names.index(bucket), b.drivers.index(driver)
+            rest = np.array([d in listed and d != driver for d in b.drivers], dtype=float)
+            base = rest * b.W[:, j]
+            out.append((j, k, tuple(r), base / base.sum() if base.sum() > 0 else rest / rest.sum()))
+    return out
+
+def weight_draws(b, ranges, draws, rng):
+    """(D x drivers x buckets) weight matrices: b.W with each range's driver drawn uniformly as
+       a fraction of the bucket's total weight and the rest spread by the range's split."""
+    Wd = np.broadcast_to(b.W, (draws,) + b.W.shape).copy()
+    for j, k, (lo, hi), split in ranges:
+        total = b.W[:, j].sum()
+        w = rng.uniform(lo, hi, draws)
+        Wd[:, :, j] = total * (1 - w)[:, None] * split
+        Wd[:, k, j] = total * w
+    return Wd
+
+def _simulate_month(base, segm, finm, cfg, unc, draws, rng, max_cells):
+    """base: the month's deterministic allocation; segm: the same rows with yield_sigma."""
+    R = len(segm)
+    rpm = segm["RPMs"].fillna(0.0).to_numpy(float)
+    yld = segm["yield_est"].fillna(0.125).to_numpy(float)
+    sig = segm["yield_sigma"].to_numpy(float)
+
+    # --- driver shares as allocated (R x drivers); fuel_driver is redrawn below ---
+    b = compile_buckets(cfg)
+    fd = base[cfg["fuel"].get("driver", "block_hours")].to_numpy(float)
+    x = {k: base[k].to_numpy(float) for k in DRIVERS if k != "fuel_driver"}
+    x["fuel_driver"] = fd * burn_rates(base["fleet_type"], cfg).to_numpy(float)
+    S = driver_shares(base, np.column_stack([x[k] for k in b.drivers]))
+    tot = np.array([sum(f * float(finm[c]) for c, f in e.items()) for e in b.expense])
+
+    # --- parameter draws (D,) / (D x fleets) ---
+    # fuel driver as allocated: the fuel section's driver x the fleet's burn rate, with the
+    # burn rates drawn around burn_rates() per fleet
+    fleets, fidx = np.unique(base["fleet_type"].astype(str).to_numpy(), return_inverse=True)
+    burn_mu = burn_rates(pd.Series(fleets), cfg).to_numpy(float)
+    burn_d = np.clip(rng.normal(burn_mu, unc["burn_rate_cv"] * burn_mu, (draws, len(fleets))), 1e-9, None)
+    fd_by_fleet = np.bincount(fidx, weights=fd, minlength=len(fleets))
+    fuel_den = burn_d @ fd_by_fleet                                # Σ fuel_driver per draw
+
+    # expense each driver spreads per draw: (D x drivers x buckets) @ bucket totals; the
+    # fuel_driver part goes by the drawn burn rates instead of S (the fuel bucket always has it)
+    v = weight_draws(b, weight_ranges(b, cfg, unc), draws, rng) @ tot
+    jf = b.drivers.index("fuel_driver")
+    v_fuel, v[:, jf] = v[:, jf].copy(), 0.0
+
+    # --- route blocks: every array below is (D x block) ---
+    block = max(1, int(max_cells // draws))
+    q = np.empty((3, R)); p_loss = np.empty(R)
+    for s in range(0, R, block):
+        sl = slice(s, min(s + block, R))
+        fuel = np.divide(fd[sl] * burn_d[:, fidx[sl]], fuel_den[:, None],
+                         out=np.zeros((draws, sl.stop - sl.start)), where=fuel_den[:, None] > 0)
+        cost = v @ S[sl].T + v_fuel[:, None] * fuel
+
+        # mean-preserving lognormal on yield
+        z = rng.standard_normal(cost.shape)
+        margin = rpm[sl] * yld[sl] * np.exp(sig[sl] * z - 0.5 * sig[sl] ** 2) - cost
+        q[:, sl] = np.percentile(margin, [10, 50, 90], axis=0)
+        p_loss[sl] = (margin < 0).mean(axis=0)
+    return q, p_loss
+
+def simulate(seg, fin, fares, cfg, draws=10_000, seed=0, max_cells=5_000_000):
+    """P10/P50/P90 margin per route for every carrier-month in seg that has financials."""
+    unc = {**DEFAULTS, **(cfg.get("uncertainty") or {})}
+    sigmas = {**DEFAULTS["yield_sigma"], **unc["yield_sigma"]}
+    fin = fin.drop_duplicates(PERIOD)
+    tot = {k: g.iloc[0] for k, g in by_period(fin).items()}
+    fa = by_period(fares)
+
+    out = []
+    for i, (key, segm) in enumerate(sorted(by_period(with_financials(seg, fin)).items())):
+        segm = segm.reset_index(drop=True)
+        base = allocate_frame(segm, fin, fares, cfg)
+
+        f = fa.get(key, fares.iloc[0:0])[["origin", "dest", "yield_est", "confidence"]]
+        segm = segm.merge(f, on=["origin", "dest"], how="left")
+        conf = segm["confidence"].astype(object).where(segm["yield_est"].notna(), "missing")
+        segm["yield_sigma"] = conf.map(sigmas).fillna(sigmas["missing"]).astype(float)
+
+        rng = np.random.default_rng([seed, i])
+        q, p_loss = _simulate_month(base, segm, tot[key], cfg, unc, draws, rng, max_cells)
+
+        band = base[KEYS + ["ASMs", "margin"]].rename(columns={"margin": "margin_base"})
+        band["margin_p10"], band["margin_p50"], band["margin_p90"] = q
+        band["p_loss"] = p_loss
+        band["draws"] = draws
+        out.append(band)
+    return pd.concat(out, ignore_index=True) if out else pd.DataFrame()
+
+def run(months=None, draws=10_000, seed=0, max_cells=5_000_000, write=True, carriers=None):
+    cfg = load_config()
+    seg, fin, fares = load_inputs(months, carriers, fare_cols=FARE_COLS + ["confidence"])
+    bands = simulate(seg, fin, fares, cfg, draws=draws, seed=seed, max_cells=max_cells)
+    if write and len(bands):
+        fact_store.write(bands, "fact_margin_bands")
+        print(f"Wrote {DATA_WORK/'fact_margin_bands'} with {len(bands)} rows ({draws} draws)")
+    return bands
+
+if __name__ == "__main__":
+    import argparse
+    from utils import parse_carriers, parse_months
+
+    a = argparse.ArgumentParser()
+    a.add_argument("--month", help="YYYY-MM, YYYY-MM..YYYY-MM or comma list (default: all)")
+    a.add_argument("--draws", type=int, default=10_000)
+    a.add_argument("--seed", type=int, default=0)
+    a.add_argument("--carriers", help="comma list of carriers (default: all)")
+    a.add_argument("--max-cells", type=int, default=5_000_000,
+                   help="Cap on draws x routes held in memory at once")
+    args = a.parse_args()
+    run(parse_months(args.month) if args.month else None,
+        draws=args.draws, seed=args.seed, max_cells=args.max_cells, carriers=parse_carriers(args.carriers))
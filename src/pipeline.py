@@ -0,0 +1,294 @@
+"""
+Flight-Prof Lite: Pipeline Runner
+- Declares ingest -> allocation -> rollup/memo (-> flights, warehouse) stages as a DAG (replaces running
+  the scripts by hand)
+- Fingerprints each stage from its raw inputs, upstream outputs, allocation_config.yaml
+  slices, parameters and source code; stages whose fingerprint matches the last run are skipped
+- Stages that become ready together (e.g. form41 P-12(a)/P-5.2, db1b and fare proration)
+  run concurrently
+- --append (monthly refresh): the ingest and allocation stages that do run touch only the
+  months/quarters that are new or changed in data_raw/ (delta.py) instead of the whole history
+- State lives in data_work/.pipeline_state.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import json
+
+import instrument
+from utils import load_config, parse_carriers
+
+RAW = Path("data_raw")
+WORK = Path("data_work")
+DOCS = Path("docs")
+SRC = Path(__file__).resolve().parent
+STATE = WORK / ".pipeline_state.json"
+
+T100_FILES = ["2023_T_T100D_SEGMENT_ALL_CARRIER.csv"]
+P12A_CSV = "FORM41_P12A_2023.csv"
+P52_CSV = "FORM41_P52_2023.csv"
+DB1B_CSV = "DB1B_MARKET_2023.csv"
+COORDS_CSV = "T_MASTER_CORD.csv"      # optional airport coordinates (distances.py)
+# params that change how a stage runs, not what it writes: kept out of its fingerprint, so
+# toggling --append or --workers does not re-run anything
+RUN_MODE = ("append", "workers")
+
+@dataclass
+class Stage:
+    name: str
+    run: str                                      # name of a module-level _run_* function
+    deps: tuple = ()                              # upstream stage names
+    raw: tuple = ()                               # data_raw/ files
+    config: tuple = ()                            # allocation_config.yaml top-level keys
+    outputs: tuple = ()                           # paths written (fact tables or files)
+    code: tuple = ()                              # src/ modules
+    params: dict = field(default_factory=dict)
+
+# --- stage bodies (module-level so they can run in a process pool) ---
+def _run_segments(p):
+    from ingest_data import build_fact_segments
+    build_fact_segments(raw_files=p["raw_files"], carriers=p["carriers"], append=p.get("append", False))
+
+def _run_financials(p):
+    from form41_ingest import build_fact_financials
+    build_fact_financials(p["p12a_csv"], p["p52_csv"], carriers=p["carriers"], append=p.get("append", False))
+
+def _run_fares(p):
+    from db1b_ingest import build_fact_fares
+    build_fact_fares(p["db1b_csv"], carriers=p["carriers"], append=p.get("append", False))
+
+def _run_prorate(p):
+    from prorate import build_fact_segment_fares
+    build_fact_segment_fares(p["db1b_csv"], carriers=p["carriers"], append=p.get("append", False))
+
+def _run_allocation(p):
+    from allocation import allocate_months
+    allocate_months(workers=p.get("workers", 1), carriers=p.get("carriers"), append=p.get("append", False))
+
+def _run_rollup(p):
+    from rollup import refresh
+    refresh()
+
+def _run_warehouse(p):
+    from warehouse import load
+    load(p.get("url") or None)
+
+def _run_flights(p):
+    from flights import build
+    build(paths=p.get("files") or None, workers=p.get("workers", 1), carriers=p.get("carriers"))
+
+def _run_memo(p):
+    from build_memo_tables import main
+    if p.get("month"):
+        main(p["month"])
+    else:
+        main()
+
+def build_dag(t100_files=T100_FILES, p12a_csv=P12A_CSV, p52_csv=P52_CSV, db1b_csv=DB1B_CSV,
+              memo_month=None, workers=1, carriers=("WN",), warehouse=None, flights=None, append=False):
+    # one pass over each raw file covers every carrier in `carriers` (None: all)
+    # append: ingest/allocation stages that do run only touch new or changed months (delta.py)
+    carriers = parse_carriers(carriers)
+    db1b = [db1b_csv] if isinstance(db1b_csv, str) else list(db1b_csv)
+    coords = (COORDS_CSV,) if (RAW / COORDS_CSV).exists() else ()
+    stages = [
+        Stage("segments", "_run_segments", raw=tuple(t100_files) + coords, config=("distances",),
+              outputs=(WORK / "fact_segments",),
+              code=("ingest_data", "distances", "delta", "fact_store", "schema", "utils"),
+              params={"raw_files": list(t100_files), "carriers": carriers, "append": append}),
+        Stage("financials", "_run_financials", deps=("segments",), raw=(p12a_csv, p52_csv),
+              outputs=(WORK / "fact_financials",),
+              code=("form41_ingest", "delta", "fact_store", "schema", "utils"),
+              params={"p12a_csv": p12a_csv, "p52_csv": p52_csv, "carriers": carriers, "append": append}),
+        Stage("fares", "_run_fares", deps=("segments",), raw=tuple(db1b),
+              outputs=(WORK / "fact_fares",), code=("db1b_ingest", "delta", "fact_store", "schema", "utils"),
+              params={"db1b_csv": db1b, "carriers": carriers, "append": append}),
+        Stage("prorate", "_run_prorate", deps=("segments",), raw=tuple(db1b), config=("fares",),
+              outputs=(WORK / "fact_segment_fares",),
+              code=("prorate", "db1b_ingest", "delta", "fact_store", "schema", "utils"),
+              params={"db1b_csv": db1b, "carriers": carriers, "append": append}),
+        Stage("allocation", "_run_allocation", deps=("segments", "financials", "fares", "prorate"),
+              config=("fuel", "labor", "maintenance", "station_other", "buckets", "fares", "reconciliation"),
+              outputs=(WORK / "fact_route_economics", WORK / "fact_reconciliation"),
+              code=("allocation", "reconcile", "delta", "fact_store", "schema", "utils"),
+              params={"workers": workers, "carriers": carriers, "append": append}),
+        Stage("rollup", "_run_rollup", deps=("allocation",), raw=coords, config=("regions",),
+              outputs=(WORK / "fact_rollup",),
+              code=("rollup", "build_memo_tables", "distances", "allocation", "fact_store", "schema", "utils")),
+        Stage("memo", "_run_memo", deps=("allocation",), raw=coords,
+              outputs=(DOCS / "top20_routes.csv", DOCS / "bottom20_routes.csv",
+                       DOCS / "asm_bins_rasm_casm.csv", DOCS / "top20_routes_by_month.csv",
+                       DOCS / "bottom20_routes_by_month.csv", DOCS / "asm_bins_by_month.csv"),
+              code=("build_memo_tables", "distances", "allocation", "fact_store", "schema"),
+              params={"month": memo_month}),
+    ]
+    if flights is not None:
+        # flight-level split of the allocation; no files: synthetic stand-in flights
+        stages.append(Stage("flights", "_run_flights", deps=("allocation",), raw=tuple(flights),
+                            config=("fuel", "labor", "maintenance", "station_other", "buckets"),
+                            outputs=(WORK / "fact_flight_economics",),
+                            code=("flights", "allocation", "fact_store", "schema", "utils"),
+                            params={"files": list(flights), "workers": workers, "carriers": carriers}))
+    if warehouse is not None:
+        # partition-incremental itself; the fingerprint only decides whether to look at all
+        stages.append(Stage("warehouse", "_run_warehouse",
+                            deps=("segments", "financials", "prorate", "allocation", "rollup"),
+                            config=("warehouse",), code=("warehouse", "fact_store", "schema"),
+                            params={"url": warehouse}))
+    return stages
+
+# --- fingerprints ---
+def _hash_file(path, h):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+def _file_digest(path, cache):
+    """Content hash of one file, memoized on (size, mtime) so unchanged multi-GB raw files
+       are not re-read on every run."""
+    st = path.stat()
+    key = str(path)
+    hit = cache.get(key)
+    if hit and hit["size"] == st.st_size and hit["mtime_ns"] == st.st_mtime_ns:
+        return hit["sha256"]
+    h = hashlib.sha256()
+    _hash_file(path, h)
+    cache[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+    return cache[key]["sha256"]
+
+def _path_digest(path, cache):
+    """Hash of a file, or of every file under a directory (names + contents)."""
+    path = Path(path)
+    if path.is_file():
+        return _file_digest(path, cache)
+    if not path.is_dir():
+        return None
+    h = hashlib.sha256()
+    for f in sorted(p for p in path.rglob("*") if p.is_file() and not p.name.startswith(".")):
+        h.update(str(f.relative_to(path)).encode())
+        h.update(_file_digest(f, cache).encode())
+    return h.hexdigest()
+
+def _config_slices(keys):
+    if not keys:
+        return {}
+    cfg = load_config() or {}
+    return {k: cfg.get(k) for k in keys}
+
+def fingerprint(stage, state, cache):
+    h = hashlib.sha256()
+    doc = {
+        "stage": stage.name,
+        "params": {k: v for k, v in stage.params.items() if k not in RUN_MODE},
+        "raw": {f: _file_digest(RAW / f, cache) for f in stage.raw},
+        "upstream": {d: state.get(d, {}).get("output") for d in stage.deps},
+        "config": _config_slices(stage.config),
+        "code": {m: _file_digest(SRC / f"{m}.py", cache) for m in stage.code},
+    }
+    h.update(json.dumps(doc, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def output_digest(stage, cache):
+    h = hashlib.sha256()
+    for p in stage.outputs:
+        h.update(str(p).encode())
+        h.update(str(_path_digest(p, cache)).encode())
+    return h.hexdigest()
+
+# --- runner ---
+def _load_state():
+    if STATE.exists():
+        return json.loads(STATE.read_text())
+    return {"stages": {}, "files": {}}
+
+def _save_state(state):
+    WORK.mkdir(exist_ok=True)
+    tmp = STATE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True))
+    tmp.replace(STATE)
+
+def _call(run, params):
+    globals()[run](params)
+    return instrument.drain()
+
+def run(stages, force=(), dry_run=False, max_parallel=None):
+    state = _load_state()
+    done, cache = state["stages"], state["files"]
+    by_name = {s.name: s for s in stages}
+    pending = list(by_name)
+    finished = set()
+    ran, skipped = [], []
+
+    while pending:
+        ready = [n for n in pending if all(d in finished for d in by_name[n].deps)]
+        if not ready:
+            raise ValueError(f"Cycle or unknown dependency among stages {pending}")
+
+        todo = []
+        for n in ready:
+            s = by_name[n]
+            fp = fingerprint(s, done, cache)
+            prev = done.get(n, {})
+            fresh = (prev.get("fingerprint") == fp and n not in force
+                     and all(Path(p).exists() for p in s.outputs))
+            if fresh:
+                print(f"[pipeline] skip {n} (up to date)")
+                skipped.append(n)
+            else:
+                print(f"[pipeline] run  {n}")
+                todo.append((s, fp))
+
+        if todo and not dry_run:
+            if len(todo) > 1 and (max_parallel is None or max_parallel > 1):
+                with ProcessPoolExecutor(max_workers=min(len(todo), max_parallel or len(todo))) as ex:
+                    futs = [ex.submit(_call, s.run, s.params) for s, _ in todo]
+                    for f in futs:
+                        instrument.absorb(f.result())
+            else:
+                for s, _ in todo:
+                    instrument.absorb(_call(s.run, s.params))
+            for s, fp in todo:
+                done[s.name] = {"fingerprint": fp, "output": output_digest(s, cache)}
+            _save_state(state)
+        ran += [s.name for s, _ in todo]
+
+        finished.update(ready)
+        pending = [n for n in pending if n not in finished]
+
+    if not dry_run:
+        _save_state(state)
+    print(f"[pipeline] ran: {ran or '-'}  skipped: {skipped or '-'}")
+    return ran, skipped
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--t100", nargs="+", default=T100_FILES, help="T-100 segment files in data_raw/")
+    p.add_argument("--p12a", default=P12A_CSV)
+    p.add_argument("--p52", default=P52_CSV)
+    p.add_argument("--db1b", nargs="+", default=[DB1B_CSV], help="DB1B MARKET files in data_raw/ (e.g. one per quarter)")
+    p.add_argument("--memo-month", help="YYYY-MM for the memo tables (default: latest month)")
+    p.add_argument("--workers", type=int, default=1, help="Process pool size for allocation carrier-months")
+    p.add_argument("--carriers", default="WN", help="comma list of carriers, or 'all' (default: WN)")
+    p.add_argument("--max-parallel", type=int, help="Max stages run at once (default: all ready)")
+    p.add_argument("--force", nargs="*", default=[], help="Stage names to re-run regardless")
+    p.add_argument("--dry-run", action="store_true", help="Only show which stages would run")
+    p.add_argument("--append", action="store_true",
+                   help="Monthly refresh: stages that run only re-ingest/re-allocate new or changed months")
+    p.add_argument("--warehouse", nargs="?", const="", metavar="URL",
+                   help="Also load the fact tables into the warehouse (URL default: $FP_WAREHOUSE_URL, then config)")
+    p.add_argument("--flights", nargs="*", metavar="FILE",
+                   help="Also split the allocation over individual flights (per-departure files in data_raw/; "
+                        "none: synthetic stand-in)")
+    p.add_argument("--profile", nargs="?", const="", metavar="TRACE_JSON",
+                   help="Record per-stage spans; writes a Chrome trace + summary (same as FP_PROFILE=1)")
+    args = p.parse_args()
+    if args.profile is not None:
+        instrument.enable(args.profile or None)
+
+    dag = build_dag(args.t100, args.p12a, args.p52, args.db1b,
+                    memo_month=args.memo_month, workers=args.workers, carriers=args.carriers,
+                    warehouse=args.warehouse, flights=args.flights, append=args.append)
+    run(dag, force=set(args.force), dry_run=args.dry_run, max_parallel=args.max_parallel)
@@ -0,0 +1,256 @@
+"""
+DB1B market -> segment fare proration
+- DB1B MARKET origin/dest are true O&D markets; a connecting itinerary never matches a T-100
+  segment, so the O&D join in fact_fares leaves its revenue on the 12.5¢ fallback
+- one streaming pass folds itineraries into quarterly (carrier, year, qtr, routing) pax and
+  revenue, so memory tracks distinct routings, not rows
+- routings come from AirportGroup (ORD:DEN:LAX) with legs on OpCarrierGroup's operating
+  carriers when present; without them a market that is not itself a segment is routed over
+  the carrier's shortest one-stop connection that quarter
+- legs are priced against an indexed (carrier, year, qtr, origin, dest) segment lookup and
+  the market revenue is split by a pluggable prorate rule (`fares.prorate`, default mileage)
+- leg totals go through the same T-100 monthly shares and KPIs as fact_fares and are written
+  to fact_segment_fares; allocation reads those segment yields instead of the O&D join
+"""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import delta
+import fact_store
+import instrument
+from db1b_ingest import (CHUNK_ROWS, KEYS, _first, _read_header, _typed, monthly_fares,
+                         quarterly, read_segments)
+from utils import load_config, parse_carriers
+
+RAW  = Path("data_raw")
+WORK = Path("data_work")
+ROUTE = ["carrier", "year", "qtr", "route", "legs_by"]
+
+# --- prorate rules: (leg miles, market id per leg) -> leg weights summing to 1 per market ---
+PRORATE = {}
+
+def prorate_rule(name):
+    """Register a prorate rule under `fares.prorate: <name>`."""
+    def deco(fn):
+        PRORATE[name] = fn
+        return fn
+    return deco
+
+def _per_market(x, mkt):
+    tot = np.bincount(mkt, weights=x)
+    return np.divide(x, tot[mkt], out=np.zeros_like(x), where=tot[mkt] > 0)
+
+@prorate_rule("mileage")
+def _mileage(miles, mkt):
+    return _per_market(miles, mkt)
+
+@prorate_rule("sqrt_mileage")
+def _sqrt_mileage(miles, mkt):
+    # tapers toward equal shares on long legs, like IATA-style prorate factors
+    return _per_market(np.sqrt(miles), mkt)
+
+@prorate_rule("equal")
+def _equal(miles, mkt):
+    return _per_market(np.ones_like(miles), mkt)
+
+# --- streaming pass: itineraries -> quarterly routings ---
+def _routes(path, carriers, chunksize=CHUNK_ROWS):
+    """Quarterly pax/rev per (carrier, year, qtr, route, legs_by): route is the ':'-joined
+       airport sequence, legs_by the ':'-joined operating carrier per leg ('' = carrier)."""
+    hdr = _read_header(path)
+    cols = pd.DataFrame(columns=list(hdr))
+
+    year     = _first(cols, ["YEAR"])
+    quarter  = _first(cols, ["QUARTER"])
+    carrierc = _first(cols, ["REPORTING_CARRIER","RPCARRIER","CARRIER","UNIQUECARRIER","AIRLINE_ID"])
+    origin   = _first(cols, ["ORIGIN"])
+    dest     = _first(cols, ["DEST"])
+    group    = next((c for c in ["AIRPORT_GROUP","AIRPORTGROUP"] if c in hdr), None)
+    opgroup  = next((c for c in ["OP_CARRIER_GROUP","OPCARRIERGROUP"] if c in hdr), None)
+    fare_total_col = next((c for c in ["MARKET_FARE","MKTFARE"] if c in hdr), None)
+    pax_col        = _first(cols, ["PASSENGERS","PAX"])
+    avg_fare_col   = next((c for c in ["AVERAGE_FARE","AVG_FARE","FARE"] if c in hdr), None)
+
+    use = [c for c in dict.fromkeys([year, quarter, carrierc, origin, dest, group, opgroup,
+                                     pax_col, fare_total_col, avg_fare_col]) if c]
+    rename = {hdr[c]: c for c in use}
+
+    acc = None
+    with instrument.span("prorate.read_chunks", bytes_read=instrument.file_bytes(path)) as sp:
+        for df in pd.read_csv(path, usecols=list(rename), dtype=str, chunksize=chunksize):
+            sp.add(rows_in=len(df))
+            df = df.rename(columns=rename)
+            cr = df[carrierc].str.strip().str.upper()
+            if carriers is not None:
+                df, cr = df[cr.isin(carriers)], cr[cr.isin(carriers)]
+            if df.empty:
+                continue
+
+            pax = pd.to_numeric(df[pax_col], errors="coerce").fillna(0.0)
+            if fare_total_col:
+                rev = pd.to_numeric(df[fare_total_col], errors="coerce").fillna(0.0)
+            elif avg_fare_col:
+                rev = pd.to_numeric(df[avg_fare_col], errors="coerce").fillna(0.0) * pax
+            else:
+                rev = pax * 0.0
+
+            od = df[origin].astype(str).str[:3] + ":" + df[dest].astype(str).str[:3]
+            route = df[group].fillna(od).astype(str).str.strip().str.upper() if group else od
+            part = pd.DataFrame({
+                "carrier": cr,
+                "year":    pd.to_numeric(df[year]).astype(int),
+                "qtr":     pd.to_numeric(df[quarter]).astype(int),
+                "route":   route,
+                "legs_by": df[opgroup].fillna("").str.strip().str.upper() if opgroup else "",
+                "pax_q":   pax,
+                "rev_q":   rev,
+            })
+            part = part.groupby(ROUTE, as_index=False).sum()
+            acc = part if acc is None else (pd.concat([acc, part], ignore_index=True)
+                                              .groupby(ROUTE, as_index=False).sum())
+        sp.add(rows_out=0 if acc is None else len(acc))
+
+    return (_routes_empty() if acc is None else acc), group is not None
+
+def _routes_empty():
+    return pd.DataFrame({c: pd.Series(dtype=str) for c in ROUTE}).assign(
+        year=pd.Series(dtype=int), qtr=pd.Series(dtype=int),
+        pax_q=pd.Series(dtype=float), rev_q=pd.Series(dtype=float))
+
+# --- routing -> legs ---
+def _legs(mk):
+    """Explode routings into legs, vectorized: one row per (market, leg) with the leg's
+       operating carrier."""
+    aps = mk["route"].str.split(":")
+    n_ap = aps.str.len().to_numpy()
+    ap = np.concatenate(aps.to_numpy()) if len(mk) else np.array([], dtype=object)
+    mid = np.repeat(np.arange(len(mk)), n_ap)
+    same = mid[1:] == mid[:-1]
+    legs = pd.DataFrame({"mkt": mid[:-1][same], "origin": ap[:-1][same], "dest": ap[1:][same]})
+
+    # operating carrier per leg where OpCarrierGroup lines up with the routing, else the market's
+    carrier = mk["carrier"].astype(str).to_numpy()[legs["mkt"].to_numpy()]
+    by = mk["legs_by"].str.split(":")
+    ok = (by.str.len().to_numpy() == n_ap - 1) & (mk["legs_by"].to_numpy() != "")
+    if ok.any():
+        flat = np.concatenate(by[ok].to_numpy())
+        hit = ok[legs["mkt"].to_numpy()]
+        carrier[hit] = flat
+    legs["carrier"] = carrier
+    legs["year"] = mk["year"].to_numpy()[legs["mkt"].to_numpy()]
+    legs["qtr"] = mk["qtr"].to_numpy()[legs["mkt"].to_numpy()]
+    return legs
+
+def segment_index(seg):
+    """Quarterly segment lookup: MultiIndex (carrier, year, qtr, origin, dest) -> stage miles."""
+    q = seg.groupby(KEYS, observed=True, as_index=False)[["RPMs", "pax"]].sum()
+    q = q[q["pax"] > 0]
+    idx = pd.MultiIndex.from_arrays([q["carrier"].astype(str), q["year"].astype("int64"), q["qtr"].astype("int64"),
+                                     q["origin"].astype(str), q["dest"].astype(str)], names=KEYS)
+    return pd.Series((q["RPMs"] / q["pax"]).to_numpy(float), index=idx, name="miles")
+
+def _lookup(index, legs):
+    """Positions of each leg's segment in the index (-1: not flown by that carrier that quarter)."""
+    keys = pd.MultiIndex.from_arrays([legs["carrier"].astype(str), legs["year"].astype("int64"),
+                                      legs["qtr"].astype("int64"), legs["origin"].astype(str),
+                                      legs["dest"].astype(str)])
+    return index.index.get_indexer(keys)
+
+def _connect(mk, index):
+    """Route O&D markets that are not a flown segment over the carrier's shortest one-stop
+       connection that quarter (markets with no connection keep their O&D routing)."""
+    od = mk["route"].str.split(":", expand=True)
+    mk = mk.assign(origin=od[0], dest=od[1])
+    legs = mk[["carrier", "year", "qtr", "origin", "dest"]].assign(carrier=mk["carrier"].astype(str))
+    direct = _lookup(index, legs) >= 0
+    todo = mk[~direct]
+    if todo.empty:
+        return mk.drop(columns=["origin", "dest"])
+
+    net = index.reset_index()
+    first = net.rename(columns={"dest": "via", "miles": "m1"})
+    second = net.rename(columns={"origin": "via", "miles": "m2"})
+    cand = (todo.reset_index()
+                .assign(carrier=lambda d: d["carrier"].astype(str), year=lambda d: d["year"].astype("int64"),
+                        qtr=lambda d: d["qtr"].astype("int64"))
+                .merge(first, on=["carrier", "year", "qtr", "origin"])
+                .merge(second, on=["carrier", "year", "qtr", "via", "dest"]))
+    cand = cand[cand["via"] != cand["origin"]]
+    best = cand.loc[(cand["m1"] + cand["m2"]).groupby(cand["index"]).idxmin()]
+    mk.loc[best["index"].to_numpy(), "route"] = (best["origin"] + ":" + best["via"] + ":" + best["dest"]).to_numpy()
+    return mk.drop(columns=["origin", "dest"])
+
+def prorate(mk, seg, rule="mileage", infer_connections=True):
+    """Quarterly routings -> quarterly leg pax_q/rev_q per (carrier, year, qtr, origin, dest),
+       plus the quarterly revenue that landed on no flown segment."""
+    index = segment_index(seg)
+    if mk.empty:
+        return pd.DataFrame(columns=KEYS + ["pax_q", "rev_q"]), 0.0
+    if infer_connections:
+        with instrument.span("prorate.connect", rows_in=len(mk)):
+            mk = _connect(mk, index)
+
+    with instrument.span("prorate.legs", rows_in=len(mk)) as sp:
+        legs = _legs(mk.reset_index(drop=True))
+        pos = _lookup(index, legs)
+        miles = np.where(pos >= 0, index.to_numpy()[pos], np.nan)
+        # legs with no flown segment get their itinerary's mean known stage length (else 1)
+        mkt = legs["mkt"].to_numpy()
+        known = np.bincount(mkt, weights=np.nan_to_num(miles), minlength=len(mk))
+        n_known = np.bincount(mkt, weights=~np.isnan(miles), minlength=len(mk))
+        fill = np.divide(known, n_known, out=np.ones_like(known), where=n_known > 0)
+        miles = np.where(np.isnan(miles), fill[mkt], miles)
+
+        w = PRORATE[rule](miles, mkt)
+        legs["pax_q"] = mk["pax_q"].to_numpy(float)[mkt]
+        legs["rev_q"] = mk["rev_q"].to_numpy(float)[mkt] * w
+        flown = legs[pos >= 0]
+        sp.add(rows_out=len(legs))
+
+    lq = flown.groupby(KEYS, as_index=False)[["pax_q", "rev_q"]].sum()
+    return lq, float(legs.loc[pos < 0, "rev_q"].sum())
+
+@instrument.traced("prorate")
+def build_fact_segment_fares(db1b_csv="DB1B_MARKET_2023.csv", carriers=("WN",), rule=None,
+                             chunksize=CHUNK_ROWS, append=False):
+    # db1b_csv: one file or a list; append: only quarters whose DB1B rows or T-100 segments
+    # changed are re-prorated (db1b_ingest.quarterly)
+    carriers = parse_carriers(carriers)
+    rule = rule or (load_config().get("fares") or {}).get("prorate", "mileage")
+    if rule not in PRORATE:
+        raise KeyError(f"Unknown prorate rule {rule!r}; have {sorted(PRORATE)}")
+
+    routed = []
+    def read(path):
+        acc, r = _routes(path, carriers, chunksize=chunksize)
+        routed.append(r)
+        return acc
+    version = {"carriers": carriers, "rule": rule}
+    parts, months, state = quarterly("prorate", db1b_csv, carriers, read, version, append)
+    if months is not None and not months:
+        delta.save("prorate", version, **state)
+        print(f"{WORK/'fact_segment_fares'} up to date")
+        return
+    mk = (pd.concat(parts, ignore_index=True).groupby(ROUTE, as_index=False).sum() if len(parts) > 1
+          else parts[0] if parts else _routes_empty())
+    seg = read_segments(carriers, months)
+    lq, unflown = prorate(mk, seg, rule=rule, infer_connections=not (routed and all(routed)))
+    out = monthly_fares(_typed(lq), seg)
+    fact_store.write(out, "fact_segment_fares", overwrite=True, carriers=carriers, months=months)
+    delta.save("prorate", version, **state)
+
+    total = mk["rev_q"].sum()
+    print(f"Wrote {WORK/'fact_segment_fares'} with {len(out)} rows (carrier+month+segment, {rule} prorate; "
+          f"{100.0 * unflown / total if total else 0.0:.1f}% of DB1B revenue on legs with no T-100 segment)")
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser()
+    p.add_argument("--db1b", nargs="+", default=["DB1B_MARKET_2023.csv"], help="DB1B MARKET file(s) in data_raw/")
+    p.add_argument("--carriers", default="WN", help="comma list of carriers, or 'all' (one pass either way)")
+    p.add_argument("--rule", choices=sorted(PRORATE), help="prorate rule (default: fares.prorate in config)")
+    p.add_argument("--append", action="store_true",
+                   help="only re-prorate quarters whose DB1B rows or T-100 segments changed since the last run")
+    args = p.parse_args()
+    build_fact_segment_fares(args.db1b, carriers=args.carriers, rule=args.rule, append=args.append)
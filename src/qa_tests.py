@@ -1,13 +1,295 @@
-import pandas as pd
+"""
+QA checks for the data_work fact tables
+- a declarative rule set: each row rule names its table, the columns it needs and a
+  vectorized check returning the violating rows of a chunk; coverage rules compare
+  partition names only; config rules check allocation_config.yaml
+- one streaming pass per table (fact_store.chunks, one carrier-month partition at a time)
+  reads the union of the table's rule columns and evaluates every rule on each chunk
+- tables are scanned concurrently; every violation is counted and up to --sample rows per
+  rule are kept, instead of stopping at the first failed assert
+- thresholds live in QA_DEFAULTS and can be overridden under `qa:` in allocation_config.yaml
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Callable
+import numpy as np
+import pandas as pd
+import fact_store
+import instrument
+import schema
+from allocation import PERIOD, compile_buckets
+from utils import load_config, month_range
 
 DATA_WORK = Path("data_work")
 
-def run_basic_checks():
-    seg = pd.read_csv(DATA_WORK/"fact_segments.csv")
-    assert (seg["ASMs"] >= seg["RPMs"]).all(), "RPMs cannot exceed ASMs"
-    assert seg["departures"].ge(0).all(), "Negative departures found"
+QA_DEFAULTS = {
+    "load_factor": [0.2, 1.0],              # RPMs / ASMs on segments that flew
+    "block_per_departure": [0.3, 12.0],     # hours
+    "yield_mad_k": {"high": 4.0, "medium": 5.0, "low": 6.0},  # robust z on log yield
+    "price_per_gallon": [1.0, 6.0],         # Form 41 fuel_expense / fuel_gallons, $
+    "reconcile_tolerance_pct": 0.01,        # reconciled vs Form 41 after spreading
+    "weight_sum_tol": 1e-9,
+}
+
+@dataclass
+class Rule:
+    name: str
+    table: str                      # fact table scanned, or "partitions" / "config"
+    check: Callable                 # row rules: (chunk, t) -> bool mask of violating rows
+    columns: tuple = ()             # columns the check needs (row rules), or a function of the settings
+    severity: str = "error"         # "error" | "warn"
+    doc: str = ""
+
+@dataclass
+class Result:
+    rule: Rule
+    checked: int = 0
+    violations: int = 0
+    samples: list = field(default_factory=list)
+    skipped: str = ""
+
+    @property
+    def sample(self):
+        return pd.concat(self.samples, ignore_index=True) if self.samples else pd.DataFrame()
+
+def settings(cfg):
+    return {**QA_DEFAULTS, **((cfg or {}).get("qa") or {})}
+
+def _outside(x, lo_hi):
+    lo, hi = lo_hi
+    return (x < lo) | (x > hi)
+
+def _ratio(num, den):
+    num, den = num.to_numpy(float), den.to_numpy(float)
+    return np.divide(num, den, out=np.full(len(num), np.nan), where=den > 0)
+
+def _yield_outliers(df, t):
+    """Log-yield more than k robust SDs from its carrier-month median; k widens as
+       DB1B confidence drops."""
+    y = df["yield_est"].to_numpy(float)
+    ly = pd.Series(np.log(np.where(y > 0, y, np.nan)), index=df.index)
+    keys = [df["carrier"], df["month"]]
+    dev = (ly - ly.groupby(keys, observed=True).transform("median")).abs()
+    mad = 1.4826 * dev.groupby(keys, observed=True).transform("median")
+    k = df["confidence"].astype(object).map(t["yield_mad_k"]).astype(float).fillna(max(t["yield_mad_k"].values()))
+    return (dev > k * mad) & (mad > 0)
+
+def _fare_rules(table, prefix):
+    return [
+        Rule(f"{prefix}_positive", table, lambda d, t: (d["yield_est"] <= 0) | (d["avg_fare"] <= 0),
+             ("yield_est", "avg_fare"), doc="non-positive yield or fare"),
+        Rule(f"{prefix}_yield_outlier", table, _yield_outliers, ("yield_est", "confidence"), "warn",
+             "yield outlier for its DB1B confidence"),
+        Rule(f"{prefix}_coverage_range", table, lambda d, t: _outside(d["coverage"], (0.0, 1.0)),
+             ("coverage",), doc="DB1B coverage outside [0, 1]"),
+    ]
+
+ROW_RULES = [
+    # --- fact_segments ---
+    Rule("seg_rpms_le_asms", "fact_segments", lambda d, t: d["RPMs"] > d["ASMs"] * (1 + 1e-9),
+         ("ASMs", "RPMs"), doc="RPMs cannot exceed ASMs"),
+    Rule("seg_nonnegative", "fact_segments",
+         lambda d, t: (d[["departures", "block_hours", "ASMs", "RPMs", "pax"]] < 0).any(axis=1),
+         ("departures", "block_hours", "ASMs", "RPMs", "pax"), doc="negative departures/hours/ASMs/RPMs/pax"),
+    Rule("seg_load_factor", "fact_segments",
+         lambda d, t: (d["ASMs"] > 0) & _outside(_ratio(d["RPMs"], d["ASMs"]), t["load_factor"]),
+         ("ASMs", "RPMs"), "warn", "load factor outside qa.load_factor"),
+    Rule("seg_block_per_departure", "fact_segments",
+         lambda d, t: (d["departures"] > 0) & _outside(_ratio(d["block_hours"], d["departures"]),
+                                                       t["block_per_departure"]),
+         ("block_hours", "departures"), "warn", "block hours per departure outside qa.block_per_departure"),
+    Rule("seg_flown_without_departures", "fact_segments", lambda d, t: (d["ASMs"] > 0) & (d["departures"] <= 0),
+         ("ASMs", "departures"), doc="ASMs on a segment with no departures"),
+    # --- fact_fares (O&D) and fact_segment_fares (prorated, prorate.py) ---
+    *_fare_rules("fact_fares", "fare"),
+    *_fare_rules("fact_segment_fares", "segfare"),
+    # --- fact_financials ---
+    Rule("fin_nonnegative", "fact_financials",
+         lambda d, t: (d[["fuel_expense", "labor_expense", "maint_expense", "station_other", "fuel_gallons"]] < 0)
+                      .any(axis=1),
+         ("fuel_expense", "labor_expense", "maint_expense", "station_other", "fuel_gallons"),
+         doc="negative Form 41 total"),
+    Rule("fin_price_per_gallon", "fact_financials",
+         lambda d, t: (d["fuel_gallons"] > 0) & _outside(_ratio(d["fuel_expense"], d["fuel_gallons"]),
+                                                         t["price_per_gallon"]),
+         ("fuel_expense", "fuel_gallons"), "warn", "implied $/gallon outside qa.price_per_gallon"),
+    # --- fact_route_economics ---
+    Rule("econ_nonnegative_costs", "fact_route_economics",
+         lambda d, t: (d[t["bucket_costs"]] < 0).any(axis=1), lambda t: t["bucket_costs"], doc="negative allocated cost"),
+    Rule("econ_total_cost", "fact_route_economics",
+         lambda d, t: ~np.isclose(d["total_cost"], d[t["bucket_costs"]].sum(axis=1), rtol=1e-9, atol=1e-6),
+         lambda t: t["bucket_costs"] + ["total_cost"], doc="total_cost is not the sum of the bucket costs"),
+    # --- fact_reconciliation ---
+    Rule("recon_matches_form41", "fact_reconciliation",
+         lambda d, t: (100.0 * (d["reconciled"] - d["form41_total"]).abs()
+                       > t["reconcile_tolerance_pct"] * d["form41_total"].abs().clip(lower=1.0)),
+         ("bucket", "form41_total", "reconciled"),
+         doc="reconciled bucket cost differs from its Form 41 total after spreading"),
+    Rule("recon_within_tolerance", "fact_reconciliation", lambda d, t: ~d["within_tolerance"].astype(bool),
+         ("bucket", "residual_pct", "within_tolerance"), "warn",
+         "raw allocation outside reconciliation.tolerance_pct before spreading"),
+]
+
+# --- partition-level rules: frames of (carrier, month) keys, no data bytes read ---
+def _missing(parts, table, ref="fact_segments"):
+    have = set(map(tuple, parts[table].to_numpy())) if table in parts else set()
+    ref = parts.get(ref, pd.DataFrame(columns=PERIOD))
+    return ref[[k not in have for k in map(tuple, ref.to_numpy())]]
+
+def _month_gaps(parts, t):
+    """Months missing inside each carrier's first..last segment month."""
+    seg = parts.get("fact_segments", pd.DataFrame(columns=PERIOD))
+    out = []
+    for c, g in seg.groupby("carrier"):
+        have = sorted(g["month"])
+        out += [(c, m) for m in month_range(have[0], have[-1]) if m not in set(have)]
+    return pd.DataFrame(out, columns=PERIOD)
+
+PARTITION_RULES = [
+    Rule("cov_financials", "partitions", lambda p, t: _missing(p, "fact_financials"),
+         doc="segment carrier-month without Form 41 financials"),
+    Rule("cov_fares", "partitions", lambda p, t: _missing(p, "fact_fares"), severity="warn",
+         doc="segment carrier-month without DB1B fares (12.5¢ fallback yield)"),
+    Rule("cov_route_economics", "partitions", lambda p, t: _missing(p, "fact_route_economics"), severity="warn",
+         doc="segment carrier-month not allocated"),
+    Rule("cov_reconciliation", "partitions",
+         lambda p, t: _missing(p, "fact_reconciliation", ref="fact_route_economics"), severity="warn",
+         doc="allocated carrier-month never reconciled"),
+    Rule("cov_month_gaps", "partitions", _month_gaps, severity="warn", doc="gap in a carrier's segment months"),
+]
+
+def _weight_sums(cfg, t):
+    b = compile_buckets(cfg)
+    df = pd.DataFrame({"bucket": b.names, "weight_sum": b.W.sum(axis=0)})
+    return df[(df["weight_sum"] - 1.0).abs() > t["weight_sum_tol"]]
+
+def _expense_splits(cfg, t):
+    split = {}
+    for e in compile_buckets(cfg).expense:
+        for c, f in e.items():
+            split[c] = split.get(c, 0.0) + f
+    df = pd.DataFrame({"form41_column": list(split), "fraction_sum": list(split.values())})
+    return df[(df["fraction_sum"] - 1.0).abs() > t["weight_sum_tol"]]
+
+CONFIG_RULES = [
+    Rule("cfg_weights_sum_to_one", "config", _weight_sums,
+         doc="bucket driver weights do not sum to 1 (allocated shares would not sum to 1)"),
+    Rule("cfg_expense_split", "config", _expense_splits,
+         doc="a Form 41 column is not split exactly once across the buckets (cost lost or double-counted)"),
+]
+
+RULES = ROW_RULES + PARTITION_RULES + CONFIG_RULES
+
+# --- engine ---
+def scan(table, rules, t, sample=5):
+    """One streaming pass over a table evaluating every rule on each partition."""
+    results = [Result(r) for r in rules]
+    have = set(fact_store.columns(table))
+    need = {r.name: list(r.columns(t) if callable(r.columns) else r.columns) for r in rules}
+    live = []
+    for res in results:
+        lack = [c for c in need[res.rule.name] if c not in have]
+        if lack:
+            res.skipped = f"missing columns {lack}"
+        else:
+            live.append(res)
+    if not live:
+        return results
+    cols = list(dict.fromkeys([c for c in PERIOD if c in have] + [c for r in live for c in need[r.rule.name]]))
+    with instrument.span("qa.scan", table=table) as sp:
+        rows = 0
+        for chunk in fact_store.chunks(table, cols):
+            rows += len(chunk)
+            for res in live:
+                mask = np.asarray(res.rule.check(chunk, t), dtype=bool)
+                n = int(mask.sum())
+                res.checked += len(chunk)
+                res.violations += n
+                kept = sum(len(s) for s in res.samples)
+                if n and kept < sample:
+                    keep = [c for c in cols if c in PERIOD or c in need[res.rule.name]]
+                    res.samples.append(schema.labels(chunk.loc[mask, keep].head(sample - kept)))
+        sp.add(rows_in=rows)
+    return results
+
+def _frame_rule(rule, frame, checked, sample):
+    out = Result(rule, checked=checked, violations=len(frame))
+    if len(frame):
+        out.samples.append(frame.head(sample).reset_index(drop=True))
+    return out
+
+def run(tables=None, rules=RULES, cfg=None, sample=5, workers=None):
+    """Evaluate the rule set; returns one Result per rule (nothing is asserted)."""
+    if cfg is None:
+        cfg = load_config() or {}
+    t = {**settings(cfg), "bucket_costs": compile_buckets(cfg).costs}
+    by_table = {}
+    for r in rules:
+        if r.table not in ("partitions", "config") and (tables is None or r.table in tables):
+            by_table.setdefault(r.table, []).append(r)
+    missing = [tb for tb in by_table if not fact_store.exists(tb)]
+    results = [Result(r, skipped="table not built") for tb in missing for r in by_table.pop(tb)]
+
+    # parquet decode and the vectorized checks release the GIL; threads keep results in-process
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(by_table))) as ex:
+        for res in ex.map(lambda kv: scan(kv[0], kv[1], t, sample), by_table.items()):
+            results += res
+
+    if tables is None:
+        parts = {tb: pd.DataFrame(fact_store.list_partitions(tb), columns=PERIOD)
+                 for tb in fact_store.TABLES if fact_store.exists(tb)}
+        for r in rules:
+            if r.table == "partitions":
+                results.append(_frame_rule(r, r.check(parts, t), len(parts.get("fact_segments", ())), sample))
+            elif r.table == "config":
+                results.append(_frame_rule(r, r.check(cfg, t), 1, sample))
+    order = {r.name: i for i, r in enumerate(rules)}
+    return sorted(results, key=lambda res: order[res.rule.name])
+
+def report(results, out=None):
+    """Print one line per rule (plus samples of failures); optionally write all samples to CSV."""
+    for res in results:
+        r = res.rule
+        if res.skipped:
+            status = f"skip  ({res.skipped})"
+        elif res.violations:
+            status = f"{'FAIL' if r.severity == 'error' else 'warn'}  {res.violations:,} of {res.checked:,}"
+        else:
+            status = f"ok    {res.checked:,}"
+        print(f"[qa] {r.name:<30} {r.table:<22} {status}")
+        if res.violations:
+            print(f"     {r.doc}")
+            print("     " + res.sample.to_string(index=False).replace("\n", "\n     "))
+    errors = [res for res in results if res.violations and res.rule.severity == "error"]
+    warns = [res for res in results if res.violations and res.rule.severity != "error"]
+    print(f"[qa] {len(results)} rules: {len(errors)} failed, {len(warns)} warnings")
+    if out:
+        frames = [res.sample.assign(rule=res.rule.name, severity=res.rule.severity)
+                  for res in results if res.violations]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["rule", "severity"])
+        df = df[["rule", "severity"] + [c for c in df.columns if c not in ("rule", "severity")]]
+        Path(out).parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(out, index=False)
+        print(f"Wrote {out} with {len(df)} rows")
+    return errors
+
+def run_basic_checks(tables=None):
+    """Run every rule, print the report and fail if any error-severity rule has violations."""
+    errors = report(run(tables))
+    assert not errors, f"QA failed: {[res.rule.name for res in errors]}"
     print("Basic checks passed.")
 
 if __name__ == "__main__":
-    run_basic_checks()
+    import argparse
+    import sys
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--tables", nargs="+", choices=fact_store.TABLES,
+                   help="only scan these tables (skips coverage/config rules)")
+    p.add_argument("--sample", type=int, default=5, help="violating rows kept per rule")
+    p.add_argument("--workers", type=int, help="tables scanned at once (default: all)")
+    p.add_argument("--out", help="write every sampled violation to this CSV")
+    args = p.parse_args()
+    errors = report(run(args.tables, sample=args.sample, workers=args.workers), out=args.out)
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,200 @@
+"""
+Reconciliation of allocated costs to Form 41 (docs/methodology.md, Reconciliation)
+- one grouped pass: Σ allocated cost per carrier x month x bucket (every configured bucket,
+  allocation.compile_buckets) vs its share of the fact_financials totals -> residual and residual % against `reconciliation.tolerance_pct`
+- fuel burn diagnostic: modelled burn in gallons (Σ fuel.driver x burn_rate_hr, kg, over
+  fuel.kg_per_gallon) vs Form 41 fuel_gallons -> burn_scale and implied $/gallon per
+  carrier-month, reported in fact_reconciliation only: one factor per carrier-month cannot
+  move the fuel shares, it says how far the burn_rate_hr table is off (gallons per
+  gallon with the block_hours driver; a relative scale with any other)
+- residual drift is spread back onto the routes pro rata to their allocated cost in that
+  bucket (ASM share where a bucket allocated nothing); totals/KPIs are then recomputed
+- writes fact_reconciliation (the tie-out report) and the reconciled fact_route_economics
+- incremental: allocation reconciles the carrier-months it just allocated in memory; the
+  CLI only re-reads carrier-months whose route economics or financials partitions changed
+  since they were last reconciled (data_work/.reconcile_state.json)
+"""
+from pathlib import Path
+import json
+import os
+import numpy as np
+import pandas as pd
+import fact_store
+from allocation import PERIOD, add_totals, burn_rates, compile_buckets, load_config
+from utils import month_key, month_label
+
+DATA_WORK = Path("data_work")
+STATE = DATA_WORK / ".reconcile_state.json"
+
+DEFAULTS = {"tolerance_pct": 2.0, "spread_residuals": True}
+KG_PER_GALLON = 3.04      # Jet A at 0.804 kg/l; `fuel.kg_per_gallon` overrides
+
+def settings(cfg):
+    return {**DEFAULTS, **(cfg.get("reconciliation") or {})}
+
+def buckets(cfg):
+    """bucket -> (allocated cost column, {Form 41 column: fraction}) for every configured bucket."""
+    b = compile_buckets(cfg)
+    return dict(zip(b.names, zip(b.costs, b.expense)))
+
+def _sums(econ, cfg):
+    """Per carrier-month sums of every bucket's allocated cost plus the modelled burn
+       (gallons, on the allocation's fuel driver)."""
+    cols = [c for c, _ in buckets(cfg).values()]
+    e = econ[PERIOD + cols].copy()
+    e["model_burn"] = (econ[cfg["fuel"].get("driver", "block_hours")].fillna(0.0).to_numpy(float)
+                       * burn_rates(econ["fleet_type"], cfg).to_numpy(float)
+                       / float(cfg["fuel"].get("kg_per_gallon", KG_PER_GALLON)))
+    return e.groupby(PERIOD, observed=True, sort=True).sum().reset_index()
+
+def tie_out(econ, fin, cfg):
+    """Long tie-out report: one row per carrier x month x bucket."""
+    tol = float(settings(cfg)["tolerance_pct"])
+    s = _sums(econ, cfg).merge(fin.drop_duplicates(PERIOD), on=PERIOD, how="left")
+
+    rep = pd.concat([
+        pd.DataFrame({"carrier": s["carrier"], "month": s["month"], "bucket": b,
+                      "form41_total": sum(f * s[c].to_numpy(float) for c, f in split.items()),
+                      "allocated": s[cc].to_numpy(float)})
+        for b, (cc, split) in buckets(cfg).items()], ignore_index=True)
+    rep["residual"] = rep["form41_total"] - rep["allocated"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rep["residual_pct"] = np.where(rep["form41_total"] != 0,
+                                       100.0 * rep["residual"] / rep["form41_total"],
+                                       np.where(rep["allocated"] == 0, 0.0, np.inf))
+    rep["within_tolerance"] = rep["residual_pct"].abs() <= tol
+
+    # fuel burn diagnostic (fuel rows only)
+    fuel = (rep["bucket"] == "fuel").to_numpy()
+    gal, burn, usd = (s["fuel_gallons"].to_numpy(float), s["model_burn"].to_numpy(float),
+                      s["fuel_expense"].to_numpy(float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        calib = {"fuel_gallons": gal, "model_burn": burn,
+                 "burn_scale": np.where(burn > 0, gal / burn, np.nan),
+                 "price_per_gallon": np.where(gal > 0, usd / gal, np.nan)}
+    for k, v in calib.items():
+        rep[k] = np.nan
+        rep.loc[fuel, k] = v
+    return rep
+
+def spread(econ, rep, cfg):
+    """Spread each carrier-month-bucket residual over its routes pro rata to allocated cost
+       (ASM share if the bucket allocated nothing there). Returns a new frame."""
+    out = econ.reset_index(drop=True).copy()
+    res = (rep.pivot_table(index=PERIOD, columns="bucket", values="residual", observed=True)
+              .reset_index())
+    res = out[PERIOD].merge(res, on=PERIOD, how="left")
+    g = out.groupby(PERIOD, observed=True)
+    asm = out["ASMs"].fillna(0.0).to_numpy(float)
+    asm_tot = g["ASMs"].transform("sum").to_numpy(float)
+    asm_w = np.divide(asm, asm_tot, out=np.zeros_like(asm), where=asm_tot > 0)
+    for b, (cc, _) in buckets(cfg).items():
+        if b not in res:
+            continue
+        cost = out[cc].to_numpy(float)
+        tot = g[cc].transform("sum").to_numpy(float)
+        w = np.divide(cost, tot, out=asm_w.copy(), where=tot != 0)
+        out[cc] = cost + np.nan_to_num(res[b].to_numpy(float)) * w
+    return add_totals(out)
+
+def reconcile_frame(econ, fin, cfg):
+    """(reconciled route economics, tie-out report) for the carrier-months in econ."""
+    rep = tie_out(econ, fin, cfg)
+    if settings(cfg)["spread_residuals"]:
+        econ = spread(econ, rep, cfg)
+    after = _sums(econ, cfg)
+    cols = {cc: b for b, (cc, _) in buckets(cfg).items()}
+    after = after.melt(id_vars=PERIOD, value_vars=list(cols), var_name="bucket", value_name="reconciled")
+    after["bucket"] = after["bucket"].map(cols)
+    rep = rep.merge(after, on=PERIOD + ["bucket"], how="left")
+    return econ, rep
+
+def summarize(rep, cfg):
+    tol = float(settings(cfg)["tolerance_pct"])
+    bad = rep[~rep["within_tolerance"]]
+    worst = rep["residual_pct"].abs().replace(np.inf, np.nan).max()
+    print(f"[reconcile] {rep[PERIOD].drop_duplicates().shape[0]} carrier-months x {rep['bucket'].nunique()} buckets: "
+          f"{len(bad)} outside ±{tol:g}% before spreading (worst {worst:.3f}%)"
+          + (", residuals spread" if settings(cfg)["spread_residuals"] else ""))
+    for r in bad.head(10).itertuples(index=False):
+        print(f"  {r.carrier} {month_label(r.month)} {r.bucket:<13} Form41 {r.form41_total:>16,.0f}  "
+              f"allocated {r.allocated:>16,.0f}  ({r.residual_pct:+.2f}%)")
+
+# --- incremental state ---
+def _load_state():
+    return json.loads(STATE.read_text()) if STATE.exists() else {}
+
+def _signatures():
+    econ = fact_store.partition_signatures("fact_route_economics")
+    fin = fact_store.partition_signatures("fact_financials")
+    return {f"{c}/{m}": [econ[(c, m)], fin.get((c, m))] for c, m in econ}
+
+def record(keys):
+    """Mark carrier-months as reconciled at their current partition signatures (and forget
+       the ones no longer in the store)."""
+    sig = _signatures()
+    state = {k: s for k, s in _load_state().items() if k in sig}
+    for c, m in keys:
+        k = f"{c}/{month_label(m)}"
+        if k in sig:
+            state[k] = sig[k]
+    DATA_WORK.mkdir(exist_ok=True)
+    tmp = STATE.with_suffix(f".json.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(tmp, STATE)
+
+def changed(months=None, carriers=None):
+    """(carrier, month) pairs whose route economics or financials changed since last reconciled."""
+    state = _load_state()
+    out = []
+    for k, s in sorted(_signatures().items()):
+        c, m = k.split("/")
+        if months is not None and m not in {month_label(x) for x in months}:
+            continue
+        if carriers is not None and c not in set(carriers):
+            continue
+        if state.get(k) != s:
+            out.append((c, m))
+    return out
+
+def run(months=None, carriers=None, force=False, write=True):
+    cfg = load_config()
+    todo = changed(months, carriers)
+    if force:
+        todo = [(c, m) for c, m in fact_store.list_partitions("fact_route_economics")
+                if (months is None or m in {month_label(x) for x in months})
+                and (carriers is None or c in set(carriers))]
+    if not todo:
+        print("[reconcile] up to date")
+        return None
+    ms, cs = sorted({m for _, m in todo}), sorted({c for c, _ in todo})
+    econ = fact_store.read("fact_route_economics", months=ms, carriers=cs)
+    fin = fact_store.read("fact_financials", months=ms, carriers=cs)
+    # the carrier x month read can over-fetch; keep the changed pairs only
+    want = pd.DataFrame({"carrier": [c for c, _ in todo], "month": [month_key(m) for _, m in todo]})
+    econ = econ[econ[PERIOD].merge(want, on=PERIOD, how="left", indicator=True)["_merge"].eq("both").to_numpy()]
+
+    econ, rep = reconcile_frame(econ, fin, cfg)
+    summarize(rep, cfg)
+    if write:
+        fact_store.write(econ, "fact_route_economics")
+        fact_store.write(rep, "fact_reconciliation")
+        record(todo)
+        print(f"Wrote {DATA_WORK/'fact_reconciliation'} with {len(rep)} rows")
+    return rep
+
+if __name__ == "__main__":
+    import argparse
+    from utils import parse_carriers, parse_months
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--month", help="YYYY-MM, YYYY-MM..YYYY-MM or comma list (default: all)")
+    p.add_argument("--carriers", help="comma list of carriers (default: all)")
+    p.add_argument("--force", action="store_true", help="re-reconcile even unchanged carrier-months")
+    p.add_argument("--out", help="also export the tie-out report to this CSV")
+    args = p.parse_args()
+    months = parse_months(args.month) if args.month else None
+    carriers = parse_carriers(args.carriers)
+    run(months, carriers, force=args.force)
+    if args.out:
+        fact_store.export_csv("fact_reconciliation", out=args.out, months=months, carriers=carriers)
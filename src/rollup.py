@@ -0,0 +1,238 @@
+"""
+Dashboard rollup cube over fact_route_economics
+- materializes additive measures (revenue, every configured bucket's cost, ASMs, RPMs,
+  departures, pax, block hours, route rows) per carrier x month at every dashboard grain:
+  network, origin, dest, OD, fleet_type, stage_bin (memo stage-length bins) and origin
+  region (`regions:` in allocation_config.yaml; unmapped airports roll up as "Other")
+- ratios (RASM, CASM, yield, load factor, margin/ASM, stage length) are never stored; query()
+  derives them from the summed measures, so any re-grouping of cells stays exact
+- fact_rollup is partitioned like its source, so a re-allocated carrier-month refreshes only
+  its own cells; refresh() compares fact_route_economics partition signatures against
+  data_work/.rollup_state.json (a change to regions/bins or to the airport coordinates
+  behind stage_bin rebuilds everything); the cells of a carrier-month that left
+  fact_route_economics are deleted and dropped from the state
+- query() answers from the cube, cached in memory until a partition changes
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import distances
+import fact_store
+import instrument
+from allocation import PERIOD, bucket_costs, compile_buckets, load_config
+from build_memo_tables import BINS, LABELS, stage_bins
+from utils import month_key, month_label
+
+DATA_WORK = Path("data_work")
+STATE = DATA_WORK / ".rollup_state.json"
+
+# additive measures besides the bucket costs (one <bucket>_cost per configured bucket)
+MEASURES = ["revenue", "total_cost", "ASMs", "RPMs", "departures", "pax", "block_hours"]
+# grain -> dimension columns (besides carrier, month)
+GRAINS = {
+    "network":   [],
+    "origin":    ["origin"],
+    "dest":      ["dest"],
+    "od":        ["origin", "dest"],
+    "fleet":     ["fleet_type"],
+    "stage_bin": ["stage_bin"],
+    "region":    ["origin_region"],
+}
+DIMS = ["origin", "dest", "fleet_type", "stage_bin", "origin_region"]
+
+def measures(df):
+    """Summed columns for an allocation frame or cube: revenue, its bucket costs, the rest."""
+    return MEASURES[:1] + bucket_costs(df) + MEASURES[1:]
+
+def regions(cfg):
+    """{airport: region} from `regions: {region: [airports]}`."""
+    return {ap: r for r, aps in (cfg.get("regions") or {}).items() for ap in aps}
+
+def _version(cfg):
+    """Changes whenever a cell's dimension definitions change."""
+    doc = {"regions": cfg.get("regions"), "bins": [BINS, LABELS], "coords": distances.version(),
+           "grains": GRAINS, "measures": MEASURES, "buckets": compile_buckets(cfg).costs}
+    return hashlib.sha256(json.dumps(doc, sort_keys=True).encode()).hexdigest()[:16]
+
+def build(econ, cfg):
+    """All grains' cells for the carrier-months in econ (one row per carrier x month x grain x dims)."""
+    ms = measures(econ)
+    e = econ[PERIOD + ["origin", "dest", "fleet_type"] + ms].copy()
+    e["stage_bin"] = stage_bins(econ)
+    reg = regions(cfg)
+    e["origin_region"] = pd.Categorical(
+        econ["origin"].astype(str).map(reg).fillna("Other"),
+        categories=sorted(set(reg.values()) | {"Other"}))
+    e["routes"] = 1
+
+    cells = []
+    with instrument.span("rollup.build", rows_in=len(e)) as sp:
+        for grain, dims in GRAINS.items():
+            # dropna=False keeps routes without a stage length (no pax) in the stage_bin grain
+            g = (e.groupby(PERIOD + dims, observed=True, sort=True, dropna=False)[ms + ["routes"]]
+                  .sum().reset_index())
+            g.insert(2, "grain", grain)
+            cells.append(g)
+        cube = pd.concat(cells, ignore_index=True)
+        sp.add(rows_out=len(cube))
+    return cube[PERIOD + ["grain"] + DIMS + ms + ["routes"]]
+
+# --- incremental state ---
+def _load_state():
+    return json.loads(STATE.read_text()) if STATE.exists() else {}
+
+def _save_state(state):
+    DATA_WORK.mkdir(exist_ok=True)
+    tmp = STATE.with_suffix(f".json.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(tmp, STATE)
+
+def stale(cfg, months=None, carriers=None):
+    """(carrier, month) pairs of fact_route_economics whose cells are missing or out of date."""
+    state = _load_state()
+    fresh = state.get("version") == _version(cfg)
+    done = state.get("partitions", {}) if fresh else {}
+    want_m = None if months is None else {month_label(m) for m in months}
+    return [(c, m) for (c, m), sig in sorted(fact_store.partition_signatures("fact_route_economics").items())
+            if (want_m is None or m in want_m) and (carriers is None or c in set(carriers))
+            and done.get(f"{c}/{m}") != sig]
+
+def orphans(months=None, carriers=None):
+    """(carrier, month) pairs with cells in fact_rollup or in the state whose
+       fact_route_economics partition no longer exists."""
+    want_m = None if months is None else {month_label(m) for m in months}
+    have = set(fact_store.list_partitions("fact_rollup"))
+    have |= {tuple(k.split("/", 1)) for k in _load_state().get("partitions", {})}
+    return sorted(k for k in have - set(fact_store.partition_signatures("fact_route_economics"))
+                  if (want_m is None or k[1] in want_m) and (carriers is None or k[0] in set(carriers)))
+
+@instrument.traced("rollup")
+def refresh(months=None, carriers=None, force=False):
+    """Rebuild the cells of changed carrier-months only (all of them with force) and delete
+       those of carrier-months no longer allocated."""
+    cfg = load_config()
+    todo = stale(cfg, months, carriers)
+    if force:
+        todo = [(c, m) for c, m in fact_store.list_partitions("fact_route_economics")
+                if (months is None or m in {month_label(x) for x in months})
+                and (carriers is None or c in set(carriers))]
+    gone = orphans(months, carriers)
+    if gone:
+        fact_store.drop("fact_rollup", gone)
+        state = _load_state()
+        for c, m in gone:
+            state.get("partitions", {}).pop(f"{c}/{m}", None)
+        _save_state(state)
+        print(f"[rollup] removed the cells of {len(gone)} carrier-months no longer allocated: "
+              f"{[f'{c}:{m}' for c, m in gone]}")
+    if not todo:
+        print("[rollup] up to date")
+        return []
+
+    # read back only the stale partitions, one carrier at a time
+    by_carriers = {}
+    for c, m in todo:
+        by_carriers.setdefault(c, []).append(m)
+    n = 0
+    for c, ms in sorted(by_carriers.items()):
+        econ = fact_store.read("fact_route_economics", months=ms, carriers=[c])
+        cube = build(econ, cfg)
+        fact_store.write(cube, "fact_rollup")
+        n += len(cube)
+
+    state = _load_state()
+    if state.get("version") != _version(cfg):
+        state = {"version": _version(cfg), "partitions": {}}
+    sigs = fact_store.partition_signatures("fact_route_economics")
+    for c, m in todo:
+        state["partitions"][f"{c}/{m}"] = sigs[(c, m)]
+    _save_state(state)
+    print(f"Wrote {DATA_WORK/'fact_rollup'} with {n} cells for {len(todo)} carrier-months")
+    return todo
+
+# --- queries ---
+_cache = {"sig": None, "cube": None}
+
+def cube(grain):
+    """One grain's cells; the cube is re-read only when a fact_rollup partition changed."""
+    if grain not in GRAINS:
+        raise KeyError(f"Unknown grain {grain!r}; have {list(GRAINS)}")
+    sig = fact_store.partition_signatures("fact_rollup")
+    if sig != _cache["sig"]:
+        c = fact_store.read("fact_rollup")
+        _cache["cube"] = {str(g): part.reset_index(drop=True) for g, part in c.groupby("grain", sort=False)}
+        _cache["empty"] = c.iloc[0:0]
+        _cache["sig"] = sig
+    return _cache["cube"].get(grain, _cache["empty"])
+
+def _per(num, den):
+    return np.divide(num, den, out=np.full(len(num), np.nan), where=den > 0)
+
+def kpis(m):
+    """Derived KPIs from summed measures (a frame or a dict of arrays) -> {name: array}."""
+    v = {c: np.asarray(m[c], dtype=float) for c in ("revenue", "total_cost", "ASMs", "RPMs", "pax")}
+    margin = v["revenue"] - v["total_cost"]
+    return {
+        "margin": margin,
+        "rasm": _per(v["revenue"], v["ASMs"]),
+        "casm": _per(v["total_cost"], v["ASMs"]),
+        "margin_per_ASM": _per(margin, v["ASMs"]),
+        "load_factor": _per(v["RPMs"], v["ASMs"]),
+        "yield": _per(v["revenue"], v["RPMs"]),
+        "stage_length": _per(v["RPMs"], v["pax"]),
+    }
+
+def ratios(df):
+    """df with the derived KPIs appended in one block."""
+    return pd.concat([df, pd.DataFrame(kpis(df), index=df.index)], axis=1)
+
+def query(grain, months=None, carriers=None, by_month=True, where=None, sort=None, top=None):
+    """Cells of one grain summed over the requested carriers/months, with KPIs derived.
+       where: {dim: value or list}; by_month=False rolls the months up; sort/top order by a
+       measure or KPI column (descending)."""
+    c = cube(grain)
+    mask = np.ones(len(c), dtype=bool)
+    if months is not None:
+        mask &= c["month"].isin({month_key(m) for m in months}).to_numpy()
+    if carriers is not None:
+        mask &= c["carrier"].isin(set(carriers)).to_numpy()
+    for dim, v in (where or {}).items():
+        mask &= c[dim].isin(v if isinstance(v, (list, tuple, set)) else [v]).to_numpy()
+    sel = c[mask]
+
+    keys = ["carrier"] + (["month"] if by_month else []) + GRAINS[grain]
+    out = ratios(sel.groupby(keys, observed=True, sort=True, dropna=False)[measures(sel) + ["routes"]]
+                    .sum().reset_index())
+    if sort:
+        out = out.sort_values(sort, ascending=False, na_position="last")
+    return out.head(top) if top else out.reset_index(drop=True)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from utils import parse_carriers, parse_months
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--month", help="YYYY-MM, YYYY-MM..YYYY-MM or comma list (default: all)")
+    p.add_argument("--carriers", help="comma list of carriers (default: all)")
+    p.add_argument("--force", action="store_true", help="rebuild cells even for unchanged carrier-months")
+    p.add_argument("--query", choices=GRAINS, help="print a rollup at this grain instead of refreshing")
+    p.add_argument("--total", action="store_true", help="with --query: roll the months up")
+    p.add_argument("--sort", default="margin", help="with --query: order by this column")
+    p.add_argument("--top", type=int, default=20)
+    args = p.parse_args()
+    months = parse_months(args.month) if args.month else None
+    carriers = parse_carriers(args.carriers)
+
+    if args.query:
+        t0 = time.perf_counter()
+        out = query(args.query, months, carriers, by_month=not args.total, sort=args.sort, top=args.top)
+        ms = 1000 * (time.perf_counter() - t0)
+        with pd.option_context("display.width", 200, "display.max_columns", 30):
+            print(out.assign(**({"month": out["month"].map(month_label)} if "month" in out else {})).to_string(index=False))
+        print(f"[rollup] {len(out)} rows in {ms:.1f} ms")
+    else:
+        refresh(months, carriers, force=args.force)
@@ -0,0 +1,174 @@
+"""
+Shared column types for the fact tables
+- carriers, airports (origin/dest) and fleets are categoricals over one stable, append-only
+  dictionary per kind, persisted in data_work/categories.json, so codes never move and
+  merges/groupbys across stages and partitions compare integer codes
+- month is an int32 YYYYMM key (utils.MonthKey); partition names and CSV/docs exports keep
+  the "YYYY-MM" label
+- counts are downcast to int32; money, miles and shares stay float64 so allocation sums
+  reproduce exactly
+- carrier is on every table; frames without one (mock data, pre-multi-carrier partitions)
+  are the single carrier the pipeline used to hard-code, DEFAULT_CARRIER
+- cast() is applied once at ingest (fact_store.write); conform() re-aligns partitions
+  written under an older, shorter dictionary on read
+"""
+from pathlib import Path
+import json
+import fcntl
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from utils import month_label
+
+WORK = Path("data_work")
+CATEGORIES = WORK / "categories.json"
+
+MONTH = "int32"
+KINDS = ("carrier", "airport", "fleet")
+DEFAULT_CARRIER = "WN"
+CONFIDENCE = pd.CategoricalDtype(["low", "medium", "high"], ordered=True)
+
+# table -> column -> "carrier" | "airport" | "fleet" | "month" | dtype
+TABLES = {
+    "fact_segments": {
+        "carrier": "carrier", "month": "month", "origin": "airport", "dest": "airport", "fleet_type": "fleet",
+        "departures": "int32", "block_hours": "float64", "ASMs": "float64", "RPMs": "float64",
+        "pax": "int32",
+    },
+    "fact_financials": {
+        "carrier": "carrier", "month": "month", "fuel_expense": "float64", "labor_expense": "float64",
+        "maint_expense": "float64", "station_other": "float64", "fuel_gallons": "float64",
+    },
+    "fact_fares": {
+        "carrier": "carrier", "month": "month", "origin": "airport", "dest": "airport", "yield_est": "float64",
+        "avg_fare": "float64", "pax": "float64", "coverage": "float64", "confidence": CONFIDENCE,
+    },
+    "fact_segment_fares": {
+        "carrier": "carrier", "month": "month", "origin": "airport", "dest": "airport", "yield_est": "float64",
+        "avg_fare": "float64", "pax": "float64", "coverage": "float64", "confidence": CONFIDENCE,
+    },
+    "fact_route_economics": {
+        "carrier": "carrier", "month": "month", "origin": "airport", "dest": "airport", "fleet_type": "fleet",
+        "departures": "int32", "pax": "int32",
+    },
+}
+# analysis tables only need the shared keys typed
+for _t in ("fact_scenarios", "fact_margin_bands", "fact_marginal"):
+    TABLES[_t] = {"carrier": "carrier", "month": "month", "origin": "airport", "dest": "airport", "fleet_type": "fleet"}
+TABLES["fact_reconciliation"] = {"carrier": "carrier", "month": "month"}
+TABLES["fact_flight_economics"] = {
+    "carrier": "carrier", "month": "month", "day": "Int8", "dep_time": "Int16", "flight_no": "Int32",
+    "origin": "airport", "dest": "airport", "fleet_type": "fleet",
+}
+TABLES["fact_rollup"] = {"carrier": "carrier", "month": "month", "origin": "airport", "dest": "airport",
+                         "fleet_type": "fleet"}
+
+_lock = threading.Lock()
+_dicts = {k: [] for k in KINDS}
+_stamp = None
+
+def _refresh():
+    """Reload the dictionary if another process has grown it since we last looked."""
+    global _dicts, _stamp
+    try:
+        st = CATEGORIES.stat()
+    except FileNotFoundError:
+        return
+    if (st.st_mtime_ns, st.st_size) != _stamp:
+        on_disk = json.loads(CATEGORIES.read_text())
+        _dicts = {k: on_disk.get(k, []) for k in KINDS}
+        _stamp = (st.st_mtime_ns, st.st_size)
+
+def _extend(kind, new):
+    """Append values under an exclusive file lock (segments and fares ingest run concurrently)."""
+    global _stamp
+    WORK.mkdir(exist_ok=True)
+    with open(CATEGORIES.with_suffix(".lock"), "w") as lk:
+        fcntl.flock(lk, fcntl.LOCK_EX)
+        _refresh()
+        add = [v for v in new if v not in set(_dicts[kind])]
+        if add:
+            _dicts[kind] = _dicts[kind] + add
+            tmp = CATEGORIES.with_suffix(f".json.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(_dicts, indent=1))
+            os.replace(tmp, CATEGORIES)
+            st = CATEGORIES.stat()
+            _stamp = (st.st_mtime_ns, st.st_size)
+
+def dtype(kind, values=()):
+    """CategoricalDtype for a kind, appending any unseen values to the shared dictionary."""
+    with _lock:
+        _refresh()
+        values = pd.unique(pd.Series(values, dtype=object).dropna().astype(str))
+        new = sorted(set(values) - set(_dicts[kind]))
+        if new:
+            _extend(kind, new)
+        return pd.CategoricalDtype(_dicts[kind])
+
+def _distinct(s):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return np.asarray(s.cat.categories, dtype=object)
+    return pd.unique(s.dropna().astype(str)).astype(object)
+
+def _to(s, dt):
+    if s.dtype == dt:
+        return s
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.cat.set_categories(dt.categories)
+    return s.astype(str).where(s.notna()).astype(dt)
+
+def month_keys(s):
+    """'YYYY-MM' labels (or YYYYMM ints) -> int32 YYYYMM keys."""
+    if pd.api.types.is_integer_dtype(s):
+        return s.astype(MONTH)
+    s = s.astype(str)
+    return (s.str[:4].astype("int32") * 100 + s.str[5:7].astype("int32")).astype(MONTH)
+
+def cast(df, table):
+    """Cast a frame to its table's compact schema (no-op for columns already typed)."""
+    spec = TABLES.get(table)
+    if not spec:
+        return df
+    df = df.copy()
+    if "carrier" in spec and "carrier" not in df.columns:
+        df.insert(0, "carrier", DEFAULT_CARRIER)
+    by_kind = {}
+    for c, t in spec.items():
+        if c in df.columns and t in KINDS:
+            by_kind.setdefault(t, []).append(c)
+    for kind, cols in by_kind.items():
+        dt = dtype(kind, np.concatenate([_distinct(df[c]) for c in cols]))
+        for c in cols:
+            df[c] = _to(df[c], dt)
+    for c, t in spec.items():
+        if c not in df.columns or t in KINDS:
+            continue
+        if t == "month":
+            df[c] = month_keys(df[c])
+        elif df[c].dtype != t:
+            df[c] = df[c].fillna(0).astype(t) if str(t).startswith("int") else df[c].astype(t)
+    return df
+
+def conform(df, table):
+    """Align a partition read back from disk with the current dictionary (partitions written
+       before the dictionary grew carry a prefix of it) and key legacy string months."""
+    spec = TABLES.get(table)
+    if not spec:
+        return df
+    for c, t in spec.items():
+        if c not in df.columns:
+            continue
+        if t == "month" and not pd.api.types.is_integer_dtype(df[c]):
+            df[c] = month_keys(df[c])
+        elif t in KINDS:
+            df[c] = _to(df[c], dtype(t, _distinct(df[c])))
+    return df
+
+def labels(df):
+    """Copy with the month key rendered as 'YYYY-MM' (for CSV/docs output)."""
+    if "month" in df.columns and pd.api.types.is_integer_dtype(df["month"]):
+        df = df.copy()
+        df["month"] = df["month"].map(month_label)
+    return df
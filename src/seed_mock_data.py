@@ -1,6 +1,7 @@
 # src/seed_mock_data.py
 from pathlib import Path
 import pandas as pd
+import fact_store
 
 DATA_WORK = Path("data_work")
 DATA_WORK.mkdir(exist_ok=True)
@@ -40,10 +41,10 @@ fact_fares = pd.DataFrame([
 fact_fares.columns = ["month","origin","dest","yield_est","avg_fare","pax"]
 
 # write files
-fact_segments.to_csv(DATA_WORK/"fact_segments.csv", index=False)
-fact_financials.to_csv(DATA_WORK/"fact_financials.csv", index=False)
-fact_fares.to_csv(DATA_WORK/"fact_fares.csv", index=False)
+fact_store.write(fact_segments, "fact_segments", overwrite=True)
+fact_store.write(fact_financials, "fact_financials", overwrite=True)
+fact_store.write(fact_fares, "fact_fares", overwrite=True)
 
-print("Seeded mock CSVs in data_work/:")
-for f in ["fact_segments.csv","fact_financials.csv","fact_fares.csv"]:
+print("Seeded mock fact tables in data_work/:")
+for f in ["fact_segments","fact_financials","fact_fares"]:
     print(" -", DATA_WORK/f)
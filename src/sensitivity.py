@@ -1,25 +1,159 @@
 """
-Simple sensitivity runner:
-- fuel +/- : scales total fuel expense before re-allocating shares
-- lf +/- : adjusts RPMs (and therefore revenue) via ASMs * (LF +/- delta)
-(Assumes data_work/fact_financials.csv and fact_segments.csv exist.)
+Scenario engine for sensitivities:
+- allocation shares are computed once per carrier-month (allocation.allocate_frame)
+- allocated costs are linear in the bucket totals, so a grid of bucket shocks (+/- % on
+  any configured bucket: fuel/labor/maint/station and every `buckets:` entry, named after
+  its cost column) is one (routes x buckets) @ (buckets x scenarios) product
+- lf +/- pts : adjusts RPMs (and therefore revenue) via ASMs * (LF +/- delta)
+- writes a tidy route x scenario delta table (fact_scenarios); baseline inputs are only read
 """
+import itertools
+import numpy as np
 import pandas as pd
 from pathlib import Path
+import fact_store
+import schema
+from allocation import load_config, load_inputs, allocate_frame, bucket_costs, compile_buckets, with_financials
 
 DATA_WORK = Path("data_work")
 
-def fuel_shock(month:str, pct:float):
-    fin = pd.read_csv(DATA_WORK/"fact_financials.csv")
-    fin.loc[fin["month"]==month, "fuel_expense"] *= (1 + pct/100.0)
-    fin.to_csv(DATA_WORK/"fact_financials_shocked.csv", index=False)
-    print(f"Applied fuel shock {pct}% for {month} -> data_work/fact_financials_shocked.csv")
+KEYS = ["carrier", "month", "origin", "dest", "fleet_type"]
+def shock(cost):
+    """Shock name of a bucket cost column: fuel_cost -> fuel (scenario column fuel_pct)."""
+    return cost[:-len("_cost")]
+
+def shocks(cfg):
+    """Shock names of every configured bucket, in bucket order."""
+    return [shock(c) for c in compile_buckets(cfg).costs]
+
+def _dims(buckets):
+    return [f"{k}_pct" for k in buckets] + ["lf_pts"]
+
+def _label(r):
+    parts = [f"{k[:-len('_pct')]}{r[k]:+g}%" for k in r if k.endswith("_pct") and r[k]]
+    if r["lf_pts"]:
+        parts.append(f"lf{r['lf_pts']:+g}pts")
+    return "|".join(parts) or "base"
+
+def build_scenarios(lf=(), cross=False, **buckets):
+    """Scenario grid, baseline first: buckets are {shock name: [+/- %, ...]} (e.g. fuel=[10, -10];
+       pass every configured bucket, empty or not, for one column each), lf in pts.
+       One-at-a-time shocks by default; cross=True takes the cartesian product of every
+       listed dimension."""
+    cols = _dims(buckets)
+    dims = dict(zip(cols, list(buckets.values()) + [lf]))
+    rows = [dict.fromkeys(cols, 0.0)]
+    if cross:
+        active = {k: [0.0] + [float(v) for v in vals] for k, vals in dims.items() if len(vals)}
+        for combo in itertools.product(*active.values()):
+            r = dict.fromkeys(cols, 0.0); r.update(zip(active, combo)); rows.append(r)
+    else:
+        for k, vals in dims.items():
+            for v in vals:
+                r = dict.fromkeys(cols, 0.0); r[k] = float(v); rows.append(r)
+    sc = pd.DataFrame(rows, columns=cols).drop_duplicates().reset_index(drop=True)
+    sc.insert(0, "scenario", [_label(r) for r in sc.to_dict("records")])
+    return sc
+
+def scenario(lf=0.0, **buckets):
+    """A single scenario row (same columns as build_scenarios), e.g. for an on-demand what-if."""
+    r = dict(zip(_dims(buckets), map(float, list(buckets.values()) + [lf])))
+    sc = pd.DataFrame([r], columns=list(r))
+    sc.insert(0, "scenario", [_label(r)])
+    return sc
+
+def evaluate(base, scenarios):
+    """Route x scenario economics from one baseline allocation, in a single vectorized pass."""
+    sc = scenarios.reset_index(drop=True)
+    R, S = len(base), len(sc)
+    dims = [c for c in sc.columns if c != "scenario"]
+    costs = bucket_costs(base)
+    unknown = sorted(set(dims) - set(_dims(map(shock, costs))))
+    if unknown:
+        raise ValueError(f"no cost bucket for scenario columns {unknown}; have {costs}")
+
+    # costs: (R x buckets) @ (buckets x S); buckets a scenario does not shock stay at baseline
+    C = base[costs].to_numpy(float)
+    M = 1.0 + sc.reindex(columns=_dims(map(shock, costs))[:-1], fill_value=0.0).to_numpy(float) / 100.0
+    cost = C @ M.T
+
+    # revenue: RPMs move with load factor, yield held at the baseline
+    asm = base["ASMs"].to_numpy(float)[:, None]
+    rpm = base["RPMs"].to_numpy(float)[:, None]
+    rev = base["revenue"].to_numpy(float)[:, None]
+    yld = np.divide(rev, rpm, out=np.full_like(rev, 0.125), where=rpm > 0)
+    lf = sc["lf_pts"].to_numpy(float)[None, :]
+    rpm_s = np.where(lf == 0, rpm, np.clip(rpm + asm * lf / 100.0, 0.0, asm))
+    revenue = rpm_s * yld
+
+    margin = revenue - cost
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rasm = np.where(asm > 0, revenue / asm, np.nan)
+        casm = np.where(asm > 0, cost / asm, np.nan)
+
+    # route keys repeated per scenario, then every other column in one block
+    out = base[KEYS].loc[base.index.repeat(S)].reset_index(drop=True)
+    cols = {c: np.tile(sc[c].to_numpy(), R) for c in ["scenario"] + dims}
+    for name, arr in [("revenue", revenue), ("total_cost", cost), ("margin", margin),
+                      ("rasm", rasm), ("casm", casm)]:
+        cols[name] = arr.ravel()
+        cols[f"d_{name}"] = (arr - base[name].to_numpy(float)[:, None]).ravel()
+    return pd.concat([out, pd.DataFrame(cols, index=out.index)], axis=1)
+
+def run(months, scenarios, write=True, carriers=None):
+    cfg = load_config()
+    seg, fin, fares = load_inputs(months, carriers)
+    seg = with_financials(seg, fin)
+    base = allocate_frame(seg, fin, fares, cfg).reset_index(drop=True)
+    cube = evaluate(base, scenarios)
+    if write:
+        fact_store.write(cube, "fact_scenarios")
+        print(f"Wrote {DATA_WORK/'fact_scenarios'} with {len(cube)} rows "
+              f"({len(base)} routes x {len(scenarios)} scenarios)")
+    return cube
+
+def summarize(cube, scenario, top=10):
+    """Print baseline vs one scenario: RASM/CASM means and top routes with deltas."""
+    for name in ["base", scenario]:
+        m = cube[cube["scenario"] == name]
+        print(f"\n=== {name} ===")
+        print("Routes:", len(m),
+              "  RASM mean:", round(float(np.nanmean(m["rasm"])), 3),
+              "  CASM mean:", round(float(np.nanmean(m["casm"])), 3))
+    b = cube[cube["scenario"] == "base"].set_index(KEYS)
+    s = cube[cube["scenario"] == scenario].set_index(KEYS)
+    t = b[["rasm", "casm", "margin"]].join(s[["d_rasm", "d_casm", "d_margin"]])
+    t = t.sort_values("margin", ascending=False).head(top).reset_index()
+    t["d_rasm"] = t["d_rasm"].round(5); t["d_casm"] = t["d_casm"].round(5); t["d_margin"] = t["d_margin"].round(0)
+    print(f"\n=== Top {top} (baseline) with deltas vs {scenario} ===")
+    print(schema.labels(t[KEYS[:4] + ["rasm", "casm", "margin", "d_rasm", "d_casm", "d_margin"]])
+          .to_string(index=False))
 
 if __name__ == "__main__":
     import argparse
+    from utils import parse_carriers, parse_months
+
+    # one shock flag per configured bucket: --fuel --labor --maint --station, then `buckets:`
+    names = shocks(load_config())
     a = argparse.ArgumentParser()
-    a.add_argument("--fuel", type=float, help="+10 or -10 means +/-10%")
-    a.add_argument("--month", required=True)
+    a.add_argument("--month", required=True, help="YYYY-MM, YYYY-MM..YYYY-MM or comma list")
+    for k in names:
+        a.add_argument(f"--{k.replace('_', '-')}", dest=k, type=float, nargs="*", default=[],
+                       help="+10 or -10 means +/-10%%" if k == names[0] else None)
+    a.add_argument("--lf", type=float, nargs="*", default=[], help="load factor +/- pts")
+    a.add_argument("--all-buckets", type=float, help="shock every cost bucket by +/- this %%")
+    a.add_argument("--cross", action="store_true", help="cartesian product instead of one-at-a-time")
+    a.add_argument("--carriers", help="comma list of carriers (default: all)")
     args = a.parse_args()
-    if args.fuel is not None:
-        fuel_shock(args.month, args.fuel)
+
+    dims = {k: list(getattr(args, k)) for k in names + ["lf"]}
+    if args.all_buckets is not None:
+        for k in names:
+            dims[k] += [args.all_buckets, -args.all_buckets]
+    if not any(dims.values()):
+        dims.update(fuel=[10, -10], lf=[2, -2])   # methodology.md defaults
+
+    scenarios = build_scenarios(**dims, cross=args.cross)
+    cube = run(parse_months(args.month), scenarios, carriers=parse_carriers(args.carriers))
+    if len(scenarios) > 1:
+        summarize(cube, scenarios["scenario"].iloc[1])
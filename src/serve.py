@@ -0,0 +1,357 @@
+"""
+Route economics query service (local HTTP on asyncio, standard library only)
+- loads fact_route_economics once into an in-memory store: column arrays sorted by carrier,
+  month, with a hash index on (carrier, month, origin, dest, fleet_type), an OD index over
+  fleets, per carrier-month row ranges and a margin order for top-N
+- GET /route      point lookup   ?carrier=WN&month=2023-07&origin=DAL&dest=HOU[&fleet=B737-800]
+  GET /top        top-N margin   ?month=2023-07[&carrier=WN][&n=20][&order=asc]
+  GET /agg        filtered sums  ?by=origin|dest|od|fleet|carrier|month|network[&month=..&carrier=..
+                                  &origin=..&dest=..&fleet=..]; RASM/CASM etc. from the sums
+  GET /whatif     scenario       ?month=2023-07[&carrier=WN][&fuel=10&labor=&maint=&station=&lf=]
+                                  (one % parameter per cost bucket in the table, named as in
+                                  sensitivity.py; sensitivity.evaluate on the stored allocation
+                                  in a worker process; LRU-cached, hits answered inline)
+  GET /health
+- a watcher polls the partition signatures; once a rewrite has settled the new store is built
+  off the event loop and swapped in with one reference assignment, so requests see either
+  the old or the new allocation, never a mix (the what-if cache goes with the old store)
+- src/loadtest.py drives concurrent keep-alive clients and reports p50/p95/p99 latency
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import json
+import math
+import signal
+import threading
+import time
+import numpy as np
+import pandas as pd
+import fact_store
+import sensitivity
+from allocation import bucket_costs
+from rollup import kpis, measures
+from utils import month_key, month_label
+
+DATA_WORK = Path("data_work")
+TABLE = "fact_route_economics"
+INDEX = ["carrier", "month", "origin", "dest", "fleet_type"]
+AGG_BY = {"network": [], "carrier": ["carrier"], "month": ["carrier", "month"], "origin": ["origin"],
+          "dest": ["dest"], "od": ["origin", "dest"], "fleet": ["fleet_type"]}
+
+class BadRequest(ValueError):
+    pass
+
+def _py(v):
+    """JSON-safe scalar (NaN -> null)."""
+    if isinstance(v, np.generic):
+        v = v.item()
+    return None if isinstance(v, float) and math.isnan(v) else v
+
+def _month(m):
+    return month_label(month_key(m)) if m else None
+
+def _records(df):
+    return [{k: _py(v) for k, v in r.items()} for r in df.to_dict("records")]
+
+def _rows(cols):
+    """{name: column} -> JSON-safe records, converting whole columns at once."""
+    vals = []
+    for v in cols.values():
+        v = np.asarray(v).tolist()
+        vals.append([None if isinstance(x, float) and x != x else x for x in v])
+    return [dict(zip(cols, r)) for r in zip(*vals)]
+
+class Store:
+    """Immutable snapshot of fact_route_economics with lookup indexes."""
+
+    def __init__(self, df, signature, whatif_cache=256):
+        df = df.sort_values(["carrier", "month", "origin", "dest", "fleet_type"], kind="stable").reset_index(drop=True)
+        self.df = df
+        self.signature = signature
+        self.loaded_at = time.time()
+        self.cols = list(df.columns)
+        # plain arrays for the hot path: a row becomes a dict without touching pandas
+        self.arrays = {c: (df[c].astype(str).to_numpy(object) if c in ("carrier", "origin", "dest", "fleet_type")
+                           else df[c].map(month_label).to_numpy(object) if c == "month"
+                           else df[c].to_numpy())
+                       for c in self.cols}
+        keys = zip(*(self.arrays[c] for c in INDEX))
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.od = {}
+        for (c, m, o, d, _), i in self.index.items():
+            self.od.setdefault((c, m, o, d), []).append(i)
+        # contiguous rows per carrier-month, and their positions in descending margin order
+        self.periods = {}
+        if len(df):
+            cm = list(zip(self.arrays["carrier"], self.arrays["month"]))
+            starts = [0] + [i for i in range(1, len(cm)) if cm[i] != cm[i - 1]] + [len(cm)]
+            margin = df["margin"].to_numpy(float)
+            for a, b in zip(starts[:-1], starts[1:]):
+                order = a + np.argsort(-np.nan_to_num(margin[a:b], nan=-np.inf), kind="stable")
+                self.periods[cm[a]] = (a, b, order)
+        # aggregates: measure matrix (every bucket cost in the table) plus, per grouping, a
+        # sorted group code for every row
+        self.measures = measures(df)
+        self.X = df[self.measures].to_numpy(float)
+        # what-if parameters: one shock per bucket cost, then load factor
+        self.shocks = [sensitivity.shock(c) for c in bucket_costs(df)] + ["lf"]
+        self.groups = {}
+        for by, keys in AGG_BY.items():
+            if keys:
+                codes, labels = pd.factorize(pd.MultiIndex.from_arrays([self.arrays[k] for k in keys]), sort=True)
+                self.groups[by] = (codes, list(labels))
+            else:
+                self.groups[by] = (np.zeros(len(df), dtype=np.intp), [()])
+        self._cache = OrderedDict()
+        self._cache_max = whatif_cache
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, **kw):
+        sig = fact_store.partition_signatures(TABLE)
+        return cls(fact_store.read(TABLE), sig, **kw)
+
+    def row(self, i):
+        return {c: _py(self.arrays[c][i]) for c in self.cols}
+
+    # --- queries ---
+    def route(self, carrier, month, origin, dest, fleet=None):
+        if fleet:
+            i = self.index.get((carrier, month, origin, dest, fleet))
+            return [] if i is None else [self.row(i)]
+        return [self.row(i) for i in self.od.get((carrier, month, origin, dest), ())]
+
+    def _periods(self, month=None, carrier=None):
+        return [(k, v) for k, v in self.periods.items()
+                if (month is None or k[1] == month) and (carrier is None or k[0] == carrier)]
+
+    def top(self, month, carrier=None, n=20, ascending=False):
+        ranked = []
+        for _, (a, b, order) in self._periods(month, carrier):
+            ranked.extend((order[::-1] if ascending else order)[:n])
+        margin = self.arrays["margin"]
+        ranked.sort(key=lambda i: margin[i], reverse=not ascending)
+        return [self.row(i) for i in ranked[:n]]
+
+    def _slice(self, month=None, carrier=None):
+        parts = [slice(a, b) for _, (a, b, _) in self._periods(month, carrier)]
+        if len(parts) == len(self.periods):
+            return self.df
+        return pd.concat([self.df.iloc[s] for s in parts]) if parts else self.df.iloc[0:0]
+
+    def agg(self, by="network", month=None, carrier=None, origin=None, dest=None, fleet=None):
+        if by not in AGG_BY:
+            raise BadRequest(f"by must be one of {list(AGG_BY)}")
+        ranges = [np.arange(a, b) for _, (a, b, _) in self._periods(month, carrier)]
+        rows = np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.intp)
+        for col, v in (("origin", origin), ("dest", dest), ("fleet_type", fleet)):
+            if v:
+                rows = rows[np.isin(self.arrays[col][rows], v.split(","))]
+        codes, labels = self.groups[by]
+        c = codes[rows]
+        n = np.bincount(c, minlength=len(labels))
+        hit = np.flatnonzero(n)
+        sums = np.column_stack([np.bincount(c, weights=self.X[rows, j], minlength=len(labels))[hit]
+                                for j in range(len(self.measures))]).reshape(len(hit), len(self.measures))
+        out = {k: [labels[h][j] for h in hit] for j, k in enumerate(AGG_BY[by])}
+        out.update(zip(self.measures, sums.T))
+        out["routes"] = n[hit]
+        out.update(kpis(out))
+        return _rows(out)
+
+    # --- what-ifs: LRU over (month, carrier, top, shocks) ---
+    def whatif_key(self, month, carrier, top, shocks):
+        return (month, carrier, top) + tuple(float(shocks.get(k) or 0.0) for k in self.shocks)
+
+    def recall(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def remember(self, key, out):
+        with self._lock:
+            self._cache[key] = out
+            while len(self._cache) > self._cache_max:
+                self._cache.popitem(last=False)
+        return out
+
+    def whatif(self, month, carrier=None, top=10, **shocks):
+        key = self.whatif_key(month, carrier, top, shocks)
+        hit = self.recall(key)
+        if hit is None:
+            hit = self.remember(key, whatif_result(self._slice(month, carrier).reset_index(drop=True),
+                                                   dict(zip(self.shocks, key[3:])), top))
+        return hit
+
+def whatif_result(base, shocks, top=10):
+    """Totals and the most affected routes for one scenario ({shock: value}) over a stored
+       allocation (module level so the service can run it in a worker process)."""
+    sc = sensitivity.scenario(**shocks)
+    res = sensitivity.evaluate(base, sc)
+    d = res["d_margin"].to_numpy(float)
+    worst = res.iloc[np.argsort(d, kind="stable")[:top]]
+    return {
+        "scenario": sc["scenario"].iloc[0], "routes": len(res),
+        "revenue": float(res["revenue"].sum()), "d_revenue": float(res["d_revenue"].sum()),
+        "total_cost": float(res["total_cost"].sum()), "d_total_cost": float(res["d_total_cost"].sum()),
+        "margin": float(res["margin"].sum()), "d_margin": float(d.sum()),
+        "most_affected": _records(worst[INDEX + ["margin", "d_margin"]].assign(
+            month=worst["month"].map(month_label))),
+    }
+
+# --- HTTP ---
+class Service:
+    def __init__(self, poll=2.0, whatif_cache=256, workers=1):
+        self.poll = poll
+        self.whatif_cache = whatif_cache
+        self.store = Store.load(whatif_cache=whatif_cache)
+        self.reloads = 0
+        # cold what-ifs are pandas-heavy; a worker process keeps them off the event loop's GIL
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    @staticmethod
+    def _params(q):
+        one = {k: v[-1] for k, v in q.items()}
+        return one, _month(one.get("month")), one.get("carrier", "").upper() or None
+
+    async def whatif(self, q):
+        s = self.store
+        one, month, carrier = self._params(q)
+        top = int(one.get("top", 10))
+        key = s.whatif_key(month, carrier, top, one)
+        hit = s.recall(key)
+        if hit is None:
+            base = s._slice(month, carrier).reset_index(drop=True)
+            hit = s.remember(key, await asyncio.get_running_loop().run_in_executor(
+                self.pool, whatif_result, base, dict(zip(s.shocks, key[3:])), top))
+        return hit
+
+    def handle(self, path, q):
+        s = self.store       # one snapshot per request
+        one, month, carrier = self._params(q)
+        try:
+            if path == "/route":
+                return s.route(carrier, month, one["origin"].upper(), one["dest"].upper(), one.get("fleet"))
+            if path == "/top":
+                return s.top(month, carrier, int(one.get("n", 20)), one.get("order") == "asc")
+            if path == "/agg":
+                return s.agg(one.get("by", "network"), month, carrier, one.get("origin"), one.get("dest"),
+                             one.get("fleet"))
+            if path == "/whatif":
+                return s.whatif(month, carrier, int(one.get("top", 10)), **{k: one.get(k) for k in s.shocks})
+            if path == "/health":
+                return {"rows": len(s.df), "partitions": len(s.signature), "loaded_at": s.loaded_at,
+                        "reloads": self.reloads, "whatif_cached": len(s._cache)}
+        except KeyError as e:
+            raise BadRequest(f"missing parameter {e}")
+        return None
+
+    async def _respond(self, writer, status, body):
+        data = json.dumps(body, separators=(",", ":")).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def _fail(self, writer, where, e):
+        """500 with a JSON body for anything the handlers did not anticipate."""
+        print(f"[serve] 500 on {where}: {type(e).__name__}: {e}")
+        try:
+            await self._respond(writer, "500 Internal Server Error", {"error": f"{type(e).__name__}: {e}"})
+        except ConnectionError:
+            pass
+
+    async def _answer(self, head):
+        """-> (status, JSON body) for one request head."""
+        line = head.split(b"\r\n", 1)[0].decode("latin-1").split()
+        if len(line) < 2 or line[0] != "GET":
+            return "405 Method Not Allowed", {"error": "GET only"}
+        try:
+            url = urlsplit(line[1])
+            q = parse_qs(url.query)
+            if url.path == "/whatif":
+                body = await self.whatif(q)
+            else:
+                body = self.handle(url.path, q)           # index/array work: inline
+        except (BadRequest, ValueError) as e:
+            return "400 Bad Request", {"error": str(e)}
+        if body is None:
+            return "404 Not Found", {"error": f"no endpoint {url.path}"}
+        return "200 OK", body
+
+    async def client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    # e.g. LimitOverrunError: header past the stream limit; the rest of the
+                    # stream cannot be framed, so answer and close
+                    await self._fail(writer, "request header", e)
+                    break
+                try:
+                    await self._respond(writer, *await self._answer(head))
+                except ConnectionError:
+                    break
+                except Exception as e:
+                    await self._fail(writer, head.split(b"\r\n", 1)[0].decode("latin-1"), e)
+                if b"connection: close" in head.lower():
+                    break
+        finally:
+            writer.close()
+
+    async def watch(self):
+        """Reload once the table's partition signatures changed and held still for one poll."""
+        loop = asyncio.get_running_loop()
+        seen = self.store.signature
+        while True:
+            await asyncio.sleep(self.poll)
+            sig = fact_store.partition_signatures(TABLE)
+            if sig == self.store.signature:
+                seen = sig
+                continue
+            if sig != seen:          # still being written
+                seen = sig
+                continue
+            new = await loop.run_in_executor(None, lambda: Store.load(whatif_cache=self.whatif_cache))
+            self.store = new         # atomic swap
+            self.reloads += 1
+            seen = new.signature
+            print(f"[serve] reloaded {TABLE}: {len(new.df)} rows")
+
+async def main(host="127.0.0.1", port=8765, poll=2.0, whatif_cache=256, workers=1):
+    svc = Service(poll, whatif_cache, workers)
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(svc.pool, int) for _ in range(workers)])   # fork workers now
+    server = await asyncio.start_server(svc.client, host, port)
+    print(f"[serve] {len(svc.store.df)} rows from {DATA_WORK/TABLE}; listening on http://{host}:{port}")
+    main_task = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), svc.watch())
+    except asyncio.CancelledError:
+        pass
+    finally:
+        svc.pool.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--poll", type=float, default=2.0, help="seconds between reload checks")
+    p.add_argument("--whatif-cache", type=int, default=256, help="LRU size for what-if results")
+    p.add_argument("--workers", type=int, default=1, help="processes for uncached what-ifs")
+    args = p.parse_args()
+    try:
+        asyncio.run(main(args.host, args.port, args.poll, args.whatif_cache, args.workers))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,152 @@
+"""
+Synthetic BTS raw files at configurable scale (seeded, reproducible)
+- T-100 segment (one file per year), Form 41 P-12(a) and P-5.2, DB1B MARKET, and the
+  airport Master Coordinate table; T-100/DB1B distances are great circles between the airports
+- column names follow the real downloads closely enough for every ingest stage
+- scales run from a 10-route toy up to multi-carrier years with millions of DB1B rows
+- DB1B markets include connecting O&Ds that never appear as a T-100 segment
+"""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from distances import haversine_miles
+
+SCALES = {
+    #         airports, routes/carrier, carriers, years, db1b rows
+    "tiny":   dict(airports=8,   routes=10,   carriers=1,  years=1, db1b_rows=5_000),
+    "small":  dict(airports=30,  routes=200,  carriers=3,  years=1, db1b_rows=200_000),
+    "medium": dict(airports=80,  routes=1500, carriers=5,  years=1, db1b_rows=2_000_000),
+    "large":  dict(airports=150, routes=4000, carriers=10, years=2, db1b_rows=10_000_000),
+}
+CARRIERS = ["WN", "AA", "DL", "UA", "B6", "AS", "NK", "F9", "G4", "HA", "SY", "MX"]
+FLEETS = {"B737-700": (143, 800), "B737-800": (175, 880), "B737-8": (175, 890), "612": (143, 800)}
+START_YEAR = 2023
+CHUNK_ROWS = 1_000_000
+
+def _airports(n):
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    rng = np.random.default_rng(12345)
+    codes = set()
+    while len(codes) < n:
+        codes.add("".join(rng.choice(letters, 3)))
+    return np.array(sorted(codes))
+
+def manifest(years=1, start_year=START_YEAR):
+    """Raw file names a generated data_raw/ holds."""
+    ys = [start_year + i for i in range(years)]
+    tag = f"{ys[0]}" if len(ys) == 1 else f"{ys[0]}_{ys[-1]}"
+    return {
+        "t100": [f"{y}_T_T100D_SEGMENT_ALL_CARRIER.csv" for y in ys],
+        "p12a": f"FORM41_P12A_{tag}.csv",
+        "p52":  f"FORM41_P52_{tag}.csv",
+        "db1b": f"DB1B_MARKET_{tag}.csv",
+        "coords": "T_MASTER_CORD.csv",
+    }
+
+def generate(root=".", airports=8, routes=10, carriers=1, years=1, db1b_rows=5_000,
+             seed=0, start_year=START_YEAR):
+    raw = Path(root) / "data_raw"; raw.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    aps = _airports(airports)
+    ll = rng.uniform((25.0, -124.0), (48.0, -68.0), (airports, 2))  # lat/lon, lower 48
+    cars = CARRIERS[:carriers] if carriers <= len(CARRIERS) else \
+        CARRIERS + [f"Z{i}" for i in range(carriers - len(CARRIERS))]
+    fleet_names = np.array(list(FLEETS))
+    seats_by_fleet = np.array([FLEETS[f][0] for f in fleet_names])
+    files = manifest(years, start_year)
+
+    # --- route network per carrier ---
+    net = []
+    n_pairs = airports * (airports - 1)
+    for c in cars:
+        k = min(routes, n_pairs)
+        pick = rng.choice(n_pairs, k, replace=False)
+        o, d = pick // (airports - 1), pick % (airports - 1)
+        d = d + (d >= o)
+        net.append(pd.DataFrame({"CARRIER": c, "o": o, "d": d,
+                                 "fleet": rng.integers(0, len(fleet_names), k),
+                                 "deps": rng.integers(20, 400, k)}))
+    net = pd.concat(net, ignore_index=True)
+    dist = haversine_miles(*ll[net["o"]].T, *ll[net["d"]].T).round()
+    pd.DataFrame({"AIRPORT": aps, "LATITUDE": ll[:, 0].round(6), "LONGITUDE": ll[:, 1].round(6),
+                  "AIRPORT_IS_LATEST": 1}).to_csv(raw / files["coords"], index=False)
+
+    # --- T-100: one file per year, 12 months x routes x 1-2 reporting rows ---
+    for yi, fname in enumerate(files["t100"]):
+        y = start_year + yi
+        rep = np.repeat(np.arange(len(net)), 12)
+        t = net.iloc[rep].reset_index(drop=True)
+        t["MONTH"] = np.tile(np.arange(1, 13), len(net))
+        split = rng.random(len(t)) < 0.3                          # some keys split across rows
+        t = pd.concat([t, t[split]], ignore_index=True)
+        dd = np.concatenate([dist[rep], dist[rep][split]])
+        dep = np.maximum(0, (t["deps"] * rng.uniform(0.8, 1.2, len(t)))).astype(int)
+        seats = dep * seats_by_fleet[t["fleet"]]
+        df = pd.DataFrame({
+            "YEAR": y, "MONTH": t["MONTH"], "CARRIER": t["CARRIER"],
+            "ORIGIN": aps[t["o"]], "DEST": aps[t["d"]], "AIRCRAFT_TYPE": fleet_names[t["fleet"]],
+            "DEPARTURES_PERFORMED": dep,
+            "RAMP_TO_RAMP": (dep * (dd / 8.0 + 30)).round(),
+            "SEATS": seats,
+            "PASSENGERS": (seats * rng.uniform(0.6, 0.95, len(t))).astype(int),
+            "DISTANCE": np.where(rng.random(len(t)) < 0.01, np.nan, dd),
+            "DATA_SOURCE": "DU",
+        })
+        df.to_csv(raw / fname, index=False)
+
+    # --- Form 41 P-12(a) monthly, P-5.2 quarterly (thousands of dollars) ---
+    ys = [start_year + i for i in range(years)]
+    ym = [(y, m) for y in ys for m in range(1, 13)]
+    p12 = pd.DataFrame([(y, m, c) for c in cars for y, m in ym for _ in range(2)],
+                       columns=["YEAR", "MONTH", "CARRIER"])
+    p12["SDOMT_GALLONS"] = rng.uniform(1e6, 8e7, len(p12)).round()
+    p12["SDOMT_COST"] = (p12["SDOMT_GALLONS"] * rng.uniform(2.2, 3.4, len(p12))).round()
+    p12["TS_GALLONS"] = p12["SDOMT_GALLONS"] * 1.05
+    p12.to_csv(raw / files["p12a"], index=False)
+
+    p52 = pd.DataFrame([(y, q, c) for c in cars for y in ys for q in range(1, 5)],
+                       columns=["YEAR", "QUARTER", "CARRIER"])
+    for col, hi in [("PILOT_FLY_OPS", 4e5), ("OTH_FLT_FLY_OPS", 1e5), ("BENEFITS_FLY_OPS", 2e5),
+                    ("TOT_DIR_MAINT", 3e5), ("TOT_AIR_OP_EXPENSES", 3e6), ("TOT_FLY_OPS", 9e5)]:
+        p52[col] = rng.uniform(hi / 10, hi, len(p52)).round()
+    p52.to_csv(raw / files["p52"], index=False)
+
+    # --- DB1B MARKET: sampled itineraries, 80% on flown segments, rest connecting O&Ds ---
+    out = raw / files["db1b"]
+    written = 0
+    while written < db1b_rows:
+        n = min(CHUNK_ROWS, db1b_rows - written)
+        r = rng.integers(0, len(net), n)
+        o, d = net["o"].to_numpy()[r], net["d"].to_numpy()[r]
+        conn = rng.random(n) < 0.2
+        d = np.where(conn, rng.integers(0, airports, n), d)
+        d = np.where(d == o, (o + 1) % airports, d)
+        miles = haversine_miles(*ll[o].T, *ll[d].T)
+        df = pd.DataFrame({
+            "ItinID": np.arange(written, written + n),
+            "Year": rng.choice(ys, n), "Quarter": rng.integers(1, 5, n),
+            "RPCarrier": net["CARRIER"].to_numpy()[r],
+            "Origin": aps[o], "Dest": aps[d],
+            "Passengers": rng.integers(1, 4, n).astype(float),
+            "MktFare": (40 + miles * rng.uniform(0.08, 0.2, n)).round(2),
+            "MktDistance": miles.round(),
+        })
+        df.to_csv(out, mode="a" if written else "w", header=not written, index=False)
+        written += n
+    return files
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--scale", choices=SCALES, default="tiny")
+    p.add_argument("--root", default=".", help="writes <root>/data_raw/")
+    p.add_argument("--seed", type=int, default=0)
+    for k in SCALES["tiny"]:
+        p.add_argument(f"--{k.replace('_', '-')}", type=int, help=f"override {k}")
+    args = p.parse_args()
+
+    params = dict(SCALES[args.scale])
+    params.update({k: getattr(args, k) for k in params if getattr(args, k) is not None})
+    files = generate(args.root, seed=args.seed, **params)
+    print(f"Wrote {args.scale} synthetic data to {Path(args.root)/'data_raw'}: {files}")
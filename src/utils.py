@@ -1,9 +1,68 @@
 from dataclasses import dataclass
+from pathlib import Path
+import yaml
+
+CONFIG = Path("allocation_config.yaml")
+
+def load_config():
+    """allocation_config.yaml, parsed (every stage reads its own slice of it)."""
+    with open(CONFIG, "r") as f:
+        return yaml.safe_load(f)
 
 @dataclass
 class MonthKey:
     year: int
     month: int
 
+    @property
+    def key(self) -> int:
+        """Integer YYYYMM key used in the fact tables."""
+        return self.year * 100 + self.month
+
+    @classmethod
+    def parse(cls, m) -> "MonthKey":
+        """'YYYY-MM' label or YYYYMM int -> MonthKey."""
+        if isinstance(m, str):
+            y, mm = m.split("-")[:2]
+            return cls(int(y), int(mm))
+        return cls(int(m) // 100, int(m) % 100)
+
+    def __str__(self) -> str:
+        return month_str(self.year, self.month)
+
 def month_str(year:int, month:int) -> str:
     return f"{year:04d}-{month:02d}"
+
+def month_key(m) -> int:
+    """'2023-07' (or 202307) -> 202307."""
+    return MonthKey.parse(m).key
+
+def month_label(m) -> str:
+    """202307 (or '2023-07') -> '2023-07'."""
+    return str(MonthKey.parse(m))
+
+def month_range(start:str, end:str) -> list:
+    """Inclusive list of YYYY-MM strings from start to end."""
+    y0, m0 = map(int, start.split("-")); y1, m1 = map(int, end.split("-"))
+    out = []
+    while (y0, m0) <= (y1, m1):
+        out.append(month_str(y0, m0))
+        y0, m0 = (y0 + 1, 1) if m0 == 12 else (y0, m0 + 1)
+    return out
+
+def parse_months(spec:str) -> list:
+    """'2023-01..2023-12' -> range; '2023-01,2023-04' -> list."""
+    if ".." in spec:
+        start, end = spec.split("..", 1)
+        return month_range(start.strip(), end.strip())
+    return [m.strip() for m in spec.split(",") if m.strip()]
+
+def parse_carriers(spec) -> list:
+    """'WN,AA' / ['WN','AA'] -> ['AA','WN']; 'all' / None -> None (every carrier in the raw data)."""
+    if spec is None:
+        return None
+    items = spec.split(",") if isinstance(spec, str) else [c for s in spec for c in str(s).split(",")]
+    items = [c.strip().upper() for c in items if c.strip()]
+    if not items or "ALL" in items:
+        return None
+    return sorted(set(items))
@@ -0,0 +1,263 @@
+"""
+Warehouse loader: fact tables -> Postgres for BI (SQLite as a local stand-in)
+- streams each table one carrier-month partition at a time from the fact store; a partition
+  is loaded as delete-and-replace of its (carrier, month) rows inside one transaction, so
+  re-runs are idempotent and readers never see a half-loaded month
+- Postgres gets the rows through COPY ... FROM STDIN (CSV); other dialects use executemany
+- only partitions whose signature changed since the last load into the same database are
+  sent (data_work/.warehouse_state.json); --full reloads everything, --recreate also drops
+  and re-creates the tables (needed when a table gains columns)
+- (carrier, month)s the warehouse holds but the fact store no longer has (a carrier-month
+  removed upstream) are deleted, within the --month/--carriers scope of the run
+- one pooled SQLAlchemy engine; tables load in parallel, one pooled connection each
+  (SQLite allows a single writer, so there they load one after another)
+- the URL comes from --url, FP_WAREHOUSE_URL or `warehouse: url` in allocation_config.yaml
+  (keep passwords in the environment); months load as 'YYYY-MM' text like the CSV exports
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import io
+import json
+import os
+import time
+import pandas as pd
+import fact_store
+import instrument
+import schema
+from utils import load_config, month_label
+
+DATA_WORK = Path("data_work")
+STATE = DATA_WORK / ".warehouse_state.json"
+ENV = "FP_WAREHOUSE_URL"
+
+DEFAULTS = {
+    "url": None,
+    "tables": ["fact_route_economics", "fact_rollup", "fact_reconciliation",
+               "fact_segment_fares", "fact_segments", "fact_financials"],
+    "workers": 4,
+}
+PARAM = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+
+def settings(cfg):
+    return {**DEFAULTS, **(cfg.get("warehouse") or {})}
+
+@dataclass
+class Target:
+    connect: object          # () -> pooled DBAPI connection; close() hands it back
+    dialect: str             # "postgresql", "sqlite", ...
+    param: str               # DBAPI placeholder
+    key: str                 # URL without the password (load state key)
+    workers: int = 1
+
+def target(url, workers=4):
+    """Pooled engine for url. SQLite gets a single connection (one writer at a time)."""
+    from sqlalchemy import create_engine, make_url
+
+    if make_url(url).get_backend_name() == "sqlite":
+        engine, workers = create_engine(url), 1
+    else:
+        engine = create_engine(url, pool_size=workers, max_overflow=0, pool_pre_ping=True)
+    return Target(engine.raw_connection, engine.dialect.name, PARAM[engine.dialect.paramstyle],
+                  engine.url.render_as_string(hide_password=True), workers)
+
+# --- DDL ---
+def _q(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _sql_type(s):
+    if pd.api.types.is_bool_dtype(s):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(s):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(s):
+        return "DOUBLE PRECISION"
+    return "TEXT"          # carrier/airport/fleet categoricals, month labels, flags
+
+def _columns(cur, table):
+    """Column names of an existing table, or None."""
+    try:
+        cur.execute(f"SELECT * FROM {_q(table)} WHERE 1 = 0")
+    except Exception:
+        return None
+    return [d[0] for d in cur.description]
+
+def _ensure(con, table, df, recreate=False):
+    cur = con.cursor()
+    if recreate:
+        cur.execute(f"DROP TABLE IF EXISTS {_q(table)}")
+        have = None
+    else:
+        have = _columns(cur, table)
+        con.rollback()     # a failed probe aborts the transaction on Postgres
+        cur = con.cursor()
+    if have is None:
+        cols = ", ".join(f"{_q(c)} {_sql_type(df[c])}" for c in df.columns)
+        cur.execute(f"CREATE TABLE {_q(table)} ({cols})")
+        cur.execute(f"CREATE INDEX {_q(table + '_period')} ON {_q(table)} (carrier, month)")
+    elif have != list(df.columns):
+        raise ValueError(f"{table} in the warehouse has columns {have}, the fact store has "
+                         f"{list(df.columns)}; reload it with --recreate")
+    con.commit()
+
+# --- bulk writers: (cursor, table, frame, placeholder) ---
+def _copy(cur, table, df, param):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cols = ", ".join(_q(c) for c in df.columns)
+    cur.copy_expert(f"COPY {_q(table)} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def _insert(cur, table, df, param):
+    cols = ", ".join(_q(c) for c in df.columns)
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    cur.executemany(f"INSERT INTO {_q(table)} ({cols}) VALUES ({', '.join([param] * df.shape[1])})",
+                    list(rows))
+
+BULK = {"postgresql": _copy}
+
+def _keys(con, table):
+    """(carrier, month) pairs a warehouse table holds (none if it does not exist)."""
+    cur = con.cursor()
+    try:
+        cur.execute(f"SELECT DISTINCT carrier, month FROM {_q(table)}")
+        return {(str(c), str(m)) for c, m in cur.fetchall()}
+    except Exception:
+        return set()
+    finally:
+        con.rollback()     # a failed probe aborts the transaction on Postgres
+
+def _delete(con, db, table, c, m, df=None):
+    """Replace one (carrier, month) with df (None: just delete it) in one transaction."""
+    try:
+        cur = con.cursor()
+        cur.execute(f"DELETE FROM {_q(table)} WHERE carrier = {db.param} AND month = {db.param}", (c, m))
+        if df is not None:
+            BULK.get(db.dialect, _insert)(cur, table, df, db.param)
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+
+def load_table(db, table, parts, recreate=False, stored=None, scope=None):
+    """Delete-and-replace each (carrier, month) in parts, one transaction per partition; then
+       delete the (carrier, month)s the warehouse holds that are not in stored (the store's
+       partitions; None: skip), limited to those scope((carrier, month)) accepts.
+       -> (rows loaded, [(carrier, month) removed])"""
+    rows = 0
+    con = db.connect()
+    try:
+        for i, (c, m) in enumerate(parts):
+            df = schema.labels(fact_store.read(table, months=[m], carriers=[c]))
+            if i == 0:
+                _ensure(con, table, df, recreate)
+            _delete(con, db, table, c, m, df)
+            rows += len(df)
+        gone = [] if stored is None else sorted(k for k in _keys(con, table) - set(stored)
+                                                if scope is None or scope(k))
+        for c, m in gone:
+            _delete(con, db, table, c, m)
+    finally:
+        con.close()
+    return rows, gone
+
+# --- incremental state (per database) ---
+def _load_state():
+    return json.loads(STATE.read_text()) if STATE.exists() else {}
+
+def _save_state(state):
+    DATA_WORK.mkdir(exist_ok=True)
+    tmp = STATE.with_suffix(f".json.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(tmp, STATE)
+
+def scope(months=None, carriers=None):
+    """(carrier, month label) -> whether a run limited to months/carriers covers it."""
+    want_m = None if months is None else {month_label(m) for m in months}
+    want_c = None if carriers is None else set(carriers)
+    return lambda k: (want_c is None or k[0] in want_c) and (want_m is None or k[1] in want_m)
+
+def plan(db, tables, months=None, carriers=None, full=False):
+    """{table: ({(carrier, month): signature} to send, every stored (carrier, month))}."""
+    done = _load_state().get(db.key, {})
+    within = scope(months, carriers)
+    out = {}
+    for t in tables:
+        sigs = fact_store.partition_signatures(t)
+        if not sigs:
+            print(f"[warehouse] skip {t}: no partitions in {DATA_WORK / t}")
+            continue
+        out[t] = ({(c, m): sig for (c, m), sig in sorted(sigs.items())
+                   if within((c, m)) and (full or done.get(t, {}).get(f"{c}/{m}") != sig)}, set(sigs))
+    return out
+
+def sync(db, tables, months=None, carriers=None, full=False, recreate=False):
+    """Load changed partitions of tables into db (all of them with full; recreate drops first
+       and ignores the month/carrier filters) and delete the carrier-months the store no
+       longer has. -> {table: rows} of the tables that changed"""
+    if recreate:
+        months = carriers = None
+    todo = plan(db, tables, months, carriers, full or recreate)
+    if not todo:
+        print(f"[warehouse] {db.key} up to date")
+        return {}
+
+    t0 = time.perf_counter()
+    loaded, removed = {}, {}
+    with ThreadPoolExecutor(max_workers=min(db.workers, len(todo))) as ex:
+        # every table is visited, changed or not: orphans need no changed partition to show up
+        futs = {t: ex.submit(load_table, db, t, list(send), recreate, None if recreate else stored,
+                             scope(months, carriers))
+                for t, (send, stored) in todo.items()}
+        for t, f in futs.items():
+            send = todo[t][0]
+            with instrument.span("warehouse.load", table=t) as sp:
+                loaded[t], removed[t] = f.result()
+                sp.add(rows_out=loaded[t])
+            if not send and not removed[t]:
+                continue
+            # record as each table lands, so a failure elsewhere does not resend it
+            state = _load_state()
+            mine = state.setdefault(db.key, {}).setdefault(t, {})
+            if recreate:
+                mine.clear()
+            mine.update({f"{c}/{m}": sig for (c, m), sig in send.items()})
+            for c, m in removed[t]:
+                mine.pop(f"{c}/{m}", None)
+            _save_state(state)
+            print(f"[warehouse] {t}: {loaded[t]} rows from {len(send)} partitions"
+                  + (f"; removed {['/'.join(k) for k in removed[t]]} (gone from the fact store)"
+                     if removed[t] else ""))
+    loaded = {t: n for t, n in loaded.items() if todo[t][0] or removed[t]}
+    if not loaded:
+        print(f"[warehouse] {db.key} up to date")
+        return {}
+    print(f"[warehouse] loaded {sum(loaded.values())} rows into {db.key} "
+          f"in {time.perf_counter() - t0:.1f}s")
+    return loaded
+
+@instrument.traced("warehouse")
+def load(url=None, tables=None, months=None, carriers=None, full=False, recreate=False, workers=None):
+    cfg = settings(load_config())
+    url = url or os.environ.get(ENV) or cfg["url"]
+    if not url:
+        raise ValueError(f"No warehouse URL: pass --url, set {ENV} or `warehouse: url` in allocation_config.yaml")
+    db = target(url, workers or cfg["workers"])
+    return sync(db, tables or cfg["tables"], months, carriers, full, recreate)
+
+if __name__ == "__main__":
+    import argparse
+    from utils import parse_carriers, parse_months
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--url", help=f"SQLAlchemy URL (default: ${ENV}, then `warehouse: url`), "
+                                 "e.g. postgresql+psycopg2://bi@db/flightprof or sqlite:///data_work/warehouse.db")
+    p.add_argument("--tables", nargs="+", choices=fact_store.TABLES, help="default: `warehouse: tables`")
+    p.add_argument("--month", help="YYYY-MM, YYYY-MM..YYYY-MM or comma list (default: all)")
+    p.add_argument("--carriers", help="comma list of carriers (default: all)")
+    p.add_argument("--full", action="store_true", help="resend unchanged partitions too")
+    p.add_argument("--recreate", action="store_true", help="drop and re-create the tables, then load everything")
+    p.add_argument("--workers", type=int, help="tables loaded in parallel (default: `warehouse: workers`)")
+    args = p.parse_args()
+    load(args.url, args.tables, parse_months(args.month) if args.month else None,
+         parse_carriers(args.carriers), args.full, args.recreate, args.workers)
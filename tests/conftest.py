@@ -0,0 +1,71 @@
+"""
+Shared fixtures: a synthetic multi-carrier network run end to end in a scratch directory
+- the scripts read data_raw/, data_work/ and allocation_config.yaml relative to the working
+  directory, so each network gets its own directory (src/ linked in, config copied) and
+  stages run there as `python src/<script>.py`, exactly as from a checkout
+- in-process reads (fact_store, allocation, ...) happen with the working directory switched
+  to the network they look at
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+SRC = REPO / "src"
+sys.path.insert(0, str(SRC))
+
+# 3 carriers, every month of a year; small enough for a few seconds per pipeline run
+NETWORK = dict(airports=16, routes=30, carriers=3, db1b_rows=30_000)
+
+def make_network(root, seed=0, **overrides):
+    """data_raw/ of a synthetic network under root, plus src/ and the config; -> raw file names."""
+    import synth_data
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "src").symlink_to(SRC)
+    shutil.copy(REPO / "allocation_config.yaml", root)
+    return synth_data.generate(root, seed=seed, **{**NETWORK, **overrides})
+
+def script(root, name, *args):
+    """Run src/<name>.py in root; -> stdout (fails the test on a non-zero exit)."""
+    r = subprocess.run([sys.executable, f"src/{name}.py", *map(str, args)], cwd=root,
+                       capture_output=True, text=True)
+    assert r.returncode == 0, f"{name} {' '.join(map(str, args))} failed:\n{r.stdout}\n{r.stderr}"
+    return r.stdout
+
+@contextmanager
+def inside(root):
+    prev = os.getcwd()
+    os.chdir(root)
+    try:
+        yield Path(root)
+    finally:
+        os.chdir(prev)
+
+def labelled(root, table):
+    """A fact table of the network at root with string keys, in a stable row order."""
+    import fact_store
+    with inside(root):
+        df = fact_store.schema.labels(fact_store.read(table))
+    keys = [c for c in ("carrier", "month", "grain", "origin", "dest", "fleet_type", "stage_bin",
+                        "origin_region", "bucket", "day", "dep_time", "flight_no") if c in df.columns]
+    df[keys] = df[keys].astype(object).where(df[keys].notna(), "").astype(str)
+    return df.sort_values(keys).reset_index(drop=True)
+
+@pytest.fixture(scope="session")
+def network(tmp_path_factory):
+    """The synthetic network after a full pipeline run over all carriers (with flights)."""
+    root = tmp_path_factory.mktemp("network")
+    make_network(root)
+    script(root, "pipeline", "--carriers", "all", "--flights")
+    return root
+
+@pytest.fixture
+def at_network(network, monkeypatch):
+    monkeypatch.chdir(network)
+    return network
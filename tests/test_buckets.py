@@ -0,0 +1,104 @@
+"""
+Configurable cost buckets
+- the default config reproduces the original four-bucket allocation (fuel on block hours x
+  burn rate, labor/maintenance/station as weighted blends of month shares) exactly
+- an extra bucket carved out of a Form 41 line leaves each carrier-month's total cost in place
+  and reaches every consumer of the bucket costs: rollup cube, sensitivity shocks and the
+  query service
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.fixture
+def inputs(at_network):
+    from allocation import load_config, load_inputs, with_financials
+    seg, fin, fares = load_inputs(None, None)
+    return with_financials(seg, fin), fin, fares, load_config()
+
+def _share(df, col):
+    tot = df.groupby(["carrier", "month"], observed=True)[col].transform("sum")
+    return np.where(tot > 0, df[col] / tot, 0.0)
+
+def _four_buckets(out, fin, cfg):
+    """The original hard-coded allocation, from the allocated frame's own drivers."""
+    from allocation import burn_rates
+    f = out[["carrier", "month"]].merge(fin, on=["carrier", "month"], how="left")
+    out = out.assign(fuel_driver=out["block_hours"] * burn_rates(out["fleet_type"], cfg))
+    bh, dep, pax = _share(out, "block_hours"), _share(out, "departures"), _share(out, "pax")
+    lw, mw, sw = (cfg[b]["weights"] for b in ("labor", "maintenance", "station_other"))
+    return {
+        "fuel_cost": _share(out, "fuel_driver") * f["fuel_expense"].to_numpy(float),
+        "labor_cost": (lw.get("block_hours", 0.0) * bh + lw.get("departures", 0.0) * dep)
+                      * f["labor_expense"].to_numpy(float),
+        "maint_cost": (mw.get("block_hours", 0.0) * bh + mw.get("departures", 0.0) * dep)
+                      * f["maint_expense"].to_numpy(float),
+        "station_cost": (sw.get("departures", 0.0) * dep + sw.get("pax", 0.0) * pax)
+                        * f["station_other"].to_numpy(float),
+    }
+
+@pytest.fixture
+def landing(inputs):
+    """Config with 30% of station_other moved to a landing bucket spread by departures."""
+    cfg = copy.deepcopy(inputs[3])
+    cfg["station_other"]["expense"] = {"station_other": 0.7}
+    cfg["buckets"] = {"landing": {"expense": {"station_other": 0.3}, "weights": {"departures": 1.0}}}
+    return cfg
+
+def test_default_config_is_the_four_bucket_allocation(inputs):
+    from allocation import OUT_COLS, allocate_frame
+    seg, fin, fares, cfg = inputs
+    out = allocate_frame(seg, fin, fares, cfg)
+    assert list(out.columns) == OUT_COLS
+    for c, ref in _four_buckets(out, fin, cfg).items():
+        np.testing.assert_array_equal(out[c].to_numpy(float), ref, err_msg=c)
+
+def test_extra_bucket_keeps_total_cost(inputs, landing):
+    from allocation import allocate_frame, bucket_costs
+    seg, fin, fares, cfg = inputs
+    base = allocate_frame(seg, fin, fares, cfg)
+    out = allocate_frame(seg, fin, fares, landing)
+    assert bucket_costs(out) == ["fuel_cost", "labor_cost", "maint_cost", "station_cost", "landing_cost"]
+    # the carve-out re-spreads 30% of station_other by departures: rows move, carrier-months don't
+    per = lambda df: df.groupby(["carrier", "month"], observed=True)["total_cost"].sum()
+    np.testing.assert_allclose(per(out), per(base), rtol=1e-12)
+    np.testing.assert_allclose(out["station_cost"], 0.7 * base["station_cost"], rtol=1e-12)
+    # every bucket sums to its Form 41 share per carrier-month
+    got = out.groupby(["carrier", "month"], observed=True)[["station_cost", "landing_cost"]].sum()
+    want = fin.set_index(["carrier", "month"])["station_other"].reindex(got.index)
+    np.testing.assert_allclose(got["station_cost"], 0.7 * want, rtol=1e-12)
+    np.testing.assert_allclose(got["landing_cost"], 0.3 * want, rtol=1e-12)
+
+def test_extra_bucket_reaches_rollup_sensitivity_and_service(inputs, landing):
+    import rollup
+    import sensitivity
+    import serve
+    from allocation import allocate_frame
+    seg, fin, fares, _ = inputs
+    out = allocate_frame(seg, fin, fares, landing).reset_index(drop=True)
+    out["month"] = out["month"].astype("int32")
+
+    cube = rollup.build(out, landing)
+    net = cube[cube["grain"] == "network"]
+    assert "landing_cost" in cube.columns
+    np.testing.assert_allclose(net[["fuel_cost", "labor_cost", "maint_cost", "station_cost", "landing_cost"]]
+                               .sum(axis=1), net["total_cost"], rtol=1e-12)
+
+    assert sensitivity.shocks(landing) == ["fuel", "labor", "maint", "station", "landing"]
+    names = sensitivity.shocks(landing)
+    sc = sensitivity.build_scenarios(**{**{k: [] for k in names}, "landing": [10]})
+    res = sensitivity.evaluate(out, sc)
+    hit = res[res["scenario"] == "landing+10%"]
+    np.testing.assert_allclose(hit["d_total_cost"].to_numpy(), 0.1 * out["landing_cost"].to_numpy(), rtol=1e-9)
+    with pytest.raises(ValueError):
+        sensitivity.evaluate(out, sensitivity.scenario(ground=5))
+
+    store = serve.Store(out, {})
+    assert "landing_cost" in store.measures and "landing" in store.shocks
+    agg = pd.DataFrame(store.agg("network"))
+    np.testing.assert_allclose(agg["landing_cost"], out["landing_cost"].sum(), rtol=1e-12)
+    month = store.arrays["month"][0]
+    w = store.whatif(month, None, 5, landing=10)
+    assert w["scenario"] == "landing+10%" and w["d_total_cost"] > 0
@@ -0,0 +1,85 @@
+"""
+fact_fares against the original row-level algorithm
+- the original build multiplied every DB1B row by its T-100 monthly pax share and then
+  summed per month+OD; the streamed build sums each market quarter first and multiplies
+  once, so totals agree up to float reassociation
+- tolerance: rtol 1e-12 on pax, revenue-derived yield/avg fare and coverage (a few ulps of
+  a sum over at most a few thousand rows); confidence must match exactly
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.conftest import labelled
+
+RTOL = 1e-12
+
+def _reference(network):
+    """The original per-row expansion, per carrier (one carrier at a time, as it ran)."""
+    db1b = pd.read_csv(network / "data_raw" / "DB1B_MARKET_2023.csv")
+    seg = labelled(network, "fact_segments")
+    seg["year"] = seg["month"].str[:4].astype(int)
+    seg["mnum"] = seg["month"].str[5:7].astype(int)
+    seg["qtr"] = (seg["mnum"] - 1) // 3 + 1
+
+    out = []
+    for carrier, s in seg.groupby("carrier"):
+        odm = s.groupby(["year", "qtr", "origin", "dest", "mnum"], as_index=False).agg(pax_m=("pax", "sum"))
+        odq = odm.groupby(["year", "qtr", "origin", "dest"], as_index=False).agg(pax_q_total=("pax_m", "sum"))
+        w = odm.merge(odq, on=["year", "qtr", "origin", "dest"], how="left")
+        w["share"] = np.where(w["pax_q_total"] > 0, w["pax_m"] / w["pax_q_total"], np.nan)
+
+        df = db1b[db1b["RPCarrier"].str.strip().str.upper() == carrier]
+        rows = pd.DataFrame({
+            "year": np.repeat(df["Year"].to_numpy(), 3),
+            "qtr": np.repeat(df["Quarter"].to_numpy(), 3),
+            "origin": np.repeat(df["Origin"].str[:3].to_numpy(), 3),
+            "dest": np.repeat(df["Dest"].str[:3].to_numpy(), 3),
+            "pax_q": np.repeat(df["Passengers"].to_numpy(float), 3),
+            "rev_q": np.repeat(df["MktFare"].to_numpy(float), 3),
+        })
+        rows["mnum"] = (rows["qtr"] - 1) * 3 + np.tile([1, 2, 3], len(df))
+        rows = rows.merge(w[["year", "qtr", "origin", "dest", "mnum", "share"]],
+                          on=["year", "qtr", "origin", "dest", "mnum"], how="left")
+        sh = rows["share"].fillna(1.0 / 3.0)
+        rows["month"] = rows["year"].map("{:04d}".format) + "-" + rows["mnum"].map("{:02d}".format)
+        rows["pax"] = rows["pax_q"] * sh      # per row, then summed: the original order
+        rows["rev"] = rows["rev_q"] * sh
+        f = rows.groupby(["month", "origin", "dest"], as_index=False).agg(pax=("pax", "sum"), rev=("rev", "sum"))
+
+        kpi = s.groupby(["month", "origin", "dest"], as_index=False).agg(RPMs=("RPMs", "sum"), pax_t100=("pax", "sum"))
+        f = f.merge(kpi, on=["month", "origin", "dest"], how="left")
+        f["yield_est"] = np.where(f["RPMs"] > 0, f["rev"] / f["RPMs"], 0.125)
+        f["avg_fare"] = np.where(f["pax"] > 0, f["rev"] / f["pax"], np.nan)
+        pax_t100 = f["pax_t100"].fillna(0.0)
+        f["coverage"] = np.where(pax_t100 > 0, f["pax"] / pax_t100, 0.0)
+        f["confidence"] = pd.cut(f["coverage"].clip(0, 1.01), bins=[-0.01, 0.25, 0.6, 1.01],
+                                 labels=["low", "medium", "high"])
+        f.insert(0, "carrier", carrier)
+        out.append(f)
+    ref = pd.concat(out, ignore_index=True)
+    return ref.sort_values(["carrier", "month", "origin", "dest"]).reset_index(drop=True)
+
+def _assert_matches(got, ref):
+    assert len(got) == len(ref)
+    for c in ("carrier", "month", "origin", "dest"):
+        assert (got[c].astype(str).to_numpy() == ref[c].astype(str).to_numpy()).all(), c
+    for c in ("pax", "yield_est", "avg_fare", "coverage"):
+        np.testing.assert_allclose(got[c].to_numpy(float), ref[c].to_numpy(float), rtol=RTOL, err_msg=c)
+    assert (got["confidence"].astype(str).to_numpy() == ref["confidence"].astype(str).to_numpy()).all()
+
+@pytest.fixture(scope="module")
+def reference(network):
+    return _reference(network)
+
+def test_fact_fares_matches_row_level_build(network, reference):
+    _assert_matches(labelled(network, "fact_fares"), reference)
+
+def test_chunking_does_not_move_totals(at_network, reference):
+    import db1b_ingest
+    import fact_store
+    mq = db1b_ingest._market_quarters(db1b_ingest.RAW / "DB1B_MARKET_2023.csv", None, chunksize=4_000)
+    out = db1b_ingest.monthly_fares(db1b_ingest._typed(mq), db1b_ingest.read_segments(None))
+    out = fact_store.schema.labels(out)
+    out["month"] = out["month"].astype(str)
+    _assert_matches(out.sort_values(["carrier", "month", "origin", "dest"]).reset_index(drop=True), reference)
@@ -0,0 +1,89 @@
+"""
+fact_flight_economics rolls up exactly to fact_route_economics
+- every segment row's flights (plus its unscheduled remainder) sum back to the row, for each
+  measure and bucket cost; tolerance rtol 1e-9 (within-row shares sum to 1 up to rounding)
+- the same holds for flights read from an On-Time Reporting file, which carries no
+  equipment (flights are dealt over the OD's fleets) and has cancelled and unknown flights
+- the input is partitioned by month in one pass: a month's spilled pieces are exactly the
+  flights a direct read of that month finds
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.conftest import labelled
+
+RTOL = 1e-9
+
+def _additive(econ):
+    import flights
+    from allocation import bucket_costs
+    return list(flights.MEASURES) + bucket_costs(econ) + ["total_cost"]
+
+def _assert_rolls_up(fl, econ):
+    import flights
+    cols = _additive(econ)
+    got = fl.groupby(flights.KEYS, observed=True)[cols].sum()
+    want = econ.set_index(flights.KEYS)[cols]
+    assert set(got.index) == set(want.index)          # no row lost, none invented
+    got = got.reindex(want.index)
+    for c in cols:
+        np.testing.assert_allclose(got[c].to_numpy(float), want[c].to_numpy(float), rtol=RTOL, atol=1e-6,
+                                   err_msg=c)
+
+def test_flight_table_rolls_up_to_segments(network):
+    econ = labelled(network, "fact_route_economics")
+    fl = labelled(network, "fact_flight_economics")
+    _assert_rolls_up(fl, econ)
+    # one scheduled flight is one departure (labelled() leaves unscheduled rows with day "")
+    sched = fl[fl["day"] != ""]
+    assert len(sched) and np.allclose(sched["departures"], 1.0)
+
+@pytest.fixture
+def on_time(at_network, tmp_path):
+    """One month of econ rows and an On-Time Reporting style file of its flights."""
+    import fact_store
+    import flights
+    econ = fact_store.read("fact_route_economics", months=[202307]).reset_index(drop=True)
+    parts = []
+    for _, part in econ.groupby(econ["carrier"].cat.codes):
+        part = part.reset_index(drop=True)
+        fl = flights.synthetic(part)
+        parts.append(pd.DataFrame({
+            "FL_DATE": [f"2023-07-{d:02d}" for d in fl["day"]],
+            "OP_UNIQUE_CARRIER": part["carrier"].astype(str).to_numpy()[fl["seg"]],
+            "OP_CARRIER_FL_NUM": fl["flight_no"],
+            "ORIGIN": part["origin"].astype(str).to_numpy()[fl["seg"]],
+            "DEST": part["dest"].astype(str).to_numpy()[fl["seg"]],
+            "CRS_DEP_TIME": fl["dep_time"],
+            "ACTUAL_ELAPSED_TIME": (fl["block_hours"] * 90).round(),
+            "CANCELLED": 0.0,
+        }))
+    df = pd.concat(parts, ignore_index=True)
+    odd = df.iloc[:2].copy()
+    odd["ORIGIN"] = "ZZZ"                              # an OD the segments do not have
+    gone = df.iloc[:3].assign(CANCELLED=1.0)
+    path = tmp_path / "On_Time_Reporting_2023_7.csv"
+    pd.concat([df, odd, gone], ignore_index=True).to_csv(path, index=False)
+    return econ, path, len(df)
+
+def test_on_time_flights_roll_up_to_segments(on_time):
+    import flights
+    from allocation import load_config
+    econ, path, n = on_time
+    fl = flights.read_flights([path], 202307)
+    assert len(fl) == n + 2                            # cancelled flights dropped
+    fl["seg"] = flights.match(fl, econ)
+    assert (fl["seg"] < 0).sum() == 2
+    out = flights.split(econ, fl, load_config())
+    assert out["day"].notna().sum() == n
+    _assert_rolls_up(out, econ)
+
+def test_spill_partitions_the_input_once(on_time, tmp_path):
+    import flights
+    econ, path, n = on_time
+    out = tmp_path / "spill"
+    assert flights.spill([path], out=out) == {202307}
+    got = flights.read_spilled(202307, out=out)
+    pd.testing.assert_frame_equal(got, flights.read_flights([path], 202307), check_dtype=False)
+    assert flights.read_spilled(202308, out=out).empty
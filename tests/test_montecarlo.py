@@ -0,0 +1,73 @@
+"""
+Monte Carlo margin bands against the deterministic allocation
+- with every range collapsed onto the configured weights (and no burn-rate or yield noise)
+  each draw is the allocation itself, so P10 = P50 = P90 = margin for any bucket setup
+"""
+import copy
+
+import numpy as np
+import pytest
+
+def _pinned(cfg):
+    """cfg with the uncertainty ranges pinned to the configured weights."""
+    cfg = copy.deepcopy(cfg)
+    w = lambda b, k: float(cfg[b]["weights"].get(k, 0.0))
+    cfg["uncertainty"] = {
+        "labor_block_hours": [w("labor", "block_hours")] * 2,
+        "maintenance_block_hours": [w("maintenance", "block_hours")] * 2,
+        "station_departures": [w("station_other", "departures")] * 2,
+        "burn_rate_cv": 0.0,
+        "yield_sigma": {"high": 0.0, "medium": 0.0, "low": 0.0, "missing": 0.0},
+    }
+    return cfg
+
+def _bands(cfg, months=(202307,)):
+    import montecarlo
+    from allocation import FARE_COLS, load_inputs
+    seg, fin, fares = load_inputs(list(months), None, fare_cols=FARE_COLS + ["confidence"])
+    return montecarlo.simulate(seg, fin, fares, cfg, draws=50)
+
+def _assert_deterministic(bands):
+    assert len(bands)
+    for c in ("margin_p10", "margin_p50", "margin_p90"):
+        np.testing.assert_allclose(bands[c], bands["margin_base"], rtol=1e-9, atol=1e-6, err_msg=c)
+
+@pytest.fixture
+def cfg(at_network):
+    from allocation import load_config
+    return _pinned(load_config())
+
+def test_pinned_ranges_reproduce_the_allocation(cfg):
+    _assert_deterministic(_bands(cfg))
+
+def test_fuel_driver_follows_config(cfg):
+    cfg["fuel"]["driver"] = "departures"
+    cfg["fuel"]["burn_rate_hr"] = {"B737-700": 500, "B737-800": 1500}    # B737-8 and 612: default
+    _assert_deterministic(_bands(cfg))
+
+def test_reconfigured_buckets_reproduce_the_allocation(cfg):
+    # labor on pax alone (its block-hours range no longer applies) and a landing bucket
+    # carved out of station_other
+    cfg["labor"]["weights"] = {"pax": 1.0}
+    cfg["station_other"]["expense"] = {"station_other": 0.7}
+    cfg["buckets"] = {"landing": {"expense": {"station_other": 0.3}, "weights": {"departures": 1.0}}}
+    _assert_deterministic(_bands(cfg))
+
+def test_weight_draws_follow_the_ranges(cfg):
+    import montecarlo
+    from allocation import compile_buckets
+    cfg["buckets"] = {"landing": {"expense": {"station_other": 0.3},
+                                  "weights": {"departures": 0.5, "ASMs": 0.5}}}
+    cfg["uncertainty"].update(labor_block_hours=[0.6, 0.8], landing_departures=[0.2, 0.4])
+    b = compile_buckets(cfg)
+    Wd = montecarlo.weight_draws(b, montecarlo.weight_ranges(b, cfg, cfg["uncertainty"]), 1000,
+                                 np.random.default_rng(0))
+    # every bucket keeps its total weight; only the ranged buckets move
+    np.testing.assert_allclose(Wd.sum(axis=1), np.broadcast_to(b.W.sum(axis=0), (1000, len(b.names))))
+    bh, dep, asm = (b.drivers.index(k) for k in ("block_hours", "departures", "ASMs"))
+    labor, landing, station = (b.names.index(k) for k in ("labor", "landing", "station_other"))
+    assert 0.6 <= Wd[:, bh, labor].min() < Wd[:, bh, labor].max() <= 0.8
+    np.testing.assert_allclose(Wd[:, dep, labor], 1 - Wd[:, bh, labor])
+    assert 0.2 <= Wd[:, dep, landing].min() < Wd[:, dep, landing].max() <= 0.4
+    np.testing.assert_allclose(Wd[:, asm, landing], 1 - Wd[:, dep, landing])
+    assert (Wd[:, :, station] == b.W[:, station]).all()      # pinned range: exactly the config
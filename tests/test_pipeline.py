@@ -0,0 +1,10 @@
+"""
+Pipeline fingerprints
+- run-mode flags (--append, --workers) change how stages run, not what they write: toggling
+  them on an up-to-date network re-runs nothing
+"""
+from tests.conftest import script
+
+def test_run_mode_flags_keep_stages_up_to_date(network):
+    out = script(network, "pipeline", "--carriers", "all", "--flights", "--append", "--workers", "2", "--dry-run")
+    assert "[pipeline] ran: -" in out, out
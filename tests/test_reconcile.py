@@ -0,0 +1,76 @@
+"""
+Allocation ties out to Form 41
+- each bucket's allocated cost per carrier-month sums to its share of the fact_financials
+  totals, and fact_reconciliation reports ~0 residual after spreading (rtol 1e-9)
+- residual drift is spread back pro rata to allocated cost (ASM share where a bucket
+  allocated nothing), leaving every carrier-month-bucket on its Form 41 total
+- the fuel burn diagnostic is in gallons on the allocation's own fuel driver
+"""
+import numpy as np
+import pytest
+
+from tests.conftest import labelled
+
+RTOL = 1e-9
+
+def _form41(fin, buckets, index):
+    f = fin.set_index(["carrier", "month"]).reindex(index)
+    return {cc: sum(frac * f[c].to_numpy(float) for c, frac in split.items())
+            for cc, split in buckets.values()}
+
+def _assert_ties_out(econ, fin, cfg):
+    import reconcile
+    b = reconcile.buckets(cfg)
+    got = econ.groupby(["carrier", "month"], observed=True)[[cc for cc, _ in b.values()]].sum()
+    for cc, want in _form41(fin, b, got.index).items():
+        np.testing.assert_allclose(got[cc].to_numpy(float), want, rtol=RTOL, err_msg=cc)
+    np.testing.assert_allclose(econ["total_cost"], econ[[cc for cc, _ in b.values()]].sum(axis=1), rtol=RTOL)
+
+@pytest.fixture
+def inputs(at_network):
+    import fact_store
+    from allocation import load_config
+    return (fact_store.read("fact_route_economics").reset_index(drop=True),
+            fact_store.read("fact_financials"), load_config())
+
+def test_allocation_ties_out_to_form41(inputs):
+    _assert_ties_out(*inputs)
+
+def test_reconciliation_report(network, inputs):
+    import reconcile
+    rep = labelled(network, "fact_reconciliation")
+    assert set(rep["bucket"]) == set(reconcile.buckets(inputs[2]))
+    np.testing.assert_allclose(rep["residual"], rep["form41_total"] - rep["allocated"], rtol=RTOL, atol=1e-6)
+    np.testing.assert_allclose(rep["reconciled"], rep["form41_total"], rtol=RTOL)
+    assert rep["within_tolerance"].all()
+
+def test_spread_puts_drift_back(inputs):
+    import reconcile
+    econ, fin, cfg = inputs
+    drift = econ.copy()
+    rng = np.random.default_rng(0)
+    drift["fuel_cost"] *= rng.uniform(0.9, 1.1, len(drift))
+    # a carrier-month whose station bucket allocated nothing: spread by ASM share
+    first = (drift["carrier"] == drift["carrier"].iloc[0]) & (drift["month"] == drift["month"].iloc[0])
+    drift.loc[first, "station_cost"] = 0.0
+
+    out, rep = reconcile.reconcile_frame(drift, fin, cfg)
+    assert (rep.loc[rep["bucket"] == "fuel", "residual"].abs() > 1.0).any()
+    _assert_ties_out(out, fin, cfg)
+    np.testing.assert_allclose(rep["reconciled"], rep["form41_total"], rtol=RTOL)
+    asm = drift.loc[first, "ASMs"].to_numpy(float)
+    np.testing.assert_allclose(out.loc[first, "station_cost"], out.loc[first, "station_cost"].sum() * asm / asm.sum(),
+                               rtol=RTOL)
+
+def test_fuel_burn_diagnostic_follows_the_fuel_driver(inputs):
+    import reconcile
+    from allocation import burn_rates
+    econ, fin, cfg = inputs
+    for driver in ("block_hours", "departures"):
+        cfg["fuel"]["driver"] = driver
+        rep = reconcile.tie_out(econ, fin, cfg)
+        fuel = rep[rep["bucket"] == "fuel"].set_index(["carrier", "month"])
+        gal = (econ[driver] * burn_rates(econ["fleet_type"], cfg) / cfg["fuel"]["kg_per_gallon"]) \
+            .groupby([econ["carrier"], econ["month"]], observed=True).sum()
+        np.testing.assert_allclose(fuel["model_burn"], gal.reindex(fuel.index), rtol=RTOL, err_msg=driver)
+        np.testing.assert_allclose(fuel["burn_scale"], fuel["fuel_gallons"] / fuel["model_burn"], rtol=RTOL)
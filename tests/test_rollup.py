@@ -0,0 +1,36 @@
+"""
+Rollup cube refresh
+- a carrier-month that leaves fact_route_economics loses its cells and its state entry;
+  the other carrier-months' cells are left alone
+"""
+import shutil
+
+import pytest
+
+from tests.conftest import inside
+
+@pytest.fixture
+def work(network, tmp_path):
+    """A scratch copy of the network's allocation and config, with its cube built."""
+    shutil.copytree(network / "data_work" / "fact_route_economics", tmp_path / "data_work" / "fact_route_economics")
+    shutil.copy(network / "allocation_config.yaml", tmp_path)
+    with inside(tmp_path):
+        import rollup
+        rollup.refresh()
+        yield tmp_path
+
+def test_removed_carrier_month_loses_its_cells(work):
+    import fact_store
+    import rollup
+    before = fact_store.partition_signatures("fact_rollup")
+    assert rollup.refresh() == []                          # up to date
+    c, m = gone = sorted(before)[0]
+    fact_store.drop("fact_route_economics", [gone])
+
+    assert rollup.orphans(carriers=["--"]) == []           # out of scope
+    assert rollup.orphans() == [gone]
+    rollup.refresh()
+    after = fact_store.partition_signatures("fact_rollup")
+    assert after == {k: s for k, s in before.items() if k != gone}
+    assert f"{c}/{m}" not in rollup._load_state()["partitions"]
+    assert rollup.orphans() == []
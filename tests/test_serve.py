@@ -0,0 +1,67 @@
+"""
+Query service error handling: every request gets a JSON answer, including ones that fail in
+ways the handlers do not anticipate
+"""
+import asyncio
+import json
+
+import pytest
+
+async def _get(reader, writer, raw):
+    writer.write(raw)
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    n = int(next(l.split(b":", 1)[1] for l in head.split(b"\r\n") if l.lower().startswith(b"content-length")))
+    return head.split(b"\r\n", 1)[0].decode(), json.loads(await reader.readexactly(n))
+
+def _serve(svc, talk):
+    async def main():
+        server = await asyncio.start_server(svc.client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                return await talk(reader, writer)
+            finally:
+                writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+    try:
+        return asyncio.run(main())
+    finally:
+        svc.pool.shutdown()
+
+@pytest.fixture
+def svc(at_network):
+    import serve
+    return serve.Service(poll=60)
+
+def test_unexpected_handler_error_is_a_json_500(svc, monkeypatch):
+    def broken(*a, **k):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(svc.store, "top", broken)
+
+    async def talk(reader, writer):
+        month = svc.store.arrays["month"][0]
+        first = await _get(reader, writer, f"GET /top?month={month} HTTP/1.1\r\n\r\n".encode())
+        then = await _get(reader, writer, b"GET /health HTTP/1.1\r\n\r\n")     # same connection
+        return first, then
+
+    (status, body), (status2, _) = _serve(svc, talk)
+    assert status == "HTTP/1.1 500 Internal Server Error" and "boom" in body["error"]
+    assert status2 == "HTTP/1.1 200 OK"
+
+def test_oversized_header_is_a_json_500(svc):
+    async def talk(reader, writer):
+        return await _get(reader, writer, b"GET /health HTTP/1.1\r\nX-Pad: " + b"x" * (1 << 17) + b"\r\n\r\n")
+
+    status, body = _serve(svc, talk)
+    assert status == "HTTP/1.1 500 Internal Server Error" and "LimitOverrun" in body["error"]
+
+def test_bad_parameters_stay_400(svc):
+    async def talk(reader, writer):
+        return await _get(reader, writer, b"GET /agg?by=planet HTTP/1.1\r\n\r\n")
+
+    status, body = _serve(svc, talk)
+    assert status == "HTTP/1.1 400 Bad Request" and "by must be one of" in body["error"]
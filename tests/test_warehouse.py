@@ -0,0 +1,51 @@
+"""
+Warehouse sync against the fact store (SQLite through the stdlib driver)
+- a carrier-month removed from the store is deleted from the warehouse on the next sync,
+  while a run limited to other months or carriers leaves it alone
+"""
+import shutil
+import sqlite3
+
+import pytest
+
+from tests.conftest import inside
+
+TABLE = "fact_route_economics"
+
+@pytest.fixture
+def store(network, tmp_path):
+    """A scratch copy of the network's fact store (the sync writes its load state there)."""
+    shutil.copytree(network / "data_work" / TABLE, tmp_path / "data_work" / TABLE)
+    with inside(tmp_path):
+        yield tmp_path
+
+def _target(root):
+    import warehouse
+    path = root / "warehouse.db"
+    return warehouse.Target(lambda: sqlite3.connect(path), "sqlite", "?", f"sqlite:///{path}")
+
+def _keys(db):
+    con = db.connect()
+    try:
+        return set(con.execute(f"SELECT DISTINCT carrier, month FROM {TABLE}").fetchall())
+    finally:
+        con.close()
+
+def test_removed_partition_is_deleted(store):
+    import fact_store
+    import warehouse
+    db = _target(store)
+    warehouse.sync(db, [TABLE])
+    stored = set(fact_store.partition_signatures(TABLE))
+    assert _keys(db) == stored
+
+    c, m = gone = sorted(stored)[0]
+    shutil.rmtree(store / "data_work" / TABLE / f"carrier={c}" / f"month={m}")
+    other = next(k for k in sorted(stored) if k[0] != c)
+    warehouse.sync(db, [TABLE], carriers=[other[0]])      # out of scope: kept
+    assert gone in _keys(db)
+
+    assert warehouse.sync(db, [TABLE]) == {TABLE: 0}
+    assert _keys(db) == stored - {gone}
+    assert f"{c}/{m}" not in warehouse._load_state()[db.key][TABLE]
+    assert warehouse.sync(db, [TABLE]) == {}              # nothing left to do